@@ -0,0 +1,225 @@
+import json
+import os
+import random
+import re
+import shutil
+import statistics
+import sys
+import time
+
+import numpy as np
+
+import simulated_annealing as sa
+import sta_runner
+from netlist import Netlist
+from perturb import SIZABLE_CELL_BASES, get_timing_info, perturb_netlist, perturb_sizes
+from sta_runner import collect_timing_data, export_gate_timing, invalidate_timing_index, load_sta_export, parse_timing_report, parse_tns, parse_wns
+from stub_opensta import StubSTA
+from telemetry import set_log_level
+
+# --- Configuration ---
+BENCH_DIR = "bench_work"            # Scaled inputs, stub reports and candidate netlists
+BASELINE_FILE = "bench_baseline.json"  # Saved results that later runs are compared against
+STUB_OPENSTA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_opensta.py")
+SCALES = (1, 10, 100)               # Netlist/report size multiples of the checked-in design
+REPEAT = 5                          # Timed runs per benchmark (after one warm-up run)
+TIME_BUDGET = 10.0                  # Seconds after which a benchmark stops repeating
+REGRESSION_TOLERANCE = 0.25         # Median slower than baseline by more than this fraction is flagged
+BENCH_SEED = 1
+
+# Local names that get a per-copy suffix when the netlist is scaled: _123_ wires/cells and escaped identifiers
+LOCAL_NAME = re.compile(r'(\\[^\s]+)(?=\s)|\b(_\d+_)|\b((?:FILLER|TAP|PHY|clkbuf|clkload|input|output)\w*)')
+
+# --- Scaled Inputs ---
+def _suffix_names(line, copy):
+    def rename(match):
+        return match.group(0) + f"c{copy}"
+    return LOCAL_NAME.sub(rename, line)
+
+def scale_netlist(verilog_path, factor, out_path):
+    """Write a netlist with the cells and wires of verilog_path repeated factor times.
+
+    Copies share the module ports and get suffixed instance and net names, so
+    the result parses like a flat netlist factor times the size.
+    """
+    with open(verilog_path, 'r') as f:
+        lines = f.readlines()
+    body_start = next(i for i, line in enumerate(lines) if line.lstrip().startswith("wire"))
+    body_end = max(i for i, line in enumerate(lines) if line.strip() == "endmodule")
+    header, body, footer = lines[:body_start], lines[body_start:body_end], lines[body_end:]
+    with open(out_path, 'w') as f:
+        f.writelines(header)
+        f.writelines(body)
+        for copy in range(1, factor):
+            f.writelines(_suffix_names(line, copy) for line in body)
+        f.writelines(footer)
+    return out_path
+
+def scale_report(report_path, factor, out_path):
+    """Write a path report holding the paths of report_path factor times, with suffixed instances."""
+    with open(report_path, 'r') as f:
+        text = f.read()
+    with open(out_path, 'w') as f:
+        f.write(text)
+        for copy in range(1, factor):
+            f.write(_suffix_names(text, copy))
+    return out_path
+
+# --- Measurement ---
+def measure(name, func, items=1):
+    """Run func once to warm up, then up to REPEAT times within TIME_BUDGET.
+
+    items is the work per call (e.g. instances), used for throughput.
+    Returns a result dict with latency statistics in ms.
+    """
+    func()
+    samples = []
+    start = time.perf_counter()
+    while len(samples) < REPEAT and (not samples or time.perf_counter() - start < TIME_BUDGET):
+        t0 = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - t0)
+    median = statistics.median(samples)
+    result = {
+        'name': name,
+        'runs': len(samples),
+        'median_ms': 1000.0 * median,
+        'mean_ms': 1000.0 * statistics.fmean(samples),
+        'min_ms': 1000.0 * min(samples),
+        'max_ms': 1000.0 * max(samples),
+        'items': items,
+        'items_per_s': items / median if median > 0 else float('inf'),
+    }
+    print(f"  {name:<40} {result['median_ms']:>10.3f} ms  (min {result['min_ms']:.3f}, max {result['max_ms']:.3f}, "
+          f"n={result['runs']})  {result['items_per_s']:>12.1f} items/s")
+    return result
+
+def configure_optimizer():
+    """Settings for a deterministic, quiet optimizer driven by the stub STA binary."""
+    set_log_level("quiet")
+    sta_runner.OPENSTA_CMD = STUB_OPENSTA
+    sa.MC_MODE = "batch"
+    sa.TIMING_BACKEND = "opensta"
+    sa.USE_EVAL_CACHE = False
+    sa.eval_cache = None
+    sa.timing_engine = None
+    sa.load_liberty_data()
+
+# --- Benchmarks ---
+def bench_scale(factor, baseline_netlist, baseline_report):
+    """All benchmarks on one netlist/report scale; returns their results."""
+    tag = f"x{factor}"
+    print(f"\n[Bench] Scale {tag}")
+    verilog_path = scale_netlist(baseline_netlist, factor, os.path.join(BENCH_DIR, f"design_{tag}.v"))
+    report_path = scale_report(baseline_report, factor, os.path.join(BENCH_DIR, f"timing_{tag}.txt"))
+    wns_path = os.path.join(BENCH_DIR, "wns.txt")
+    tns_path = os.path.join(BENCH_DIR, "tns.txt")
+    with open(wns_path, 'w') as f:
+        f.write("wns max -0.03\n")
+    with open(tns_path, 'w') as f:
+        f.write("tns max -0.31\n")
+    export_path = os.path.join(BENCH_DIR, f"sta_export_{tag}.csv")
+    with open(export_path, 'w') as f:
+        f.write("M,-0.03,-0.31\n")
+    StubSTA().export_paths(export_path, report_path)
+    os.environ["STUB_STA_TIMING_REPORT"] = os.path.abspath(report_path)
+
+    netlist = Netlist.from_verilog(verilog_path, SIZABLE_CELL_BASES)
+    instances = len(netlist.inst_names)
+    timing_data = collect_timing_data(-0.03, -0.31, report_path)
+    candidate_path = os.path.join(BENCH_DIR, f"candidate_{tag}.v")
+    results = []
+
+    def seeded(func):
+        def run():
+            np.random.seed(BENCH_SEED)
+            random.seed(BENCH_SEED)
+            return func()
+        return run
+
+    results.append(measure(f"parse_timing_report {tag}", lambda: parse_timing_report(report_path), factor))
+
+    def load_export():
+        invalidate_timing_index(export_path)  # Measure the load, not the cache
+        return export_gate_timing(load_sta_export(export_path))
+
+    results.append(measure(f"load_sta_export {tag}", load_export, factor))
+    results.append(measure(f"parse_wns+parse_tns {tag}", lambda: (parse_wns(wns_path), parse_tns(tns_path)), 2))
+    results.append(measure(f"netlist_parse {tag}", lambda: Netlist.from_verilog(verilog_path, SIZABLE_CELL_BASES), instances))
+    results.append(measure(f"calculate_area {tag}", lambda: sa.calculate_area(verilog_path), instances))
+    results.append(measure(f"get_timing_info {tag}", lambda: get_timing_info(
+        verilog_path, sa.DESIGN_NAME, sa.SDC_FILE, sa.LIB_FILE, sa.SPEF_FILE, timing_data=timing_data), instances))
+    results.append(measure(f"perturb_netlist {tag}", seeded(lambda: perturb_netlist(
+        verilog_path, candidate_path, timing_data=timing_data)), instances))
+    sizes = netlist.initial_sizes()
+    results.append(measure(f"perturb_sizes {tag}", seeded(lambda: perturb_sizes(netlist, sizes, timing_data)), len(sizes)))
+
+    # Cost evaluation and a full SA step through the stub STA binary (one-shot batch runs)
+    sa.derate_bank = sa.start_derate_bank(BENCH_SEED)
+    work_dir = os.path.join(BENCH_DIR, f"sta_{tag}")
+    results.append(measure(f"calculate_cost {tag}", lambda: sa.calculate_cost(
+        verilog_path, sa.DESIGN_NAME, sa.SDC_FILE, sa.LIB_FILE, sa.SPEF_FILE, work_dir=work_dir), sa.MC_TRIALS))
+    current_cost = sa.calculate_cost(verilog_path, sa.DESIGN_NAME, sa.SDC_FILE, sa.LIB_FILE, sa.SPEF_FILE, work_dir=work_dir)
+    current_timing = sa.last_timing_data
+    results.append(measure(f"sa_iteration {tag}", seeded(lambda: sa.anneal_step(
+        netlist, sizes, current_cost, sa.INIT_TEMP, candidate_path, work_dir=work_dir, current_timing=current_timing)), 1))
+    return results
+
+def compare(results, baseline, baseline_path=BASELINE_FILE):
+    """Print each result against its baseline; returns the names of regressions."""
+    regressions = []
+    print(f"\n[Bench] Comparison with {baseline_path}")
+    for result in results:
+        previous = baseline.get(result['name'])
+        if previous is None:
+            print(f"  {result['name']:<40} (no baseline)")
+            continue
+        ratio = result['median_ms'] / previous['median_ms'] if previous['median_ms'] > 0 else float('inf')
+        flag = ""
+        if ratio > 1.0 + REGRESSION_TOLERANCE:
+            flag = "  <-- REGRESSION"
+            regressions.append(result['name'])
+        print(f"  {result['name']:<40} {previous['median_ms']:>10.3f} -> {result['median_ms']:>10.3f} ms  ({ratio:.2f}x){flag}")
+    return regressions
+
+def run_benchmarks(scales=SCALES, save_baseline=False, baseline_path=BASELINE_FILE):
+    """Run the suite at every scale, compare with the saved baseline and optionally replace it.
+
+    Returns the number of regressions found.
+    """
+    os.makedirs(BENCH_DIR, exist_ok=True)
+    configure_optimizer()
+    results = []
+    for factor in scales:
+        results += bench_scale(factor, sa.BASELINE_NETLIST, "timing.txt")
+
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path, 'r') as f:
+            baseline = {r['name']: r for r in json.load(f)['results']}
+    regressions = compare(results, baseline, baseline_path) if baseline else []
+    if save_baseline:
+        with open(baseline_path, 'w') as f:
+            json.dump({'created': time.strftime("%Y-%m-%d %H:%M:%S"), 'python': sys.version.split()[0],
+                       'results': results}, f, indent=1)
+        print(f"[Bench] Baseline saved to {baseline_path}")
+    if regressions:
+        print(f"[Bench] {len(regressions)} regression(s) beyond {100 * REGRESSION_TOLERANCE:.0f}%: {', '.join(regressions)}")
+    return len(regressions)
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    # python3 benchmark.py [--scales=1,10,100] [--repeat=N] [--save-baseline] [--baseline=bench_baseline.json] [--clean]
+    scales = SCALES
+    baseline_path = BASELINE_FILE
+    for arg in sys.argv[1:]:
+        if arg.startswith("--scales="):
+            scales = tuple(int(s) for s in arg.split("=", 1)[1].split(","))
+        elif arg.startswith("--repeat="):
+            REPEAT = int(arg.split("=", 1)[1])
+        elif arg.startswith("--baseline="):
+            baseline_path = arg.split("=", 1)[1]
+    failures = run_benchmarks(scales, "--save-baseline" in sys.argv, baseline_path)
+    if "--clean" in sys.argv:
+        shutil.rmtree(BENCH_DIR, ignore_errors=True)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,42 @@
+import os
+import pickle
+
+CHECKPOINT_VERSION = 1  # Bump when the saved state layout changes so old checkpoints are not resumed
+
+def save_checkpoint(path, context_key, state):
+    """Write an optimizer state dict to path atomically.
+
+    The state is pickled to a temporary file that then replaces path, so a
+    crash while saving leaves the previous checkpoint intact. context_key
+    (see eval_cache.settings_key) ties the checkpoint to its inputs.
+    """
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'version': CHECKPOINT_VERSION, 'context': context_key, 'state': state}, f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return True
+    except (IOError, OSError, pickle.PicklingError) as e:
+        print(f"[Warning] Could not write checkpoint {path}: {e}")
+        return False
+
+def load_checkpoint(path, context_key):
+    """State dict saved by save_checkpoint(), or None if there is no usable checkpoint for this context."""
+    if not os.path.exists(path):
+        print(f"[Warning] Checkpoint {path} not found")
+        return None
+    try:
+        with open(path, 'rb') as f:
+            saved = pickle.load(f)
+    except (IOError, OSError, pickle.UnpicklingError, EOFError) as e:
+        print(f"[Warning] Could not read checkpoint {path}: {e}")
+        return None
+    if saved.get('version') != CHECKPOINT_VERSION:
+        print(f"[Warning] Checkpoint {path} has version {saved.get('version')}, expected {CHECKPOINT_VERSION}")
+        return None
+    if saved.get('context') != context_key:
+        print(f"[Warning] Checkpoint {path} was written for different input files or settings")
+        return None
+    return saved['state']
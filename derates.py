@@ -0,0 +1,142 @@
+from statistics import NormalDist
+
+import numpy as np
+
+# Ways to place the standard normal draws behind a set of derate samples
+SAMPLERS = ("random", "lhs", "sobol", "halton", "antithetic")
+
+_UNIT_EPS = 1e-12  # Keeps unit-cube points off 0 and 1, where the inverse normal is infinite
+
+def _inverse_normal(u):
+    """Standard normal quantiles of an array of points in (0, 1)."""
+    inv_cdf = NormalDist().inv_cdf
+    u = np.clip(u, _UNIT_EPS, 1.0 - _UNIT_EPS)
+    return np.array([inv_cdf(x) for x in u.ravel()]).reshape(u.shape)
+
+def _latin_hypercube(num_samples, dims, rng):
+    """One point per stratum of every axis, strata paired at random across axes."""
+    strata = np.stack([rng.permutation(num_samples) for _ in range(dims)], axis=1)
+    return (strata + rng.random((num_samples, dims))) / num_samples
+
+def _radical_inverse(indices, base):
+    """Van der Corput radical inverse of integer indices in a base."""
+    result = np.zeros(len(indices))
+    scale = 1.0 / base
+    indices = indices.copy()
+    while indices.any():
+        result += (indices % base) * scale
+        indices //= base
+        scale /= base
+    return result
+
+def _halton(num_samples, dims, rng):
+    """Halton points (bases 2, 3, 5, ...) under a random Cranley-Patterson shift."""
+    bases = (2, 3, 5, 7, 11, 13)[:dims]
+    indices = np.arange(1, num_samples + 1)
+    points = np.stack([_radical_inverse(indices, base) for base in bases], axis=1)
+    return (points + rng.random(dims)) % 1.0
+
+# Sobol direction numbers (s, a, m_1..m_s) of the primitive polynomials for dimensions 2..4
+_SOBOL_POLYNOMIALS = ((1, 0, (1,)), (2, 1, (1, 3)), (3, 1, (1, 3, 1)))
+_SOBOL_BITS = 30
+
+def _sobol_directions(dim):
+    """Direction numbers v_1..v_BITS of one Sobol dimension, scaled to _SOBOL_BITS-bit integers."""
+    if dim == 0:
+        return [1 << (_SOBOL_BITS - 1 - k) for k in range(_SOBOL_BITS)]
+    s, a, m = _SOBOL_POLYNOMIALS[dim - 1]
+    v = [m[k] << (_SOBOL_BITS - 1 - k) for k in range(s)]
+    for k in range(s, _SOBOL_BITS):
+        value = v[k - s] ^ (v[k - s] >> s)
+        for j in range(1, s):
+            if (a >> (s - 1 - j)) & 1:
+                value ^= v[k - j]
+        v.append(value)
+    return v
+
+def _sobol(num_samples, dims, rng):
+    """Sobol points in Gray-code order under a random digital shift."""
+    if dims > len(_SOBOL_POLYNOMIALS) + 1:
+        raise ValueError(f"Sobol sampling supports at most {len(_SOBOL_POLYNOMIALS) + 1} dimensions")
+    points = np.zeros((num_samples, dims))
+    for d in range(dims):
+        v = _sobol_directions(d)
+        x = int(rng.integers(0, 1 << _SOBOL_BITS))  # Digital shift, so every seed gives a different point set
+        for i in range(num_samples):
+            points[i, d] = x / float(1 << _SOBOL_BITS)
+            x ^= v[((i + 1) & -(i + 1)).bit_length() - 1]  # Lowest zero bit of i is the lowest set bit of i + 1
+    return points
+
+def standard_normal_samples(num_samples, dims, rng, sampler="random"):
+    """(num_samples, dims) standard normal draws placed by a sampler.
+
+    "random" draws them independently; "lhs", "sobol" and "halton" map
+    stratified or low-discrepancy points of the unit cube through the
+    inverse normal CDF; "antithetic" pairs each draw z with -z. All of them
+    take their randomness from rng, so a seeded rng gives a fixed sample set.
+    """
+    if sampler == "random":
+        return np.stack([rng.normal(size=num_samples) for _ in range(dims)], axis=1)
+    if sampler == "antithetic":
+        half = rng.normal(size=((num_samples + 1) // 2, dims))
+        return np.concatenate([half, -half])[:num_samples]
+    if sampler == "lhs":
+        return _inverse_normal(_latin_hypercube(num_samples, dims, rng))
+    if sampler == "sobol":
+        return _inverse_normal(_sobol(num_samples, dims, rng))
+    if sampler == "halton":
+        return _inverse_normal(_halton(num_samples, dims, rng))
+    raise ValueError(f"Unknown derate sampler '{sampler}', expected one of {', '.join(SAMPLERS)}")
+
+def draw_derate_arrays(num_samples, rng, mu=1.0, sigma_delay=0.02, sigma_check=0.02, sampler="random"):
+    """(cell_delay, cell_check) sample arrays from rng, clipped at 0.1 like sample_derate()."""
+    z = standard_normal_samples(num_samples, 2, rng, sampler)
+    return np.maximum(0.1, mu + sigma_delay * z[:, 0]), np.maximum(0.1, mu + sigma_check * z[:, 1])
+
+class DerateBank:
+    """A seeded, pre-generated set of (cell_delay, cell_check) derate samples.
+
+    Every evaluation draws its MC trials from the same bank, so the current
+    and candidate states are compared on common random numbers and the
+    difference of their costs is not swamped by sampling noise. The samples
+    of a generation depend only on (seed, generation): redraw() moves the bank
+    on, and any process given the same pair rebuilds identical samples.
+    sampler (see SAMPLERS) decides how the samples cover the distribution.
+    """
+
+    def __init__(self, num_samples, seed=None, mu=1.0, sigma_delay=0.02, sigma_check=0.02, sampler="random"):
+        if sampler not in SAMPLERS:
+            raise ValueError(f"Unknown derate sampler '{sampler}', expected one of {', '.join(SAMPLERS)}")
+        self.num_samples = num_samples
+        self.seed = seed if seed is not None else int(np.random.SeedSequence().entropy % (2 ** 32))
+        self.mu = mu
+        self.sigma_delay = sigma_delay
+        self.sigma_check = sigma_check
+        self.sampler = sampler
+        self.generation = None
+        self.redraw(0)
+
+    def redraw(self, generation=None):
+        """Switch to a generation (default: the next one). Returns True if the samples changed."""
+        if generation is None:
+            generation = self.generation + 1
+        if generation == self.generation:
+            return False
+        rng = np.random.default_rng([self.seed, generation])
+        self.delay, self.check = draw_derate_arrays(self.num_samples, rng, self.mu, self.sigma_delay,
+                                                    self.sigma_check, self.sampler)
+        self.generation = generation
+        return True
+
+    @property
+    def key(self):
+        """Identifies the current samples, e.g. to keep cached costs from different banks apart."""
+        return f"{self.sampler}:{self.seed}:{self.generation}"
+
+    def arrays(self):
+        """(cell_delay, cell_check) sample arrays for vectorized MC."""
+        return self.delay, self.check
+
+    def pairs(self):
+        """[(cell_delay, cell_check)] samples for batched or per-trial STA."""
+        return list(zip(self.delay.tolist(), self.check.tolist()))
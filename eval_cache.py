@@ -0,0 +1,125 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+from collections import OrderedDict
+
+from liberty import file_hash
+
+def settings_key(input_files, settings):
+    """Hash of the evaluation context: input file contents plus cost/derate settings.
+
+    input_files are paths (None entries are skipped); settings is a dict of
+    the parameters that change a cost. Any difference gives a different key,
+    so entries from other designs or parameter sweeps are never reused.
+    """
+    digest = hashlib.sha256()
+    for path in input_files:
+        if path and os.path.exists(path):
+            digest.update(f"{os.path.basename(path)}={file_hash(path)};".encode())
+    digest.update(repr(sorted(settings.items())).encode())
+    return digest.hexdigest()
+
+def sizing_key(sizes, variant=""):
+    """Canonical hash of a sizing state (an array('i') over the sizable instances).
+
+    variant separates evaluations of the same state that are not
+    interchangeable, e.g. costs taken on different derate banks.
+    """
+    digest = hashlib.sha256(sizes.tobytes())
+    digest.update(variant.encode())
+    return digest.hexdigest()
+
+def report_cache_stats(hits, misses):
+    """Print evaluation cache hit/miss counts."""
+    lookups = hits + misses
+    rate = 100.0 * hits / lookups if lookups else 0.0
+    print(f"[INFO] Evaluation cache: {hits} hits, {misses} misses ({rate:.1f}% hit rate)")
+
+class EvalCache:
+    """Cost evaluations keyed by sizing state, with an optional SQLite store.
+
+    Entries are (cost, timing_data) pairs. Lookups go to an in-memory LRU
+    first and then to the SQLite file, if one was given; the file outlives
+    the run and is shared by every run with the same settings_key.
+    """
+
+    def __init__(self, context_key, capacity=4096, db_path=None):
+        self.context_key = context_key
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.db = None
+        if db_path:
+            try:
+                self.db = sqlite3.connect(db_path, timeout=30.0)
+                self.db.execute("CREATE TABLE IF NOT EXISTS evaluations ("
+                                "context TEXT, sizing TEXT, cost REAL, timing BLOB, PRIMARY KEY (context, sizing))")
+                self.db.commit()
+            except sqlite3.Error as e:
+                print(f"[Warning] Could not open evaluation cache {db_path} ({e}), keeping it in memory only")
+                self.db = None
+
+    def get(self, sizes, variant=""):
+        """(cost, timing_data) of a previously evaluated sizing state, or None."""
+        key = sizing_key(sizes, variant)
+        entry = self.entries.get(key)
+        if entry is None and self.db is not None:
+            try:
+                row = self.db.execute("SELECT cost, timing FROM evaluations WHERE context = ? AND sizing = ?",
+                                      (self.context_key, key)).fetchone()
+            except sqlite3.Error as e:
+                print(f"[Warning] Evaluation cache lookup failed: {e}")
+                row = None
+            if row is not None:
+                entry = (row[0], pickle.loads(row[1]))
+                self._remember(key, entry)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, sizes, cost, timing_data, variant=""):
+        """Store the evaluation of a sizing state; failed evaluations (infinite cost) are not cached."""
+        if cost is None or cost == float('inf'):
+            return
+        if timing_data is not None:
+            # The report file is rewritten by the next STA run, only the parsed index stays valid
+            timing_data = dict(timing_data, timing_report=None)
+        key = sizing_key(sizes, variant)
+        self._remember(key, (cost, timing_data))
+        if self.db is not None:
+            try:
+                self.db.execute("INSERT OR REPLACE INTO evaluations VALUES (?, ?, ?, ?)",
+                                (self.context_key, key, cost, pickle.dumps(timing_data, pickle.HIGHEST_PROTOCOL)))
+                self.db.commit()
+            except sqlite3.Error as e:
+                print(f"[Warning] Could not store evaluation in cache: {e}")
+
+    def _remember(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def snapshot(self):
+        """In-memory entries and counters, for checkpointing a run."""
+        return {'entries': list(self.entries.items()), 'hits': self.hits, 'misses': self.misses}
+
+    def restore(self, snapshot):
+        """Reload entries and counters saved by snapshot(), in LRU order."""
+        self.entries = OrderedDict(snapshot['entries'])
+        self.hits = snapshot['hits']
+        self.misses = snapshot['misses']
+
+    def report(self):
+        """Print this cache's hit/miss counts."""
+        report_cache_stats(self.hits, self.misses)
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
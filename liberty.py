@@ -0,0 +1,318 @@
+import hashlib
+import os
+import pickle
+import re
+import sys
+import time
+
+import numpy as np
+
+from netlist import split_master
+
+# Tokens of a Liberty file: quoted strings, punctuation and bare words/numbers
+TOKEN_PATTERN = re.compile(r'"((?:[^"\\]|\\.)*)"|([(){}:;,])|([^\s(){}:;",]+)')
+COMMENT_PATTERN = re.compile(r'/\*.*?\*/|//[^\n]*', re.DOTALL)
+
+# Table variables, normalized so delay tables are (input slew, output load) and
+# constraint tables are (constrained pin slew, related pin slew)
+SLEW_VARIABLES = ("input_net_transition", "input_transition_time")
+LOAD_VARIABLES = ("total_output_net_capacitance",)
+CONSTRAINED_VARIABLES = ("constrained_pin_transition",)
+RELATED_VARIABLES = ("related_pin_transition",)
+
+TIME_UNITS = {"1ps": 1e-3, "10ps": 1e-2, "100ps": 0.1, "1ns": 1.0}  # Liberty time_unit -> ns
+
+LIBERTY_CACHE_DIR = ".liberty_cache"  # Compiled libraries, one pickle per liberty file content hash
+CACHE_VERSION = 1  # Bump when Library/Cell/Table change so stale caches are not loaded
+
+_loaded_libraries = {}  # Libraries already loaded by this process, keyed by cache path
+
+# --- Generic Group Parser ---
+class LibertyGroup:
+    """A Liberty group: type(args) { attributes; subgroups }."""
+    __slots__ = ("type", "args", "attrs", "groups")
+
+    def __init__(self, group_type, args):
+        self.type = group_type
+        self.args = args
+        self.attrs = {}   # Simple attributes (name : value) and complex attributes (name(values))
+        self.groups = []
+
+    def find(self, group_type):
+        """All direct subgroups of one type."""
+        return [g for g in self.groups if g.type == group_type]
+
+def _tokenize(text):
+    text = COMMENT_PATTERN.sub(" ", text.replace("\\\n", " "))
+    for string, punct, word in TOKEN_PATTERN.findall(text):
+        if punct:
+            yield punct
+        else:
+            # Quoted values are kept as ('"', value) so "0.1, 0.2" stays one token
+            yield ('"', string) if string or not word else word
+
+def parse_liberty(path):
+    """Parse a Liberty file into a tree of LibertyGroup; returns the library group."""
+    with open(path, 'r') as f:
+        tokens = list(_tokenize(f.read()))
+    root = LibertyGroup("root", [])
+    stack = [root]
+    pos = 0
+    while pos < len(tokens):
+        token = tokens[pos]
+        if token == "}":
+            stack.pop()
+            pos += 1
+            continue
+        if token == ";":
+            pos += 1
+            continue
+        name = token[1] if isinstance(token, tuple) else token
+        nxt = tokens[pos + 1] if pos + 1 < len(tokens) else None
+        if nxt == ":":
+            value = tokens[pos + 2]
+            stack[-1].attrs[name] = value[1] if isinstance(value, tuple) else value
+            pos += 3
+        elif nxt == "(":
+            args = []
+            pos += 2
+            while tokens[pos] != ")":
+                if tokens[pos] != ",":
+                    args.append(tokens[pos][1] if isinstance(tokens[pos], tuple) else tokens[pos])
+                pos += 1
+            pos += 1
+            if pos < len(tokens) and tokens[pos] == "{":
+                group = LibertyGroup(name, args)
+                stack[-1].groups.append(group)
+                stack.append(group)
+                pos += 1
+            else:
+                stack[-1].attrs[name] = args
+        else:
+            raise ValueError(f"Unexpected token {token!r} in {path}")
+    libraries = root.find("library")
+    if not libraries:
+        raise ValueError(f"No library group found in {path}")
+    return libraries[0]
+
+# --- NLDM Model ---
+def _floats(value):
+    """Parse a Liberty number list ("0.1, 0.2" or ["0.1, 0.2", ...]) into floats."""
+    if isinstance(value, list):
+        value = ",".join(value)
+    return [float(v) for v in value.replace("\\", " ").replace(",", " ").split()]
+
+class Table:
+    """A two-dimensional lookup table; index_1 and index_2 already normalized."""
+    __slots__ = ("index_1", "index_2", "values")
+
+    def __init__(self, index_1, index_2, values):
+        self.index_1 = np.asarray(index_1, dtype=float)
+        self.index_2 = np.asarray(index_2, dtype=float)
+        self.values = np.asarray(values, dtype=float).reshape(len(index_1), len(index_2))
+
+    def lookup(self, x1, x2):
+        """Bilinear interpolation with linear extrapolation, as STA tools do."""
+        return interpolate(self.index_1[None, :], self.index_2[None, :], self.values[None, :, :],
+                           np.array([len(self.index_1)]), np.array([len(self.index_2)]),
+                           np.array([x1], dtype=float), np.array([x2], dtype=float))[0]
+
+def interpolate(index_1, index_2, values, len_1, len_2, x1, x2):
+    """Vectorized bilinear lookup of row r of stacked tables at (x1[r], x2[r]).
+
+    Tables are padded to a common shape with +inf in unused index entries;
+    len_1/len_2 hold the real sizes (at least 2).
+    """
+    rows = np.arange(len(x1))
+    i = np.minimum(np.sum(index_1[:, 1:] <= x1[:, None], axis=1), len_1 - 2)
+    j = np.minimum(np.sum(index_2[:, 1:] <= x2[:, None], axis=1), len_2 - 2)
+    a0, a1 = index_1[rows, i], index_1[rows, i + 1]
+    b0, b1 = index_2[rows, j], index_2[rows, j + 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(a1 > a0, (x1 - a0) / (a1 - a0), 0.0)
+        u = np.where(b1 > b0, (x2 - b0) / (b1 - b0), 0.0)
+    v00 = values[rows, i, j]
+    v01 = values[rows, i, j + 1]
+    v10 = values[rows, i + 1, j]
+    v11 = values[rows, i + 1, j + 1]
+    return (1 - t) * (1 - u) * v00 + (1 - t) * u * v01 + t * (1 - u) * v10 + t * u * v11
+
+class TimingArc:
+    """One timing group of an output (or constrained) pin."""
+    __slots__ = ("pin", "related_pin", "timing_type", "timing_sense", "tables")
+
+    def __init__(self, pin, related_pin, timing_type, timing_sense, tables):
+        self.pin = pin
+        self.related_pin = related_pin
+        self.timing_type = timing_type
+        self.timing_sense = timing_sense
+        self.tables = tables  # {"cell_rise": Table, "rise_transition": Table, "rise_constraint": Table, ...}
+
+class Cell:
+    __slots__ = ("name", "area", "pin_caps", "pin_directions", "arcs")
+
+    def __init__(self, name, area):
+        self.name = name
+        self.area = area
+        self.pin_caps = {}        # Input pin -> capacitance in library units
+        self.pin_directions = {}  # Pin -> "input" / "output" / "inout"
+        self.arcs = []
+
+    def delay_arcs(self):
+        """Combinational and clock-to-output arcs."""
+        return [a for a in self.arcs if a.timing_type in ("combinational", "rising_edge", "falling_edge")]
+
+    def setup_arcs(self):
+        return [a for a in self.arcs if a.timing_type in ("setup_rising", "setup_falling")]
+
+class Library:
+    """The NLDM subset of a Liberty library needed by timing_engine.
+
+    Times are in ns. Capacitances stay in library units; cap_unit_pf gives
+    their size in pF for converting SPEF values.
+    """
+
+    def __init__(self, name, cells, time_scale=1.0, cap_unit_pf=1e-3):
+        self.name = name
+        self.cells = cells
+        self.time_scale = time_scale
+        self.cap_unit_pf = cap_unit_pf
+
+    def areas(self):
+        """{cell: area} for every cell."""
+        return {name: cell.area for name, cell in self.cells.items()}
+
+    def drive_families(self):
+        """{base: sorted drive sizes} for logic cells, e.g. {"NAND2_X": [1, 2, 4]}.
+
+        Physical-only cells (fillers, taps) have no output pin and are left out.
+        """
+        families = {}
+        for name, cell in self.cells.items():
+            base, size = split_master(name)
+            if size is not None and "output" in cell.pin_directions.values():
+                families.setdefault(base, []).append(size)
+        return {base: sorted(sizes) for base, sizes in families.items()}
+
+def _cap_unit_pf(library):
+    unit = library.attrs.get("capacitive_load_unit")
+    if not unit:
+        return 1e-3
+    scale = float(unit[0])
+    return scale * {"ff": 1e-3, "pf": 1.0}.get(unit[1].strip().lower(), 1e-3)
+
+def _read_table(group, templates, kind, time_scale):
+    template = templates.get(group.args[0] if group.args else "", {})
+    var_1, var_2 = template.get("variable_1"), template.get("variable_2")
+    values = np.asarray(_floats(group.attrs["values"]), dtype=float) * time_scale
+    if values.size == 1:
+        return Table([0.0, 1.0], [0.0, 1.0], [values[0]] * 4)
+    index_1 = _floats(group.attrs["index_1"]) if "index_1" in group.attrs else template.get("index_1", [0.0])
+    index_2 = [0.0]
+    if var_2 is not None:
+        index_2 = _floats(group.attrs["index_2"]) if "index_2" in group.attrs else template.get("index_2", [0.0])
+    values = values.reshape(len(index_1), len(index_2))
+    time_variables = SLEW_VARIABLES + CONSTRAINED_VARIABLES + RELATED_VARIABLES
+    if var_1 in time_variables:
+        index_1 = [x * time_scale for x in index_1]
+    if var_2 in time_variables:
+        index_2 = [x * time_scale for x in index_2]
+    second = LOAD_VARIABLES if kind == "delay" else RELATED_VARIABLES
+    if var_1 in second:
+        index_1, index_2, values = index_2, index_1, values.T
+    # Single-point axes become two identical rows/columns so every table is 2-D
+    if len(index_1) == 1:
+        index_1, values = [index_1[0], index_1[0] + 1.0], np.vstack([values, values])
+    if len(index_2) == 1:
+        index_2, values = [index_2[0], index_2[0] + 1.0], np.hstack([values, values])
+    return Table(index_1, index_2, values)
+
+def load_library(path):
+    """Parse a Liberty file into a Library."""
+    lib_group = parse_liberty(path)
+    time_scale = TIME_UNITS.get(str(lib_group.attrs.get("time_unit", "1ns")).strip(), 1.0)
+    templates = {}
+    for group in lib_group.find("lu_table_template"):
+        templates[group.args[0]] = {
+            "variable_1": group.attrs.get("variable_1"),
+            "variable_2": group.attrs.get("variable_2"),
+            "index_1": _floats(group.attrs["index_1"]) if "index_1" in group.attrs else [0.0],
+            "index_2": _floats(group.attrs["index_2"]) if "index_2" in group.attrs else [0.0],
+        }
+
+    cells = {}
+    for cell_group in lib_group.find("cell"):
+        cell = Cell(cell_group.args[0], float(cell_group.attrs.get("area", 0.0)))
+        for pin_group in cell_group.find("pin"):
+            pin = pin_group.args[0]
+            direction = pin_group.attrs.get("direction", "input")
+            cell.pin_directions[pin] = direction
+            if direction != "output":
+                caps = [float(pin_group.attrs[a]) for a in ("capacitance", "rise_capacitance", "fall_capacitance")
+                        if a in pin_group.attrs]
+                cell.pin_caps[pin] = max(caps) if caps else 0.0
+            for timing in pin_group.find("timing"):
+                timing_type = timing.attrs.get("timing_type", "combinational")
+                kind = "constraint" if timing_type.startswith(("setup", "hold")) else "delay"
+                tables = {g.type: _read_table(g, templates, kind, time_scale) for g in timing.groups
+                          if g.type in ("cell_rise", "cell_fall", "rise_transition", "fall_transition",
+                                        "rise_constraint", "fall_constraint")}
+                for related in str(timing.attrs.get("related_pin", "")).split():
+                    cell.arcs.append(TimingArc(pin, related, timing_type,
+                                               timing.attrs.get("timing_sense", "non_unate"), tables))
+        cells[cell.name] = cell
+    return Library(lib_group.args[0] if lib_group.args else path, cells, time_scale, _cap_unit_pf(lib_group))
+
+# --- Compiled Cache ---
+def file_hash(path):
+    """SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_library_cached(path, cache_dir=LIBERTY_CACHE_DIR):
+    """load_library() through an on-disk pickle keyed by the file's content hash.
+
+    A changed .lib gets a new key, so the cache never needs invalidating;
+    an unreadable cache entry is simply rebuilt.
+    """
+    start = time.time()
+    key = file_hash(path)[:16]
+    cache_path = os.path.join(cache_dir, f"{os.path.basename(path)}-{key}-v{CACHE_VERSION}.pkl")
+    if cache_path in _loaded_libraries:
+        return _loaded_libraries[cache_path]
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                library = pickle.load(f)
+            print(f"[INFO] Loaded compiled liberty {cache_path} in {1000.0 * (time.time() - start):.1f} ms")
+            _loaded_libraries[cache_path] = library
+            return library
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+            print(f"[Warning] Ignoring unreadable liberty cache {cache_path}: {e}")
+
+    library = _loaded_libraries[cache_path] = load_library(path)
+    print(f"[INFO] Parsed liberty {path} in {1000.0 * (time.time() - start):.1f} ms")
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(library, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"[Warning] Could not write liberty cache {cache_path}: {e}")
+    return library
+
+# --- Standalone Test Block ---
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python3 liberty.py <library.lib>")
+        sys.exit(1)
+    library = load_library_cached(sys.argv[1])
+    print(f"[INFO] Library {library.name}: {len(library.cells)} cells, cap unit {library.cap_unit_pf} pF")
+    for name in sorted(library.cells)[:10]:
+        cell = library.cells[name]
+        print(f"  {name}: area {cell.area}, inputs {sorted(cell.pin_caps)}, {len(cell.delay_arcs())} delay arcs, "
+              f"{len(cell.setup_arcs())} setup arcs")
@@ -0,0 +1,159 @@
+import re
+from array import array
+
+from profiling import timed
+
+# "<MASTER> <instance> (" at the start of a cell instantiation; escaped names run to the next whitespace
+INSTANCE_HEADER = re.compile(r'^(\s*)([A-Za-z_]\w*)(\s+)(\\\S+|[A-Za-z_][\w$]*)(\s*\(.*)$', re.DOTALL)
+# ".PIN(net)" connections, including escaped and bus-bit nets and unconnected pins
+PIN_PATTERN = re.compile(r'\.(\w+)\s*\(\s*(\\\S+|[^()\s]*)\s*\)')
+# "input [31:0] a, b;" port declarations
+PORT_DECLARATION = re.compile(r'^\s*(input|output)\s*(?:\[(\d+):(\d+)\])?\s*([^;]+);')
+# Drive-strength suffix of a master, e.g. NAND2_X4 -> ("NAND2_X", 4)
+SIZED_MASTER = re.compile(r'([A-Z0-9_]+?X)(\d+)')
+
+def instance_key(instance_name):
+    """Name of an instance as STA reports print it (escaped identifiers lose the backslash)."""
+    return instance_name[1:] if instance_name.startswith('\\') else instance_name
+
+def split_master(master):
+    """Split a master into (base, size), or (master, None) if it has no drive suffix."""
+    match = SIZED_MASTER.fullmatch(master)
+    if match:
+        return match.group(1), int(match.group(2))
+    return master, None
+
+class Netlist:
+    """A flat gate-level netlist parsed once from Verilog.
+
+    Instances, masters and pin connections are kept in parallel lists with
+    CSR-style pin offsets. The sizing state of a design is an array('i') of
+    drive sizes with one entry per sizable instance, so copying a state is an
+    array copy and Verilog is only produced by write_verilog().
+    """
+    __slots__ = ("lines", "inst_names", "inst_masters", "inst_lines",
+                 "pin_offsets", "pin_names", "pin_nets",
+                 "input_ports", "output_ports",
+                 "sizable", "sizable_bases", "base_sizes", "_heads", "_tails")
+
+    def __init__(self, lines, sizable_bases=None):
+        self.lines = lines
+        self.inst_names = []
+        self.inst_masters = []
+        self.inst_lines = array('i')
+        self.pin_offsets = array('i', [0])
+        self.pin_names = []
+        self.pin_nets = []
+        self.input_ports = []            # Port bits, e.g. "req_msg[3]"
+        self.output_ports = []
+        self.sizable = array('i')        # Instance index of each sizable instance
+        self.sizable_bases = []          # Master base ("NAND2_X") of each sizable instance
+        self.base_sizes = array('i')     # Drive size of each sizable instance in the parsed netlist
+        self._heads = []                 # Header-line text before the master
+        self._tails = []                 # Header-line text after the master
+        self._parse(sizable_bases)
+
+    @classmethod
+    def from_verilog(cls, verilog_path, sizable_bases=None):
+        """Parse a Verilog netlist; sizable_bases restricts which masters may be resized."""
+        with open(verilog_path, 'r') as f:
+            return cls(f.readlines(), sizable_bases)
+
+    def _parse(self, sizable_bases):
+        statement = None
+        for line_num, line in enumerate(self.lines):
+            if statement is None:
+                port = PORT_DECLARATION.match(line)
+                if port:
+                    self._add_ports(*port.groups())
+                    continue
+                match = INSTANCE_HEADER.match(line)
+                if not match or match.group(2) in ("module", "endmodule"):
+                    continue
+                indent, master, gap, name, rest = match.groups()
+                inst = len(self.inst_names)
+                self.inst_names.append(name)
+                self.inst_masters.append(master)
+                self.inst_lines.append(line_num)
+                base, size = split_master(master)
+                if size is not None and (sizable_bases is None or base in sizable_bases):
+                    self.sizable.append(inst)
+                    self.sizable_bases.append(base)
+                    self.base_sizes.append(size)
+                    self._heads.append(indent)
+                    self._tails.append(gap + name + rest)
+                statement = rest
+            else:
+                statement += line
+            if ";" in line:
+                for pin, net in PIN_PATTERN.findall(statement):
+                    self.pin_names.append(pin)
+                    self.pin_nets.append(net)
+                self.pin_offsets.append(len(self.pin_names))
+                statement = None
+
+    def _add_ports(self, direction, msb, lsb, names):
+        ports = self.input_ports if direction == "input" else self.output_ports
+        for name in names.split(","):
+            name = name.strip()
+            if msb is None:
+                ports.append(name)
+            else:
+                step = -1 if int(msb) >= int(lsb) else 1
+                ports.extend(f"{name}[{bit}]" for bit in range(int(msb), int(lsb) + step, step))
+
+    # --- Sizing state ---
+    def initial_sizes(self):
+        """Sizing state of the parsed netlist."""
+        return array('i', self.base_sizes)
+
+    def master_of(self, k, sizes):
+        """Master of sizable instance k under a sizing state."""
+        return f"{self.sizable_bases[k]}{sizes[k]}"
+
+    def sizable_masters(self, sizes):
+        """[(instance_name, master)] of every sizable instance under a sizing state."""
+        return [(self.inst_names[self.sizable[k]], self.master_of(k, sizes)) for k in range(len(sizes))]
+
+    def sizing_changes(self, sizes, new_sizes):
+        """[(instance_name, old_master, new_master)] turning one sizing state into another."""
+        return [(self.inst_names[self.sizable[k]], self.master_of(k, sizes), self.master_of(k, new_sizes))
+                for k in range(len(sizes)) if sizes[k] != new_sizes[k]]
+
+    def pins(self, inst):
+        """[(pin, net)] connections of an instance."""
+        start, end = self.pin_offsets[inst], self.pin_offsets[inst + 1]
+        return list(zip(self.pin_names[start:end], self.pin_nets[start:end]))
+
+    def sized_lines(self, sizes):
+        """Verilog lines with a sizing state applied; only resized header lines are rebuilt."""
+        lines = self.lines
+        changed = [k for k in range(len(sizes)) if sizes[k] != self.base_sizes[k]]
+        if changed:
+            lines = list(lines)
+            for k in changed:
+                lines[self.inst_lines[self.sizable[k]]] = f"{self._heads[k]}{self.master_of(k, sizes)}{self._tails[k]}"
+        return lines
+
+    @timed("netlist.write_verilog")
+    def write_verilog(self, path, sizes):
+        """Write the netlist with a sizing state applied."""
+        with open(path, 'w') as f:
+            f.writelines(self.sized_lines(sizes))
+        return path
+
+    def resized(self, sizes):
+        """The Netlist that parsing write_verilog(path, sizes) would give, without parsing.
+
+        Connectivity is shared with this netlist; the sizing state becomes
+        the new netlist's initial_sizes().
+        """
+        netlist = Netlist.__new__(Netlist)
+        for slot in Netlist.__slots__:
+            setattr(netlist, slot, getattr(self, slot))
+        netlist.lines = self.sized_lines(sizes)
+        netlist.inst_masters = list(self.inst_masters)
+        for k in range(len(sizes)):
+            netlist.inst_masters[self.sizable[k]] = self.master_of(k, sizes)
+        netlist.base_sizes = array('i', sizes)
+        return netlist
@@ -0,0 +1,253 @@
+import os
+import math
+import random
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+import simulated_annealing as sa
+from eval_cache import report_cache_stats
+from netlist import Netlist
+from perturb import SIZABLE_CELL_BASES, init_net_loads
+from sta_backend import open_sta_backend
+
+# --- Configuration ---
+PT_REPLICAS = 4             # Number of chains, one per temperature and worker process
+PT_T_MIN = sa.FINAL_TEMP    # Coldest replica temperature
+PT_T_MAX = sa.INIT_TEMP     # Hottest replica temperature
+PT_ROUNDS = 50              # Number of exchange rounds
+PT_STEPS_PER_ROUND = 4      # Metropolis steps each replica runs between exchanges
+PT_SEED = None              # Set to an int for a reproducible run
+PT_WORK_DIR = "pt_work"     # Per-replica candidate netlists and per-worker STA scratch files live here
+PT_BEST_NETLIST = "pt_best.v"  # Global best over all replicas
+
+_netlist = None  # Baseline Netlist model, parsed once per process
+
+# --- Helpers ---
+def temperature_ladder(num_replicas, t_min=PT_T_MIN, t_max=PT_T_MAX):
+    """Geometrically spaced temperatures from t_min (replica 0) to t_max."""
+    if num_replicas == 1:
+        return [t_min]
+    ratio = (t_max / t_min) ** (1.0 / (num_replicas - 1))
+    return [t_min * ratio ** k for k in range(num_replicas)]
+
+def replica_dir(replica):
+    """Scratch directory holding one replica's candidate netlist and STA files."""
+    return os.path.join(PT_WORK_DIR, f"replica_{replica}")
+
+def exchange_probability(temp_a, temp_b, cost_a, cost_b):
+    """Probability of swapping the states of two replicas (replica-exchange criterion)."""
+    exponent = (1.0 / temp_a - 1.0 / temp_b) * (cost_a - cost_b)
+    if exponent >= 0:
+        return 1.0
+    return math.exp(max(exponent, -700.0))
+
+# --- Worker Process ---
+def _init_replica_worker(derate_seed=None):
+    """Give each pool process the netlist model, its own scratch directory and its own STA backend.
+
+    derate_seed is the master's derate bank seed, so all replicas share the same samples.
+    """
+    global _netlist
+    sa.set_log_level(sa.LOG_LEVEL)
+    sa.load_liberty_data()
+    init_net_loads(sa.SPEF_FILE)
+    _netlist = Netlist.from_verilog(sa.BASELINE_NETLIST, SIZABLE_CELL_BASES)
+    work_dir = os.path.join(PT_WORK_DIR, f"worker_{os.getpid()}")
+    os.makedirs(work_dir, exist_ok=True)
+    # Replicas already occupy the cores; nested MC process pools would only oversubscribe them
+    if sa.MC_MODE == "parallel":
+        sa.MC_MODE = "batch"
+    if sa.TIMING_BACKEND == "engine":
+        sa.timing_engine = sa.start_timing_engine(_netlist)
+    if sa.timing_engine is None:
+        sa.sta_backend = open_sta_backend(sa.STA_BACKEND, sa.BASELINE_NETLIST, sa.DESIGN_NAME, sa.SDC_FILE, sa.LIB_FILE,
+                                          sa.SPEF_FILE, work_dir=work_dir)
+    sa.eval_cache = sa.start_eval_cache()
+    sa.derate_bank = sa.start_derate_bank(derate_seed)
+
+def _run_replica_segment(args):
+    """Run a fixed-temperature Metropolis segment on one replica.
+
+    States travel between processes as sizing vectors. generation selects
+    the derate bank samples; with refresh set the bank moved on since the
+    replica's costs were taken, so the current and best states are
+    re-evaluated first.
+    Returns (replica,
+    sizes, current_cost, current_timing, best_sizes, best_cost, accepted_moves,
+    cache_stats) with cache_stats the (hits, misses) of this segment.
+    """
+    replica, temp, sizes, current_cost, current_timing, best_sizes, best_cost, steps, seed, generation, refresh = args
+    random.seed(seed)
+    np.random.seed(seed % (2 ** 32))
+    work_dir = replica_dir(replica)
+    candidate_path = os.path.join(work_dir, "candidate.v")
+    # The worker's backend last held another replica's state; bring it to this one
+    if sa.sta_backend is not None:
+        sa.sta_backend.sync_masters(_netlist.sizable_masters(sizes))
+    if sa.derate_bank is not None:
+        sa.derate_bank.redraw(generation)
+        if refresh:
+            current_cost, current_timing = sa.evaluate_current(_netlist, sizes, os.path.join(work_dir, "current.v"), work_dir)
+            # The best cost was taken on an older bank; compare both states on the new samples
+            best_cost = current_cost if list(best_sizes) == list(sizes) else sa.evaluate_current(
+                _netlist, best_sizes, os.path.join(work_dir, "best.v"), work_dir, linked_sizes=sizes)[0]
+            if current_cost < best_cost:
+                best_cost = current_cost
+                best_sizes = sizes
+
+    cache_start = (sa.eval_cache.hits, sa.eval_cache.misses) if sa.eval_cache is not None else (0, 0)
+    accepted_moves = 0
+    for step in range(steps):
+        sa.log(f"\n[Replica {replica} | T = {temp:.4f}] Step {step + 1}/{steps}")
+        accepted, candidate_cost, candidate_timing, sizes = sa.anneal_step(
+            _netlist, sizes, current_cost, temp, candidate_path, work_dir=work_dir, current_timing=current_timing)
+        if not accepted:
+            continue
+        accepted_moves += 1
+        current_cost = candidate_cost
+        current_timing = candidate_timing
+        if current_cost < best_cost:
+            best_cost = current_cost
+            best_sizes = sizes
+    cache_stats = (sa.eval_cache.hits - cache_start[0], sa.eval_cache.misses - cache_start[1]) if sa.eval_cache is not None else (0, 0)
+    return replica, sizes, current_cost, current_timing, best_sizes, best_cost, accepted_moves, cache_stats
+
+# --- Parallel Tempering Main Loop ---
+def parallel_tempering(num_replicas=PT_REPLICAS, rounds=PT_ROUNDS, steps_per_round=PT_STEPS_PER_ROUND):
+    """Runs replica-exchange simulated annealing with one process per temperature."""
+    sa.set_log_level(sa.LOG_LEVEL)
+    if PT_SEED is not None:
+        random.seed(PT_SEED)
+    temps = temperature_ladder(num_replicas)
+    print(f"[PT Init] {num_replicas} replicas at temperatures: {', '.join(f'{t:.4f}' for t in temps)}")
+
+    essential_files = [sa.BASELINE_NETLIST, sa.SDC_FILE, sa.LIB_FILE]
+    if sa.SPEF_FILE: essential_files.append(sa.SPEF_FILE)
+    for f in essential_files:
+        if not os.path.exists(f):
+            print(f"[FATAL ERROR] Required file not found: {f}. Exiting.")
+            sys.exit(1)
+
+    # Every replica starts from the baseline sizing
+    if os.path.exists(PT_WORK_DIR):
+        shutil.rmtree(PT_WORK_DIR)
+    for replica in range(num_replicas):
+        os.makedirs(replica_dir(replica))
+    sa.load_liberty_data()
+    init_net_loads(sa.SPEF_FILE)
+    netlist = Netlist.from_verilog(sa.BASELINE_NETLIST, SIZABLE_CELL_BASES)
+
+    print("[PT Init] Calculating initial cost...")
+    if sa.TIMING_BACKEND == "engine":
+        sa.timing_engine = sa.start_timing_engine(netlist)
+    # The initial cost comes from the same STA backend the replicas evaluate with
+    if sa.timing_engine is None:
+        sa.sta_backend = open_sta_backend(sa.STA_BACKEND, sa.BASELINE_NETLIST, sa.DESIGN_NAME, sa.SDC_FILE, sa.LIB_FILE,
+                                          sa.SPEF_FILE, work_dir=PT_WORK_DIR)
+        if sa.sta_backend is None:
+            print("[FATAL ERROR] No STA backend available. Exiting.")
+            sys.exit(1)
+        if sa.STA_BACKEND == "standin" and sa.MC_MODE == "parallel":
+            sa.MC_MODE = "batch"  # The stand-in runs in this process; a pool would launch OpenSTA instead
+    sa.derate_bank = sa.start_derate_bank()
+    initial_cost = sa.calculate_cost(sa.BASELINE_NETLIST, sa.DESIGN_NAME, sa.SDC_FILE, sa.LIB_FILE, sa.SPEF_FILE,
+                                     work_dir=PT_WORK_DIR)
+    # Each replica worker opens its own backend; the master's is only needed for the baseline
+    if sa.sta_backend is not None:
+        sa.sta_backend.close()
+        sa.sta_backend = None
+    if initial_cost == float('inf'):
+        print("[FATAL ERROR] Initial baseline netlist failed STA. Cannot proceed. Check baseline files and setup.")
+        sys.exit(1)
+
+    sizes = [netlist.initial_sizes() for _ in range(num_replicas)]
+    costs = [initial_cost] * num_replicas
+    timings = [sa.last_timing_data] * num_replicas
+    best_sizes = list(sizes)
+    best_costs = [initial_cost] * num_replicas
+    global_best = initial_cost
+    global_best_sizes = netlist.initial_sizes()
+    history = [[] for _ in range(num_replicas)]
+    swaps_tried = [0] * (num_replicas - 1)
+    swaps_done = [0] * (num_replicas - 1)
+    cache_hits = cache_misses = 0
+    generation = 0
+
+    derate_seed = sa.derate_bank.seed if sa.derate_bank is not None else None
+    with ProcessPoolExecutor(max_workers=num_replicas, initializer=_init_replica_worker, initargs=(derate_seed,)) as pool:
+        for round_idx in range(rounds):
+            # All replicas share one derate bank generation per round, so exchanges compare costs on common samples
+            previous_generation = generation
+            if sa.DERATE_REFRESH_STEPS:
+                generation = round_idx * steps_per_round // sa.DERATE_REFRESH_STEPS
+            jobs = [(k, temps[k], sizes[k], costs[k], timings[k], best_sizes[k], best_costs[k], steps_per_round,
+                     random.randrange(2 ** 32), generation, generation != previous_generation) for k in range(num_replicas)]
+            for replica, replica_sizes, current_cost, current_timing, best, best_cost, _, cache_stats in pool.map(_run_replica_segment, jobs):
+                cache_hits += cache_stats[0]
+                cache_misses += cache_stats[1]
+                sizes[replica] = replica_sizes
+                costs[replica] = current_cost
+                timings[replica] = current_timing
+                best_sizes[replica] = best
+                best_costs[replica] = best_cost
+                history[replica].append(current_cost)
+
+            # Share the global best across chains; after a bank refresh only the replicas' re-evaluated bests compare
+            best_replica = min(range(num_replicas), key=lambda k: best_costs[k])
+            if best_costs[best_replica] < global_best or generation != previous_generation:
+                if best_costs[best_replica] < global_best:
+                    print(f"[PT Round {round_idx + 1}] 🚀 New global best {best_costs[best_replica]:.6f} from replica {best_replica}")
+                global_best = best_costs[best_replica]
+                global_best_sizes = best_sizes[best_replica]
+
+            # Exchange states between neighbouring temperatures, alternating even and odd pairs
+            for k in range(round_idx % 2, num_replicas - 1, 2):
+                swaps_tried[k] += 1
+                if random.random() < exchange_probability(temps[k], temps[k + 1], costs[k], costs[k + 1]):
+                    sizes[k], sizes[k + 1] = sizes[k + 1], sizes[k]
+                    costs[k], costs[k + 1] = costs[k + 1], costs[k]
+                    timings[k], timings[k + 1] = timings[k + 1], timings[k]
+                    swaps_done[k] += 1
+
+            print(f"[PT Round {round_idx + 1}/{rounds}] Costs: {', '.join(f'{c:.4f}' for c in costs)} | Global best = {global_best:.6f}")
+
+    netlist.write_verilog(PT_BEST_NETLIST, global_best_sizes)
+    print(f"\n[PT Done] Parallel Tempering Finished.")
+    print(f"  Rounds = {rounds}, Steps per round = {steps_per_round}, Replicas = {num_replicas}")
+    for k in range(num_replicas - 1):
+        rate = swaps_done[k] / swaps_tried[k] if swaps_tried[k] else 0.0
+        print(f"  Swap acceptance T{k}<->T{k + 1}: {swaps_done[k]}/{swaps_tried[k]} ({100.0 * rate:.1f}%)")
+    print(f"  Best Cost Found = {global_best:.6f}")
+    print(f"  Best netlist saved to: {PT_BEST_NETLIST}")
+    if sa.USE_EVAL_CACHE:
+        report_cache_stats(cache_hits, cache_misses)
+
+    # Save per-replica cost curves in 'results' folder
+    for k in range(num_replicas):
+        plt.plot(history[k], label=f"T={temps[k]:.3f}")
+    plt.xlabel("Exchange Round")
+    plt.ylabel("Cost")
+    plt.title("Parallel Tempering Cost per Replica")
+    plt.legend()
+    plt.grid(True)
+    plt.tight_layout()
+    results_dir = "results"
+    if not os.path.exists(results_dir):
+        os.makedirs(results_dir)
+    plot_path = os.path.join(results_dir, f"pt_cost_curve_REPLICAS-{num_replicas}_ROUNDS-{rounds}_STEPS-{steps_per_round}.png")
+    plt.savefig(plot_path)
+    print(f"Saved cost plot as {plot_path}")
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    # python3 parallel_tempering.py [replicas] [--log-level=quiet|info|debug]
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    for arg in sys.argv[1:]:
+        if arg.startswith("--log-level="):
+            sa.LOG_LEVEL = arg.split("=", 1)[1]
+    replicas = int(args[0]) if args else PT_REPLICAS
+    parallel_tempering(num_replicas=replicas)
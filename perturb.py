@@ -1,12 +1,18 @@
 import random
-import re
 import sys
 import time
 import os # For diff command in test
 import subprocess
 import json
+from array import array
 from collections import defaultdict
-from sta_runner import run_sta, generate_derate, parse_timing_report
+from netlist import Netlist, instance_key
+import sta_runner
+from sta_runner import run_sta, generate_derate, load_timing_index
+from liberty import load_library_cached
+from spef import load_spef
+from telemetry import log, set_log_level
+from profiling import phase, timed
 
 # --- Configuration ---
 
@@ -62,153 +68,265 @@ SIZING_TARGETS_PER_CELL = {
 # This controls how likely a potential modification actually happens.
 PROB_APPLY_SIZE_CHANGE = 0.95 # High chance to apply change once identified & within limit
 
+# Top-scored candidate resizes whose effect is measured with a what-if STA evaluation
+# (apply, time, undo) when the STA backend holds the design; 0 ranks moves by score only
+WHAT_IF_CANDIDATES = 16
+WNS_COST_WEIGHT = 10.0  # Weight of WNS against TNS in the timing cost (SA cost and what-if gains)
+
 SIZABLE_CELL_BASES = set(SIZING_TARGETS_PER_CELL.keys())
 
-REGEX_PATTERN_TEMPLATE = r'([A-Z0-9_]+?)({suffix})(\d+)(\s+)([a-zA-Z_]\w*)(\s*\()'
 CELL_SUFFIX = "X"
 
 EXISTING_SIZES = set(sz for targets in SIZING_TARGETS_PER_CELL.values() for sz in targets.keys())
 ALL_TARGET_SIZES = set(tsz for targets in SIZING_TARGETS_PER_CELL.values() for sz_targets in targets.values() for tsz in sz_targets)
 ALL_KNOWN_SIZES = sorted(list(EXISTING_SIZES.union(ALL_TARGET_SIZES)))
 
-REGEX_PATTERNS = {}
-for size in ALL_KNOWN_SIZES:
-     pattern_string = REGEX_PATTERN_TEMPLATE.format(suffix=re.escape(CELL_SUFFIX), size=size)
-     REGEX_PATTERNS[size] = re.compile(pattern_string)
+def sizing_targets_from_families(families):
+    """Build SIZING_TARGETS_PER_CELL entries from {base: sorted sizes}.
+
+    Like the hand-written table, each size may move to the two next smaller
+    drives or the next larger one. Families with a single size are skipped.
+    """
+    targets = {}
+    for base, sizes in families.items():
+        if len(sizes) < 2:
+            continue
+        targets[base] = {size: sizes[max(0, i - 2):i] + sizes[i + 1:i + 2] for i, size in enumerate(sizes)}
+    return targets
+
+def init_sizing_targets(lib_path):
+    """Replace the built-in sizing table with the drive families found in a liberty file.
+
+    The tables are updated in place so modules that imported them see the
+    change. Returns False (keeping the built-in table) if the library cannot be read.
+    """
+    global EXISTING_SIZES, ALL_TARGET_SIZES, ALL_KNOWN_SIZES
+    try:
+        library = load_library_cached(lib_path)
+    except (IOError, ValueError) as e:
+        print(f"[Warning] Could not read {lib_path} for sizing targets ({e}), keeping the built-in table")
+        return False
+    targets = sizing_targets_from_families(library.drive_families())
+    if not targets:
+        print(f"[Warning] No drive-strength families in {lib_path}, keeping the built-in table")
+        return False
+    SIZING_TARGETS_PER_CELL.clear()
+    SIZING_TARGETS_PER_CELL.update(targets)
+    SIZABLE_CELL_BASES.clear()
+    SIZABLE_CELL_BASES.update(targets)
+    EXISTING_SIZES = set(sz for t in targets.values() for sz in t.keys())
+    ALL_TARGET_SIZES = set(tsz for t in targets.values() for sz_targets in t.values() for tsz in sz_targets)
+    ALL_KNOWN_SIZES = sorted(list(EXISTING_SIZES.union(ALL_TARGET_SIZES)))
+    print(f"[INFO] Sizing targets from {lib_path}: {len(targets)} drive families")
+    return True
 
 # Add timing-related configuration
 CRITICAL_PATH_THRESHOLD = -0.1  # Paths with slack less than this are considered critical
 SLACK_SENSITIVITY_THRESHOLD = 0.2  # Gates with slack sensitivity above this are prioritized
-
-def get_timing_info(verilog_path, design_name, sdc_file, lib_file, spef_file=None):
-    """Get timing information from STA to identify critical paths and slack sensitivity."""
-    # Initialize timing analysis data structures
+LOAD_CAP_REFERENCE = 0.005  # pF; gates driving this much SPEF load or more get double criticality
+
+net_loads = {}  # {net: total SPEF capacitance in pF}, filled by init_net_loads()
+
+def init_net_loads(spef_path):
+    """Load per-net parasitic capacitance from a SPEF file for load-aware gate scoring."""
+    global net_loads
+    if not spef_path or not os.path.exists(spef_path):
+        net_loads = {}
+        return False
+    net_loads = load_spef(spef_path).net_caps()
+    return True
+
+def output_load(nets):
+    """Total SPEF capacitance (pF) of the given nets, 0.0 without SPEF data."""
+    return sum(net_loads.get(instance_key(net), 0.0) for net in nets)
+
+# --- Netlist Index ---
+_netlist_index_cache = {}  # {path: (file stamp, Netlist)}
+
+def _file_stamp(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+@timed("perturb.netlist_index")
+def load_netlist_index(verilog_path):
+    """Tokenized netlist of a Verilog file (every instance with a drive size is sizable).
+
+    The file is parsed once per version: instances, their header lines,
+    master bases, sizes and pin connections come from one pass, so scoring
+    and rewriting a netlist never run a regex over it again.
+    perturb_netlist() registers the index of every file it writes.
+    """
+    stamp = _file_stamp(verilog_path)
+    cached = _netlist_index_cache.get(verilog_path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    netlist = Netlist.from_verilog(verilog_path)
+    _netlist_index_cache[verilog_path] = (stamp, netlist)
+    return netlist
+
+def netlist_gates(netlist, sizes):
+    """Gates of a Netlist's sizable instances for analyze_gates(): (gates, gate_inputs, gate_outputs)."""
+    gates = []
+    gate_inputs = defaultdict(set)
+    gate_outputs = defaultdict(set)
+    for k, inst in enumerate(netlist.sizable):
+        instance_name = instance_key(netlist.inst_names[inst])
+        for port, net in netlist.pins(inst):
+            if port.startswith('I'):  # Input port
+                gate_inputs[instance_name].add(net)
+            elif port.startswith('Z'):  # Output port
+                gate_outputs[instance_name].add(net)
+        cell_type = netlist.sizable_bases[k][:-len(CELL_SUFFIX)].rstrip("_")
+        gates.append((cell_type, sizes[k], instance_name))
+    return gates, gate_inputs, gate_outputs
+
+def analyze_gates(gates, gate_inputs, gate_outputs, wns, timing_info):
+    """Score gates for sizing from STA results.
+
+    gates is a sequence of (cell_type, size, instance_name), gate_inputs and
+    gate_outputs map instance names to connected nets and timing_info is the
+    per-instance index from the STA report. With an index, only gates on
+    reported paths with negative slack can be critical; without one every
+    gate is assumed to sit at the WNS. Criticality grows with the SPEF
+    load on a gate's output nets once init_net_loads() has run. Returns (critical_paths,
+    slack_sensitivity, gate_fanout, gate_location, cell_timing).
+    """
     critical_paths = set()
     slack_sensitivity = defaultdict(float)
     gate_fanout = defaultdict(int)
     gate_location = defaultdict(str)
     cell_timing = defaultdict(dict)
-    
-    try:
-        # Run STA to get timing information
-        wns, tns = run_sta(
-            verilog_file=verilog_path,
-            design_name=design_name,
-            sdc_path=sdc_file,
-            lib_path=lib_file,
-            spef_path=spef_file
-        )
-        
-        if wns is None or tns is None:
-            print("  [Warning] Failed to get timing information, falling back to random selection")
-            return set(), defaultdict(float), defaultdict(int), defaultdict(str), defaultdict(dict)
+
+    for cell_type, size, instance_name in gates:
+        # Get timing information from STA report
+        gate_timing = timing_info.get(instance_name, {})
         
-        # Read the verilog file to get gate information
-        with open(verilog_path, 'r') as f:
-            content = f.readlines()
+        # Calculate timing metrics based on STA results
+        if wns < 0 and (gate_timing or not timing_info):  # If there are timing violations through this gate
+            # Base criticality calculation using actual timing data
+            criticality = max(-gate_timing.get('slack', wns), 0.0)
             
-        # Enhanced pattern matching for gates with more detailed timing analysis
-        gate_pattern = re.compile(r'(\w+)_X(\d+)\s+(\w+)\s*\(')
-        
-        # Track gate connections for better path analysis
-        gate_connections = defaultdict(set)
-        gate_inputs = defaultdict(set)
-        gate_outputs = defaultdict(set)
-        
-        # First pass: build connection graph
-        for line in content:
-            match = gate_pattern.search(line)
-            if match:
-                cell_type = match.group(1)
-                size = int(match.group(2))
-                instance_name = match.group(3)
-                
-                # Parse connections from the line
-                connections = re.findall(r'\.(\w+)\s*\(\s*(\w+)\s*\)', line)
-                for port, net in connections:
-                    if port.startswith('I'):  # Input port
-                        gate_inputs[instance_name].add(net)
-                    elif port.startswith('Z'):  # Output port
-                        gate_outputs[instance_name].add(net)
+            # Adjust criticality based on cell type and size
+            if cell_type in ['AND', 'NAND', 'OR', 'NOR', 'AOI', 'OAI']:
+                criticality *= (1.2 + size * 0.1)  # Larger logic gates are more critical
+                gate_location[instance_name] = "middle"
+            elif cell_type in ['BUF', 'INV', 'CLKBUF']:
+                criticality *= (0.8 + size * 0.15)  # Larger buffers are more critical
+                gate_location[instance_name] = "end"
+            elif cell_type in ['DFF', 'LATCH']:
+                criticality *= (1.5 + size * 0.2)  # Larger sequential elements are more critical
+                gate_location[instance_name] = "sequential"
+            
+            # Adjust criticality based on actual delay and slew
+            delay = gate_timing.get('delay', 0.0)
+            slew = gate_timing.get('slew', 0.0)
+            if delay > 0:
+                criticality *= (1.0 + delay / abs(wns))  # Higher delay increases criticality
+            if slew > 0:
+                criticality *= (1.0 + slew / abs(wns))  # Higher slew increases criticality
+            
+            # Adjust criticality based on fanout
+            fanout = len(gate_outputs[instance_name])
+            if fanout > 0:
+                criticality *= (1.0 + min(fanout / 5.0, 1.0))  # Higher fanout increases criticality
+
+            # Adjust criticality based on the parasitic load the gate drives
+            load = output_load(gate_outputs[instance_name])
+            if load > 0:
+                criticality *= (1.0 + min(load / LOAD_CAP_REFERENCE, 1.0))
+            
+            # Adjust criticality based on input connections
+            input_count = len(gate_inputs[instance_name])
+            if input_count > 0:
+                criticality *= (1.0 + input_count * 0.1)  # More inputs can increase criticality
+            
+            # Add to critical paths if criticality is significant
+            if criticality > abs(wns) * 0.5:
+                critical_paths.add(instance_name)
+                slack_sensitivity[instance_name] = criticality
         
-        # Second pass: analyze timing characteristics
-        for line in content:
-            match = gate_pattern.search(line)
-            if match:
-                cell_type = match.group(1)
-                size = int(match.group(2))
-                instance_name = match.group(3)
-                
-                # Get timing information from STA report
-                timing_info = parse_timing_report("timing.txt")
-                gate_timing = timing_info.get(instance_name, {})
-                
-                # Calculate timing metrics based on STA results
-                if wns < 0:  # If there are timing violations
-                    # Base criticality calculation using actual timing data
-                    criticality = abs(gate_timing.get('slack', wns))
-                    
-                    # Adjust criticality based on cell type and size
-                    if cell_type in ['AND', 'NAND', 'OR', 'NOR', 'AOI', 'OAI']:
-                        criticality *= (1.2 + size * 0.1)  # Larger logic gates are more critical
-                        gate_location[instance_name] = "middle"
-                    elif cell_type in ['BUF', 'INV', 'CLKBUF']:
-                        criticality *= (0.8 + size * 0.15)  # Larger buffers are more critical
-                        gate_location[instance_name] = "end"
-                    elif cell_type in ['DFF', 'LATCH']:
-                        criticality *= (1.5 + size * 0.2)  # Larger sequential elements are more critical
-                        gate_location[instance_name] = "sequential"
-                    
-                    # Adjust criticality based on actual delay and slew
-                    delay = gate_timing.get('delay', 0.0)
-                    slew = gate_timing.get('slew', 0.0)
-                    if delay > 0:
-                        criticality *= (1.0 + delay / abs(wns))  # Higher delay increases criticality
-                    if slew > 0:
-                        criticality *= (1.0 + slew / abs(wns))  # Higher slew increases criticality
-                    
-                    # Adjust criticality based on fanout
-                    fanout = len(gate_outputs[instance_name])
-                    if fanout > 0:
-                        criticality *= (1.0 + min(fanout / 5.0, 1.0))  # Higher fanout increases criticality
-                    
-                    # Adjust criticality based on input connections
-                    input_count = len(gate_inputs[instance_name])
-                    if input_count > 0:
-                        criticality *= (1.0 + input_count * 0.1)  # More inputs can increase criticality
-                    
-                    # Add to critical paths if criticality is significant
-                    if criticality > abs(wns) * 0.5:
-                        critical_paths.add(instance_name)
-                        slack_sensitivity[instance_name] = criticality
-                
-                # Enhanced fanout estimation
-                if cell_type in ['BUF', 'INV', 'CLKBUF']:
-                    gate_fanout[instance_name] = size * 2  # Buffers typically drive more loads
-                elif cell_type in ['DFF', 'LATCH']:
-                    gate_fanout[instance_name] = 1  # Sequential elements typically drive one load
-                else:
-                    gate_fanout[instance_name] = max(2, size)  # Logic gates have at least 2 fanouts
-                
-                # Enhanced cell timing characteristics using actual STA data
-                cell_timing[instance_name] = {
-                    "delay": gate_timing.get('delay', size * 0.1),  # Use actual delay if available
-                    "slew": gate_timing.get('slew', size * 0.05),  # Use actual slew if available
-                    "capacitance": size * 0.2,  # Base capacitance
-                    "setup_time": 0.1 if cell_type in ['DFF', 'LATCH'] else 0.0,  # Setup time for sequential elements
-                    "hold_time": 0.05 if cell_type in ['DFF', 'LATCH'] else 0.0,  # Hold time for sequential elements
-                    "clock_to_q": 0.15 if cell_type in ['DFF', 'LATCH'] else 0.0,  # Clock-to-Q delay for sequential elements
-                    "input_count": len(gate_inputs[instance_name]),  # Number of inputs
-                    "output_count": len(gate_outputs[instance_name]),  # Number of outputs
-                    "path_type": gate_timing.get('path_type', 'unknown')  # Path type from STA
-                }
+        # Enhanced fanout estimation
+        if cell_type in ['BUF', 'INV', 'CLKBUF']:
+            gate_fanout[instance_name] = size * 2  # Buffers typically drive more loads
+        elif cell_type in ['DFF', 'LATCH']:
+            gate_fanout[instance_name] = 1  # Sequential elements typically drive one load
+        else:
+            gate_fanout[instance_name] = max(2, size)  # Logic gates have at least 2 fanouts
         
-        return critical_paths, slack_sensitivity, gate_fanout, gate_location, cell_timing
+        # Enhanced cell timing characteristics using actual STA data
+        cell_timing[instance_name] = {
+            "delay": gate_timing.get('delay', size * 0.1),  # Use actual delay if available
+            "slew": gate_timing.get('slew', size * 0.05),  # Use actual slew if available
+            "capacitance": output_load(gate_outputs[instance_name]) or size * 0.2,  # SPEF load if available, else base capacitance
+            "setup_time": 0.1 if cell_type in ['DFF', 'LATCH'] else 0.0,  # Setup time for sequential elements
+            "hold_time": 0.05 if cell_type in ['DFF', 'LATCH'] else 0.0,  # Hold time for sequential elements
+            "clock_to_q": 0.15 if cell_type in ['DFF', 'LATCH'] else 0.0,  # Clock-to-Q delay for sequential elements
+            "input_count": len(gate_inputs[instance_name]),  # Number of inputs
+            "output_count": len(gate_outputs[instance_name]),  # Number of outputs
+            "path_type": gate_timing.get('path_type', 'unknown')  # Path type from STA
+        }
+
+    return critical_paths, slack_sensitivity, gate_fanout, gate_location, cell_timing
+
+@timed("perturb.timing_info")
+def get_timing_info(verilog_path, design_name, sdc_file, lib_file, spef_file=None, work_dir=None, timing_data=None,
+                    backend=None):
+    """Get timing information from STA to identify critical paths and slack sensitivity.
+
+    If timing_data (see sta_runner.collect_timing_data) from an earlier
+    evaluation of this netlist is given, it is used instead of running STA.
+    Otherwise the netlist is evaluated by backend (a sta_backend.STABackend)
+    or, without one, by a one-shot OpenSTA run whose scripts and reports go
+    to work_dir (current directory if None).
+    """
+    try:
+        if timing_data is not None:
+            # Reuse the timing of the last evaluation of this netlist
+            wns, tns = timing_data['wns'], timing_data['tns']
+        elif backend is not None:
+            wns, tns = backend.run_sta(verilog_file=verilog_path)
+        else:
+            # Run STA to get timing information
+            wns, tns = run_sta(
+                verilog_file=verilog_path,
+                design_name=design_name,
+                sdc_path=sdc_file,
+                lib_path=lib_file,
+                spef_path=spef_file,
+                work_dir=work_dir
+            )
+
+        if wns is None or tns is None:
+            print("  [Warning] Failed to get timing information, falling back to random selection")
+            return set(), defaultdict(float), defaultdict(int), defaultdict(str), defaultdict(dict)
         
+        # Per-instance slack/delay index, parsed once for the whole scoring pass
+        if timing_data is not None:
+            timing_info = timing_data['gate_timing']
+        elif backend is not None:
+            timing_info = backend.timing_data(wns, tns)['gate_timing']
+        else:
+            timing_info = load_timing_index(sta_runner.last_timing_report)
+
+        # Gates and their connections come from the file's index, tokenized once per file version
+        netlist = load_netlist_index(verilog_path)
+        gates, gate_inputs, gate_outputs = netlist_gates(netlist, netlist.base_sizes)
+        return analyze_gates(gates, gate_inputs, gate_outputs, wns, timing_info)
+
     except Exception as e:
         print(f"  [Warning] Error in timing analysis: {e}")
         return set(), defaultdict(float), defaultdict(int), defaultdict(str), defaultdict(dict)
 
+@timed("perturb.timing_info")
+def get_model_timing_info(netlist, sizes, timing_data):
+    """get_timing_info() for a parsed Netlist and sizing state, using timing_data from its last evaluation."""
+    if timing_data is None or timing_data['wns'] is None:
+        print("  [Warning] No timing information for the current state, falling back to random selection")
+        return set(), defaultdict(float), defaultdict(int), defaultdict(str), defaultdict(dict)
+
+    gates, gate_inputs, gate_outputs = netlist_gates(netlist, sizes)
+    return analyze_gates(gates, gate_inputs, gate_outputs, timing_data['wns'], timing_data['gate_timing'])
+
 def get_gate_score(gate_name, critical_paths, slack_sensitivity, gate_fanout, gate_location, cell_timing):
     """Calculate a score for a gate based on timing factors only."""
     score = 0.0
@@ -289,14 +407,117 @@ def select_new_size(current_size, possible_sizes, needs_upsize):
         else:
             return current_size  # Keep current size if no smaller options
 
+def what_if_cost(wns, tns):
+    """Timing cost of a what-if result; lower is better."""
+    return WNS_COST_WEIGHT * abs(min(wns, 0.0)) + abs(min(tns, 0.0))
+
+@timed("perturb.what_if")
+def measure_moves(netlist, sizes, potential_mods, backend):
+    """Measure the top WHAT_IF_CANDIDATES resizes of the score-sorted potential_mods.
+
+    Each candidate gets the size select_new_size() proposes for it and is
+    evaluated alone on the design linked in backend, next to the unchanged
+    design (STABackend.evaluate_moves). Returns [(gain, sizable_index,
+    new_size)] for the candidates that lowered the timing cost, largest gain
+    first, or None if the backend cannot run what-ifs.
+    """
+    if WHAT_IF_CANDIDATES <= 0 or backend is None or not backend.holds_design():
+        return None
+    candidates = []
+    for k, current_size, score, needs_upsize in potential_mods:
+        if len(candidates) >= WHAT_IF_CANDIDATES:
+            break
+        new_size = select_new_size(current_size, SIZING_TARGETS_PER_CELL[netlist.sizable_bases[k]][current_size], needs_upsize)
+        if new_size != current_size:
+            candidates.append((k, new_size))
+    # The backend must hold exactly the state being perturbed
+    if not candidates or not backend.sync_masters(netlist.sizable_masters(sizes)):
+        return None
+
+    new_sizes = array('i', sizes)
+    moves = [[]]  # The unchanged design, timed under the same conditions as the moves
+    for k, new_size in candidates:
+        new_sizes[k] = new_size
+        moves.append([(netlist.inst_names[netlist.sizable[k]], netlist.master_of(k, sizes), netlist.master_of(k, new_sizes))])
+        new_sizes[k] = sizes[k]
+    results = backend.evaluate_moves(moves)
+    if results is None or results[0][0] is None:
+        return None
+    base_cost = what_if_cost(*results[0])
+    measured = sorted(((base_cost - what_if_cost(wns, tns), k, new_size)
+                       for (k, new_size), (wns, tns) in zip(candidates, results[1:]) if wns is not None),
+                      reverse=True)
+    improving = [move for move in measured if move[0] > 0]
+    log(f"  [What-if] {len(improving)} of {len(candidates)} candidate resizes improve the timing cost")
+    return improving
+
+def select_moves(netlist, sizes, potential_mods, backend=None):
+    """Pick up to MAX_GATES_TO_MODIFY_PER_RUN resizes from the score-sorted potential_mods.
+
+    With a backend that holds the design, the top candidates are measured
+    (measure_moves) and the ones that improve timing are taken largest gain
+    first. Otherwise, or if none improves, gates are taken in score order
+    with a score-weighted probability and resized by select_new_size().
+    Returns (new_sizes, changes) with changes as [(instance, old_master,
+    new_master)].
+    """
+    new_sizes = array('i', sizes)
+    changes = []
+
+    def resize(k, new_size, note):
+        new_sizes[k] = new_size
+        instance_name = netlist.inst_names[netlist.sizable[k]]
+        changes.append((instance_name, netlist.master_of(k, sizes), netlist.master_of(k, new_sizes)))
+        size_change = "upsize" if new_size > sizes[k] else "downsize"
+        log(f"  [Perturb] Modified gate {instance_name} ({note}, {size_change} {sizes[k]}->{new_size})", "debug")
+
+    measured = measure_moves(netlist, sizes, potential_mods, backend)
+    if measured:
+        for gain, k, new_size in measured:
+            if len(changes) >= MAX_GATES_TO_MODIFY_PER_RUN:
+                break
+            if random.random() < PROB_APPLY_SIZE_CHANGE:
+                resize(k, new_size, f"Gain: {gain:.4f}")
+        if changes:
+            return new_sizes, changes
+
+    for k, current_size, score, needs_upsize in potential_mods:
+        if len(changes) >= MAX_GATES_TO_MODIFY_PER_RUN:
+            break
+
+        # Adjust probability based on score
+        adjusted_prob = PROB_APPLY_SIZE_CHANGE * (1.0 + score)  # Increase probability for high-scoring gates
+        if random.random() < adjusted_prob:
+            # Select new size based on timing needs
+            possible_new_sizes = SIZING_TARGETS_PER_CELL[netlist.sizable_bases[k]][current_size]
+            new_size = select_new_size(current_size, possible_new_sizes, needs_upsize)
+            if new_size != current_size:  # Only modify if size actually changes
+                resize(k, new_size, f"Score: {score:.2f}")
+    return new_sizes, changes
+
 # --- Perturbation Function ---
-def perturb_netlist(verilog_path, new_path):
+last_changes = []  # [(instance, old_master, new_master)] applied by the last perturb_netlist() call
+
+@timed("perturb.perturb_netlist")
+def perturb_netlist(verilog_path, new_path, work_dir=None, timing_data=None, backend=None):
+    """Write a resized copy of verilog_path to new_path.
+
+    timing_data from the last evaluation of verilog_path avoids re-running STA
+    to rank the gates; otherwise it is timed with backend (see
+    get_timing_info). A backend that holds the design also measures the
+    top-ranked resizes before they are chosen (see select_moves). Gates are scored and resized on the file's index (see
+    load_netlist_index), whose resized version is registered for new_path,
+    so a chain of perturbations tokenizes only the first file. The resizes
+    are also left in last_changes.
+    """
+    global last_changes
+    last_changes = []
     try:
-        with open(verilog_path, 'r') as f:
-            lines = f.readlines()
+        netlist = load_netlist_index(verilog_path)
     except FileNotFoundError:
         print(f"[ERROR] Input netlist not found: {verilog_path}")
         return None
+    sizes = netlist.base_sizes
 
     # Get timing information
     critical_paths, slack_sensitivity, gate_fanout, gate_location, cell_timing = get_timing_info(
@@ -304,92 +525,42 @@ def perturb_netlist(verilog_path, new_path):
         "gcd",  # Replace with your design name
         "design.sdc",
         "my.lib",
-        "design.spef" if os.path.exists("design.spef") else None
+        "design.spef" if os.path.exists("design.spef") else None,
+        work_dir=work_dir,
+        timing_data=timing_data,
+        backend=backend
     )
     
-    print(f"  [Timing Info] Found {len(critical_paths)} gates on critical paths")
-    
-    perturbed_lines = []
-    gates_sized_count = 0
-    buffer_inserted = False
-    gates_modified_this_run = 0
+    log(f"  [Timing Info] Found {len(critical_paths)} gates on critical paths")
 
     # --- Create a list of potential modification points with scores ---
-    potential_mods = []  # Store tuples: (line_index, current_size, match_object, score, needs_upsize)
-    for line_num, line in enumerate(lines):
-        for current_size, pattern in REGEX_PATTERNS.items():
-            match = pattern.search(line)
-            if match:
-                cell_name_base = match.group(1)
-                cell_suffix_matched = match.group(2)
-                instance_name = match.group(5)
-                full_base = cell_name_base + cell_suffix_matched
-                
-                if full_base in SIZABLE_CELL_BASES:
-                    targets_for_this_cell = SIZING_TARGETS_PER_CELL.get(full_base)
-                    if targets_for_this_cell:
-                        possible_new_sizes = targets_for_this_cell.get(current_size)
-                        if possible_new_sizes:
-                            # Calculate score for this gate
-                            score, needs_upsize = get_gate_score(
-                                instance_name, critical_paths, slack_sensitivity,
-                                gate_fanout, gate_location, cell_timing
-                            )
-                            potential_mods.append((line_num, current_size, match, score, needs_upsize))
+    potential_mods = []  # Store tuples: (sizable_index, current_size, score, needs_upsize)
+    with phase("perturb.score_gates"):
+        for k, current_size in enumerate(sizes):
+            full_base = netlist.sizable_bases[k]
+            if full_base not in SIZABLE_CELL_BASES:
+                continue
+            possible_new_sizes = SIZING_TARGETS_PER_CELL.get(full_base, {}).get(current_size)
+            if possible_new_sizes:
+                # Calculate score for this gate
+                score, needs_upsize = get_gate_score(
+                    instance_key(netlist.inst_names[netlist.sizable[k]]), critical_paths, slack_sensitivity,
+                    gate_fanout, gate_location, cell_timing
+                )
+                potential_mods.append((k, current_size, score, needs_upsize))
 
     # Sort potential modifications by score (highest first)
-    potential_mods.sort(key=lambda x: x[3], reverse=True)
-    
-    lines_to_modify_indices = set()
-
-    for line_index, current_size, match, score, needs_upsize in potential_mods:
-        if gates_modified_this_run >= MAX_GATES_TO_MODIFY_PER_RUN:
-            break
-
-        if line_index in lines_to_modify_indices:
-            continue
+    potential_mods.sort(key=lambda x: x[2], reverse=True)
 
-        # Adjust probability based on score
-        adjusted_prob = PROB_APPLY_SIZE_CHANGE * (1.0 + score)  # Increase probability for high-scoring gates
-        if random.random() < adjusted_prob:
-            cell_name_base = match.group(1)
-            cell_suffix_matched = match.group(2)
-            whitespace_after_size = match.group(4)
-            instance_name = match.group(5)
-            space_and_paren = match.group(6)
-            full_base = cell_name_base + cell_suffix_matched
-
-            targets_for_this_cell = SIZING_TARGETS_PER_CELL.get(full_base)
-            if targets_for_this_cell:
-                possible_new_sizes = targets_for_this_cell.get(current_size)
-                if possible_new_sizes:
-                    # Select new size based on timing needs
-                    new_size = select_new_size(current_size, possible_new_sizes, needs_upsize)
-                    
-                    if new_size != current_size:  # Only modify if size actually changes
-                        original_line = lines[line_index]
-                        modified_line = match.re.sub(
-                            f"{cell_name_base}{cell_suffix_matched}{new_size}{whitespace_after_size}{instance_name}{space_and_paren}",
-                            original_line,
-                            count=1
-                        )
-
-                        if modified_line != original_line:
-                            lines[line_index] = modified_line
-                            gates_sized_count += 1
-                            gates_modified_this_run += 1
-                            lines_to_modify_indices.add(line_index)
-                            size_change = "upsize" if new_size > current_size else "downsize"
-                            print(f"  [Perturb] Modified gate {instance_name} (Score: {score:.2f}, {size_change} {current_size}->{new_size})")
-
-    perturbed_lines = lines
+    new_sizes, last_changes = select_moves(netlist, sizes, potential_mods, backend)
 
+    gates_sized_count = len(last_changes)
     try:
-        with open(new_path, 'w') as f:
-            f.writelines(perturbed_lines)
-        print(f"  [Perturb OK] Saved to {new_path}. Gates sized: {gates_sized_count} (Limit: {MAX_GATES_TO_MODIFY_PER_RUN})")
+        netlist.write_verilog(new_path, new_sizes)
+        _netlist_index_cache[new_path] = (_file_stamp(new_path), netlist.resized(new_sizes))
+        log(f"  [Perturb OK] Saved to {new_path}. Gates sized: {gates_sized_count} (Limit: {MAX_GATES_TO_MODIFY_PER_RUN})")
         if gates_sized_count == 0 and len(potential_mods) > 0:
-            print(f"  [Perturb INFO] No gates were sized (Prob: {PROB_APPLY_SIZE_CHANGE}, Limit: {MAX_GATES_TO_MODIFY_PER_RUN}). Potential mods found: {len(potential_mods)}")
+            log(f"  [Perturb INFO] No gates were sized (Prob: {PROB_APPLY_SIZE_CHANGE}, Limit: {MAX_GATES_TO_MODIFY_PER_RUN}). Potential mods found: {len(potential_mods)}")
         elif gates_sized_count == 0 and len(potential_mods) == 0:
             print("  [Perturb WARNING] No sizable gates found matching patterns/config.")
         return new_path
@@ -397,6 +568,46 @@ def perturb_netlist(verilog_path, new_path):
         print(f"[ERROR] Could not write perturbed netlist to {new_path}: {e}")
         return None
 
+@timed("perturb.perturb_sizes")
+def perturb_sizes(netlist, sizes, timing_data=None, backend=None):
+    """Propose a resized sizing state for a parsed Netlist.
+
+    Applies the same scoring, move selection and MAX_GATES_TO_MODIFY_PER_RUN
+    limit as perturb_netlist, but works on the sizing vector: the cost is
+    O(sizable instances) and nothing is read or written on disk. A backend
+    that holds the design measures the top candidates first (see
+    select_moves). Returns
+    (new_sizes, changes) with changes as [(instance, old_master, new_master)],
+    ready to be applied to a linked design with replace_cell.
+    """
+    critical_paths, slack_sensitivity, gate_fanout, gate_location, cell_timing = get_model_timing_info(
+        netlist, sizes, timing_data)
+    log(f"  [Timing Info] Found {len(critical_paths)} gates on critical paths")
+
+    # --- Create a list of potential modification points with scores ---
+    potential_mods = []  # Store tuples: (sizable_index, current_size, score, needs_upsize)
+    for k, current_size in enumerate(sizes):
+        possible_new_sizes = SIZING_TARGETS_PER_CELL.get(netlist.sizable_bases[k], {}).get(current_size)
+        if possible_new_sizes:
+            instance_name = instance_key(netlist.inst_names[netlist.sizable[k]])
+            score, needs_upsize = get_gate_score(
+                instance_name, critical_paths, slack_sensitivity,
+                gate_fanout, gate_location, cell_timing
+            )
+            potential_mods.append((k, current_size, score, needs_upsize))
+
+    # Sort potential modifications by score (highest first)
+    potential_mods.sort(key=lambda x: x[2], reverse=True)
+
+    new_sizes, changes = select_moves(netlist, sizes, potential_mods, backend)
+
+    log(f"  [Perturb OK] Gates sized: {len(changes)} (Limit: {MAX_GATES_TO_MODIFY_PER_RUN})")
+    if not changes and potential_mods:
+        log(f"  [Perturb INFO] No gates were sized (Prob: {PROB_APPLY_SIZE_CHANGE}, Limit: {MAX_GATES_TO_MODIFY_PER_RUN}). Potential mods found: {len(potential_mods)}")
+    elif not potential_mods:
+        print("  [Perturb WARNING] No sizable gates found matching patterns/config.")
+    return new_sizes, changes
+
 # --- Standalone Test Block ---
 if __name__ == "__main__":
     if len(sys.argv) != 3:
@@ -411,6 +622,7 @@ if __name__ == "__main__":
         print(f"[ERROR] Input file not found: {in_file}")
         sys.exit(1)
 
+    set_log_level("debug")  # Show every modified gate
     print(f"--- Running Perturbation Test ---")
     print(f"Input:  {in_file}")
     print(f"Output: {out_file}")
@@ -419,7 +631,7 @@ if __name__ == "__main__":
     print(f"  Prob Apply Change:   {PROB_APPLY_SIZE_CHANGE}")
     # print(f"  Target Sizes Per Cell: {SIZING_TARGETS_PER_CELL}") # Can be very long
     print(f"  Sizable Cell Bases ({len(SIZABLE_CELL_BASES)} types): {list(SIZABLE_CELL_BASES)[:5]}...") # Show first 5
-    print(f"  Compiled Regex Patterns for sizes: {list(REGEX_PATTERNS.keys())}")
+    print(f"  Known drive sizes: {ALL_KNOWN_SIZES}")
     print(f"  Assumed Cell Suffix: '{CELL_SUFFIX}'")
 
 
@@ -0,0 +1,111 @@
+import cProfile
+import functools
+import io
+import os
+import pstats
+import time
+from contextlib import contextmanager
+
+ENABLED = True  # Phase timers cost two clock reads per call; set False to skip even that
+
+_phases = {}  # {phase: [calls, wall seconds, cpu seconds]}
+_profiler = None  # cProfile.Profile while a capture is running
+
+@contextmanager
+def phase(name):
+    """Accumulate the wall and CPU time of a block under a phase name.
+
+    Nested phases are counted in full by each enclosing phase, so a parent's
+    time includes its children's.
+    """
+    if not ENABLED:
+        yield
+        return
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield
+    finally:
+        totals = _phases.get(name)
+        if totals is None:
+            totals = _phases[name] = [0, 0.0, 0.0]
+        totals[0] += 1
+        totals[1] += time.perf_counter() - wall_start
+        totals[2] += time.process_time() - cpu_start
+
+def timed(name):
+    """Decorator form of phase() for a whole function."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def reset():
+    """Forget all phase totals."""
+    _phases.clear()
+
+def phase_totals():
+    """{phase: (calls, wall seconds, cpu seconds)} accumulated so far."""
+    return {name: tuple(totals) for name, totals in _phases.items()}
+
+def summary_table(total_wall=None):
+    """Phase totals as a text table, slowest phase first.
+
+    With total_wall (e.g. the run's wall time) a share column is added.
+    CPU time is this process's only; time spent inside OpenSTA shows up as
+    wall time without CPU time.
+    """
+    header = f"{'Phase':<28} {'Calls':>8} {'Wall [s]':>10} {'CPU [s]':>10} {'ms/call':>10}"
+    if total_wall:
+        header += f" {'Share':>7}"
+    lines = [header, "-" * len(header)]
+    for name, (calls, wall, cpu) in sorted(_phases.items(), key=lambda item: -item[1][1]):
+        line = f"{name:<28} {calls:>8} {wall:>10.3f} {cpu:>10.3f} {1000.0 * wall / calls:>10.3f}"
+        if total_wall:
+            line += f" {100.0 * wall / total_wall:>6.1f}%"
+        lines.append(line)
+    if total_wall:
+        lines.append(f"{'total run':<28} {'':>8} {total_wall:>10.3f}")
+    return "\n".join(lines)
+
+def write_summary(path, total_wall=None):
+    """Write summary_table() to a file, creating its directory."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(summary_table(total_wall) + "\n")
+
+# --- cProfile Capture ---
+def start_cprofile():
+    """Start a cProfile capture (no-op if one is running)."""
+    global _profiler
+    if _profiler is None:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+def cprofile_running():
+    return _profiler is not None
+
+def stop_cprofile(path, top=40):
+    """Stop the capture, save raw stats to path and a cumulative-time listing next to it (.txt)."""
+    global _profiler
+    if _profiler is None:
+        return None
+    _profiler.disable()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    _profiler.dump_stats(path)
+    listing = io.StringIO()
+    pstats.Stats(_profiler, stream=listing).sort_stats("cumulative").print_stats(top)
+    text_path = os.path.splitext(path)[0] + ".txt"
+    with open(text_path, 'w') as f:
+        f.write(listing.getvalue())
+    _profiler = None
+    return text_path
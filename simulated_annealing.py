@@ -1,15 +1,28 @@
-import shutil
 import os
+from array import array
 import math
 import random
 import subprocess
 import time
 import sys
+from statistics import NormalDist, fmean, stdev
+import numpy as np
 import matplotlib.pyplot as plt
 
 # Import necessary functions directly
-from sta_runner import run_sta, generate_derate
-from perturb import perturb_netlist
+import sta_runner
+from sta_runner import collect_timing_data, run_sta, run_sta_batch, run_sta_parallel, shutdown_worker_pool, generate_derate, write_derate, sample_derates, sample_derate_arrays, read_instance_masters
+from sta_backend import open_sta_backend
+from perturb import perturb_sizes, init_sizing_targets, init_net_loads, SIZABLE_CELL_BASES, WNS_COST_WEIGHT
+from liberty import load_library_cached
+from netlist import Netlist
+from timing_engine import TimingEngine
+from eval_cache import EvalCache, settings_key
+from derates import DerateBank
+from checkpoint import save_checkpoint, load_checkpoint
+from telemetry import Journal, log, log_enabled, set_log_level
+import profiling
+from profiling import phase, timed
 
 # --- Configuration ---
 # Files
@@ -32,6 +45,31 @@ ALPHA = 0.95        # Cooling rate (0.85-0.99). Slower cooling (higher alpha) ex
 MAX_ITER = 400      # Max iterations per temperature step (or total iterations, depending on loop structure) - Increase significantly
 MC_TRIALS = 8      # Number of Monte Carlo STA runs per cost evaluation - Increase for accuracy (e.g., 10-30) but slows down SA.
 TNS_WEIGHT = 1.2    # Weight for TNS in the cost function
+STA_BACKEND = "session"  # With TIMING_BACKEND = "opensta": "session" keeps one OpenSTA process loaded with the design,
+                         # "oneshot" relaunches it per evaluation, "standin" is an in-process model for dry runs (sta_backend.py)
+MC_MODE = "batch"   # "serial": one STA run per trial, "batch": sweep all trials inside one STA evaluation,
+                    # "parallel": one STA run per trial spread over MC_WORKERS processes
+MC_WORKERS = os.cpu_count() or 1  # Worker pool size for MC_MODE = "parallel"
+USE_LIBERTY_DATA = True  # Take cell areas and sizing targets from LIB_FILE (compiled cache) instead of the built-in tables
+TIMING_BACKEND = "opensta"  # "opensta": external STA runs, "engine": built-in NumPy timing engine (timing_engine.py)
+ENGINE_MC_TRIALS = 1000  # MC samples per evaluation with the engine; all samples are propagated in one vectorized pass
+USE_ECO_CHANGES = True  # With a session (or stand-in) backend, evaluate candidates as edits of the linked design instead of writing Verilog
+USE_EVAL_CACHE = True   # Reuse the cost of sizing states that were already evaluated instead of re-running STA
+EVAL_CACHE_SIZE = 4096  # Evaluations kept in the in-memory LRU
+EVAL_CACHE_DB = None    # SQLite file (e.g. "eval_cache.sqlite") that keeps evaluations across runs and sweeps
+USE_DERATE_BANK = True  # Evaluate current and candidate states on the same seeded derate samples (common random numbers)
+DERATE_SEED = None      # Seed of the derate bank; None picks one per run (printed at start-up)
+DERATE_REFRESH_STEPS = 50  # Redraw the bank every N SA steps, re-evaluating the current state; 0 keeps one bank
+DERATE_SAMPLER = "lhs"  # How MC derate samples cover the distribution: "random", "lhs", "sobol", "halton" or "antithetic"
+ADAPTIVE_MC = True      # Stop a candidate's STA trials once its accept/reject outcome is statistically settled (MC_TRIALS is the maximum)
+MC_MIN_TRIALS = 3       # Trials an adaptive evaluation always runs before it may stop
+MC_CONFIDENCE = 0.95    # Confidence level of the interval on the mean cost difference that settles the outcome
+CHECKPOINT_FILE = "sa_checkpoint.pkl"  # Full SA state, rewritten every CHECKPOINT_EVERY iterations; resume with --resume
+CHECKPOINT_EVERY = 10   # Iterations between checkpoints; 0 disables checkpointing
+LOG_LEVEL = "quiet"     # Console output: "quiet" (summaries), "info" (per iteration) or "debug" (per trial, per gate, raw STA output)
+JOURNAL_FILE = os.path.join("results", "sa_journal.jsonl")  # Append-only per-iteration metrics (telemetry.read_journal); None disables
+PROFILE_PHASES = True   # Time the pipeline phases (Tcl generation, OpenSTA, parsing, perturbation, ...) and report them at the end
+CPROFILE_ITERATIONS = 0  # Capture the first N iterations with cProfile into results/; 0 disables
 
 # Cost function weights
 TIMING_WEIGHT = 1  # Weight for timing cost
@@ -43,88 +81,282 @@ AREA_NORM_FACTOR = 1000.0  # Normalize area to similar scale as timing
 # --- Cost Function ---
 # --- START OF relevant part of simulated_annealing.py ---
 cost_history = []
+sta_backend = None  # STA backend (sta_backend.STA_BACKENDS) opened by simulated_annealing() when TIMING_BACKEND = "opensta"
+last_timing_data = None  # Timing data (WNS/TNS and parsed path report) of the last calculate_cost() call
+timing_engine = None  # TimingEngine over the baseline Netlist, built by simulated_annealing() when TIMING_BACKEND = "engine"
+eval_cache = None  # EvalCache of (cost, timing data) per sizing state, built by simulated_annealing() when USE_EVAL_CACHE is set
+derate_bank = None  # DerateBank shared by all cost evaluations, built by simulated_annealing() when USE_DERATE_BANK is set
+last_step = {}  # Moves, cache use and evaluation time of the last anneal_step() call, for the run journal
 # ... (other imports and configurations) ...
 
+def evaluate_sta_batch(verilog_path, design_name, sdc_path, lib_path, spef_path, derates, work_dir=None):
+    """Evaluate a list of (cell_delay, cell_check) derates in one STA pass; returns [(wns, tns), ...]."""
+    if sta_backend is not None:
+        return sta_backend.run_sta_batch(verilog_file=verilog_path, derates=derates)
+    return run_sta_batch(verilog_path, design_name, sdc_path, lib_path, spef_path, derates, work_dir=work_dir)
+
+def trial_derates(num_trials):
+    """The (cell_delay, cell_check) pairs of an MC evaluation: the derate bank's, or fresh samples without one."""
+    if derate_bank is not None:
+        return derate_bank.pairs()
+    return sample_derates(num_trials, sampler=DERATE_SAMPLER)
+
+def cache_variant():
+    """Evaluation cache variant of the current derate samples."""
+    return derate_bank.key if derate_bank is not None else ""
+
+@timed("sa.engine_evaluate")
+def evaluate_engine(verilog_path, sizes, num_samples):
+    """Vectorized MC with the built-in timing engine.
+
+    sizes is a sizing state of the engine's netlist; with None the masters
+    are read from verilog_path. Returns the engine result (per-sample 'wns',
+    'tns' and 'worst_slack' vectors, 'yield') with 'gate_timing' added,
+    taken at nominal derate.
+    """
+    if sizes is not None:
+        master_ids = timing_engine.master_ids(sizes)
+    else:
+        master_ids = timing_engine.master_ids_for_verilog(verilog_path)
+    if derate_bank is not None:
+        delay_derates, check_derates = derate_bank.arrays()
+    else:
+        delay_derates, check_derates = sample_derate_arrays(num_samples, sampler=DERATE_SAMPLER)
+    result = timing_engine.evaluate_samples(master_ids, delay_derates, check_derates)
+    result['gate_timing'] = timing_engine.gate_timing(timing_engine.propagate(master_ids))
+    return result
+
+def run_trials(verilog_path, design_name, sdc_path, lib_path, spef_path, derates, derate_tcl, work_dir=None):
+    """Evaluate a list of (cell_delay, cell_check) derates in the configured MC_MODE; returns [(wns, tns), ...]."""
+    if MC_MODE == "batch":
+        return evaluate_sta_batch(verilog_path, design_name, sdc_path, lib_path, spef_path, derates, work_dir)
+    if MC_MODE == "parallel":
+        return run_sta_parallel(verilog_path, design_name, sdc_path, lib_path, spef_path, derates, MC_WORKERS)
+    trial_results = []
+    for delay_derate, check_derate in derates:
+        # Write this trial's derates
+        write_derate(derate_tcl, delay_derate, check_derate)
+
+        # Run STA
+        trial_results.append(evaluate_sta(verilog_path, design_name, sdc_path, lib_path, spef_path, derate_tcl, work_dir))
+    return trial_results
+
+def run_trials_adaptive(verilog_path, design_name, sdc_path, lib_path, spef_path, derates, derate_tcl, work_dir,
+                        reference, area_cost):
+    """run_trials() a few derates at a time, stopping as soon as the Metropolis outcome is settled.
+
+    reference is (current_trial_costs, threshold): the per-trial costs of
+    the current state on the same derates, and the threshold -T*ln(u) the
+    mean cost difference must stay below for the candidate to be accepted.
+    Trials stop once the MC_CONFIDENCE interval of the mean difference lies
+    entirely on one side of the threshold. Returns (trial_results, accepted),
+    accepted being None if no trial succeeded.
+    """
+    current_costs, threshold = reference
+    known_costs = [c for c in current_costs if c is not None]
+    fallback_cost = fmean(known_costs)  # For trials the current state has no cost for
+    z = NormalDist().inv_cdf(0.5 + MC_CONFIDENCE / 2.0)
+    chunk = MC_WORKERS if MC_MODE == "parallel" else 1
+    trial_results = []
+    diffs = []
+    accepted = None
+    mean = half_width = 0.0
+    while len(trial_results) < len(derates):
+        start = len(trial_results)
+        count = MC_MIN_TRIALS if start == 0 else chunk
+        trial_results += run_trials(verilog_path, design_name, sdc_path, lib_path, spef_path,
+                                    derates[start:start + count], derate_tcl, work_dir)
+        for i in range(start, len(trial_results)):
+            wns, tns = trial_results[i]
+            if wns is None or tns is None:
+                continue
+            current = current_costs[i] if i < len(current_costs) and current_costs[i] is not None else fallback_cost
+            diffs.append(TIMING_WEIGHT * trial_timing_cost(wns, tns) + AREA_WEIGHT * area_cost - current)
+        if len(diffs) < max(MC_MIN_TRIALS, 2):  # A spread needs two samples
+            continue
+        mean = fmean(diffs)
+        half_width = z * stdev(diffs) / math.sqrt(len(diffs))
+        if mean + half_width < threshold:
+            accepted = True
+            break
+        if mean - half_width > threshold:
+            accepted = False
+            break
+    if not diffs:
+        return trial_results, None
+    if accepted is None:
+        # MC_TRIALS reached without a settled outcome; decide on the mean
+        mean = fmean(diffs)
+        accepted = mean < threshold
+    log(f"    [Adaptive MC] {len(trial_results)}/{len(derates)} trials: cost difference {mean:+.4f} ± {half_width:.4f} "
+          f"vs threshold {threshold:.4f} -> {'accept' if accepted else 'reject'}")
+    return trial_results, accepted
+
+def metropolis_threshold(temp):
+    """Draw the Metropolis threshold -T*ln(u): a cost increase below it is accepted (same law as accept())."""
+    if temp <= 0:
+        return 0.0
+    return -temp * math.log(1.0 - random.random())
+
+def evaluate_sta(verilog_path, design_name, sdc_path, lib_path, spef_path=None, derate_tcl=DERATE_TCL, work_dir=None):
+    """Run STA through the configured backend if one is open, else as a one-shot OpenSTA run."""
+    if sta_backend is not None:
+        return sta_backend.run_sta(verilog_file=verilog_path, derate_tcl=derate_tcl)
+    return run_sta(
+        verilog_file=verilog_path,
+        design_name=design_name,
+        sdc_path=sdc_path,
+        lib_path=lib_path,
+        spef_path=spef_path,
+        derate_tcl=derate_tcl,
+        work_dir=work_dir
+    )
+
 # --- Cost Function ---
+# Area of each cell master; only used when LIB_FILE cannot be read (see load_liberty_data)
+CELL_AREAS = {
+    "AND2_X1": 2.0, "AND2_X2": 4.0, "AND2_X4": 8.0,
+    "AND3_X1": 3.0, "AND3_X2": 6.0, "AND3_X4": 12.0,
+    "AND4_X1": 4.0, "AND4_X2": 8.0, "AND4_X4": 16.0,
+    "AOI21_X1": 2.5, "AOI21_X2": 5.0, "AOI21_X4": 10.0,
+    "AOI22_X1": 3.0, "AOI22_X2": 6.0, "AOI22_X4": 12.0,
+    "BUF_X1": 1.0, "BUF_X2": 2.0, "BUF_X4": 4.0, "BUF_X8": 8.0, "BUF_X16": 16.0, "BUF_X32": 32.0,
+    "CLKBUF_X1": 1.5, "CLKBUF_X2": 3.0, "CLKBUF_X3": 4.5,
+    "DFF_X1": 5.0, "DFF_X2": 10.0,
+    "INV_X1": 1.0, "INV_X2": 2.0, "INV_X4": 4.0, "INV_X8": 8.0, "INV_X16": 16.0, "INV_X32": 32.0,
+    "NAND2_X1": 1.5, "NAND2_X2": 3.0, "NAND2_X4": 6.0,
+    "NAND3_X1": 2.0, "NAND3_X2": 4.0, "NAND3_X4": 8.0,
+    "NAND4_X1": 2.5, "NAND4_X2": 5.0, "NAND4_X4": 10.0,
+    "NOR2_X1": 1.5, "NOR2_X2": 3.0, "NOR2_X4": 6.0,
+    "NOR3_X1": 2.0, "NOR3_X2": 4.0, "NOR3_X4": 8.0,
+    "NOR4_X1": 2.5, "NOR4_X2": 5.0, "NOR4_X4": 10.0,
+    "OAI21_X1": 2.5, "OAI21_X2": 5.0, "OAI21_X4": 10.0,
+    "OAI22_X1": 3.0, "OAI22_X2": 6.0, "OAI22_X4": 12.0,
+    "OR2_X1": 2.0, "OR2_X2": 4.0, "OR2_X4": 8.0,
+    "OR3_X1": 2.5, "OR3_X2": 5.0, "OR3_X4": 10.0,
+    "OR4_X1": 3.0, "OR4_X2": 6.0, "OR4_X4": 12.0,
+    "TBUF_X1": 2.0, "TBUF_X2": 4.0, "TBUF_X4": 8.0, "TBUF_X8": 16.0, "TBUF_X16": 32.0,
+    "XNOR2_X1": 3.0, "XNOR2_X2": 6.0,
+    "XOR2_X1": 3.0, "XOR2_X2": 6.0
+}
+
+cell_areas = CELL_AREAS  # Active area table, replaced by the liberty areas in load_liberty_data()
+
+def load_liberty_data(lib_path=LIB_FILE):
+    """Use the liberty file's cell areas and drive families for cost and perturbation."""
+    global cell_areas
+    if not USE_LIBERTY_DATA:
+        return
+    try:
+        cell_areas = load_library_cached(lib_path).areas()
+    except (IOError, ValueError) as e:
+        print(f"[Warning] Could not read cell areas from {lib_path} ({e}), using the built-in table")
+        cell_areas = CELL_AREAS
+        return
+    init_sizing_targets(lib_path)
+
+@timed("sa.calculate_area")
 def calculate_area(verilog_path):
     """Calculate total area of the design."""
     try:
-        with open(verilog_path, 'r') as f:
-            content = f.read()
-            
-        # Count instances of each cell type and size
-        cell_areas = {
-            "AND2_X1": 2.0, "AND2_X2": 4.0, "AND2_X4": 8.0,
-            "AND3_X1": 3.0, "AND3_X2": 6.0, "AND3_X4": 12.0,
-            "AND4_X1": 4.0, "AND4_X2": 8.0, "AND4_X4": 16.0,
-            "AOI21_X1": 2.5, "AOI21_X2": 5.0, "AOI21_X4": 10.0,
-            "AOI22_X1": 3.0, "AOI22_X2": 6.0, "AOI22_X4": 12.0,
-            "BUF_X1": 1.0, "BUF_X2": 2.0, "BUF_X4": 4.0, "BUF_X8": 8.0, "BUF_X16": 16.0, "BUF_X32": 32.0,
-            "CLKBUF_X1": 1.5, "CLKBUF_X2": 3.0, "CLKBUF_X3": 4.5,
-            "DFF_X1": 5.0, "DFF_X2": 10.0,
-            "INV_X1": 1.0, "INV_X2": 2.0, "INV_X4": 4.0, "INV_X8": 8.0, "INV_X16": 16.0, "INV_X32": 32.0,
-            "NAND2_X1": 1.5, "NAND2_X2": 3.0, "NAND2_X4": 6.0,
-            "NAND3_X1": 2.0, "NAND3_X2": 4.0, "NAND3_X4": 8.0,
-            "NAND4_X1": 2.5, "NAND4_X2": 5.0, "NAND4_X4": 10.0,
-            "NOR2_X1": 1.5, "NOR2_X2": 3.0, "NOR2_X4": 6.0,
-            "NOR3_X1": 2.0, "NOR3_X2": 4.0, "NOR3_X4": 8.0,
-            "NOR4_X1": 2.5, "NOR4_X2": 5.0, "NOR4_X4": 10.0,
-            "OAI21_X1": 2.5, "OAI21_X2": 5.0, "OAI21_X4": 10.0,
-            "OAI22_X1": 3.0, "OAI22_X2": 6.0, "OAI22_X4": 12.0,
-            "OR2_X1": 2.0, "OR2_X2": 4.0, "OR2_X4": 8.0,
-            "OR3_X1": 2.5, "OR3_X2": 5.0, "OR3_X4": 10.0,
-            "OR4_X1": 3.0, "OR4_X2": 6.0, "OR4_X4": 12.0,
-            "TBUF_X1": 2.0, "TBUF_X2": 4.0, "TBUF_X4": 8.0, "TBUF_X8": 16.0, "TBUF_X16": 32.0,
-            "XNOR2_X1": 3.0, "XNOR2_X2": 6.0,
-            "XOR2_X1": 3.0, "XOR2_X2": 6.0
-        }
-        
-        total_area = 0.0
-        for cell_type, area in cell_areas.items():
-            count = content.count(cell_type)
-            total_area += count * area
-            
-        return total_area
-        
+        masters = read_instance_masters(verilog_path)
+        return sum(cell_areas.get(master, 0.0) for master in masters.values())
     except Exception as e:
         print(f"Error calculating area: {e}")
         return 0.0
 
-def calculate_cost(verilog_path, design_name, sdc_path, lib_path, spef_path=None):
-    """Calculate the cost of a solution based on timing and area."""
-    print(f"  [Cost] Evaluating {verilog_path} with {MC_TRIALS} MC trials...")
+@timed("sa.calculate_area")
+def calculate_model_area(netlist, sizes):
+    """Total area of a Netlist model under a sizing state, without writing Verilog."""
+    total_area = sum(cell_areas.get(master, 0.0) for master in netlist.inst_masters)
+    for k in range(len(sizes)):
+        if sizes[k] != netlist.base_sizes[k]:
+            total_area += cell_areas.get(netlist.master_of(k, sizes), 0.0) - cell_areas.get(netlist.master_of(k, netlist.base_sizes), 0.0)
+    return total_area
+
+def trial_timing_cost(wns, tns):
+    """Timing cost of one WNS/TNS pair; only violations (negative values) count."""
+    timing_cost = 0.0
+    if wns < 0:
+        timing_cost += abs(wns) * WNS_COST_WEIGHT  # Weight WNS violations more heavily
+    if tns < 0:
+        timing_cost += abs(tns)
+    return timing_cost
+
+@timed("sa.calculate_cost")
+def calculate_cost(verilog_path, design_name, sdc_path, lib_path, spef_path=None, work_dir=None, area=None, sizes=None,
+                   reference=None):
+    """Calculate the cost of a solution based on timing and area.
+
+    Derate files and STA reports go to work_dir (current directory if None).
+    The evaluation's timing data is left in last_timing_data for perturbation,
+    with the per-trial costs in 'trial_costs'. verilog_path=None evaluates
+    the design linked in sta_backend as is, or the sizing state sizes with
+    the timing engine; area must then be given since there is no file to
+    measure. With reference (see run_trials_adaptive) and ADAPTIVE_MC, STA
+    trials stop early and the outcome is left in last_timing_data['mc_decision'].
+    An accepted candidate still runs its remaining trials; a rejected one
+    keeps the early stop and is flagged by last_timing_data['partial'].
+    """
+    global last_timing_data
+    last_timing_data = None
+    num_trials = ENGINE_MC_TRIALS if timing_engine is not None else MC_TRIALS
+    log(f"  [Cost] Evaluating {verilog_path or ('sizing state' if sizes is not None else 'linked session design')} with {num_trials} MC trials...")
     wns_list = []
     tns_list = []
     successful_trials = 0
+    derate_tcl = os.path.join(work_dir, DERATE_TCL) if work_dir else DERATE_TCL
 
-    for i in range(MC_TRIALS):
-        # Generate new random derates for this trial
-        generate_derate(path=DERATE_TCL)
-        
-        # Run STA
-        wns, tns = run_sta(
-            verilog_file=verilog_path,
-            design_name=design_name,
-            sdc_path=sdc_path,
-            lib_path=lib_path,
-            spef_path=spef_path,
-            derate_tcl=DERATE_TCL
-        )
-        
+    # Calculate area cost
+    if area is None:
+        area = calculate_area(verilog_path)
+    area_cost = area / AREA_NORM_FACTOR  # Normalize area to similar scale as timing
+
+    engine_result = None
+    decision = None
+    partial = False  # Trials stopped early; the cost then covers only part of the derate samples
+    if timing_engine is not None:
+        # All samples at once; per-trial lines would swamp the log, so only the distribution is printed
+        engine_result = evaluate_engine(verilog_path, sizes, num_trials)
+        wns_list = engine_result['wns'].tolist()
+        tns_list = engine_result['tns'].tolist()
+        successful_trials = num_trials
+        trial_results = []
+        log(f"    [MC x{num_trials}] WNS = {np.mean(wns_list):+.4f} ± {np.std(wns_list):.4f} ns, "
+              f"TNS = {np.mean(tns_list):+.4f} ± {np.std(tns_list):.4f} ns, Yield = {100.0 * engine_result['yield']:.1f}%")
+    elif ADAPTIVE_MC and reference is not None:
+        derates = trial_derates(MC_TRIALS)
+        trial_results, decision = run_trials_adaptive(verilog_path, design_name, sdc_path, lib_path, spef_path,
+                                                      derates, derate_tcl, work_dir, reference, area_cost)
+        if decision and len(trial_results) < len(derates):
+            # An accepted candidate becomes the current state, whose cost and per-trial costs must cover every sample
+            trial_results += run_trials(verilog_path, design_name, sdc_path, lib_path, spef_path,
+                                        derates[len(trial_results):], derate_tcl, work_dir)
+        partial = len(trial_results) < len(derates)
+    else:
+        trial_results = run_trials(verilog_path, design_name, sdc_path, lib_path, spef_path, trial_derates(MC_TRIALS), derate_tcl, work_dir)
+
+    trial_costs = []  # Per-trial cost, aligned with the derate samples (None for failed trials)
+    show_trials = log_enabled("debug")
+    for i, (wns, tns) in enumerate(trial_results):
         if wns is not None and tns is not None:
             wns_list.append(wns)
             tns_list.append(tns)
+            trial_costs.append(TIMING_WEIGHT * trial_timing_cost(wns, tns) + AREA_WEIGHT * area_cost)
             successful_trials += 1
             # Print results for this trial
-            passed = (wns >= 0 and tns >= 0)
-            status = "✓ Pass" if passed else "✗ Fail"
-            print(f"    [Trial {i+1:02d}/{MC_TRIALS}] WNS = {wns:+.4f} ns, TNS = {tns:+.4f} ns -> {status}")
+            if show_trials:
+                passed = (wns >= 0 and tns >= 0)
+                status = "✓ Pass" if passed else "✗ Fail"
+                print(f"    [Trial {i+1:02d}/{MC_TRIALS}] WNS = {wns:+.4f} ns, TNS = {tns:+.4f} ns -> {status}")
         else:
-            print(f"    [Trial {i+1:02d}/{MC_TRIALS}] STA Failed")
+            trial_costs.append(None)
+            if show_trials:
+                print(f"    [Trial {i+1:02d}/{MC_TRIALS}] STA Failed")
     
     # Clean up derate file
-    if os.path.exists(DERATE_TCL):
-        os.remove(DERATE_TCL)
+    if os.path.exists(derate_tcl):
+        os.remove(derate_tcl)
     
     if not successful_trials:
         print("  [Cost] No successful STA trials. Assigning infinite cost.")
@@ -134,23 +366,28 @@ def calculate_cost(verilog_path, design_name, sdc_path, lib_path, spef_path=None
     avg_wns = sum(wns_list) / successful_trials
     avg_tns = sum(tns_list) / successful_trials
     
-    print(f"  [Cost] Average WNS = {avg_wns:+.4f} ns, Average TNS = {avg_tns:+.4f} ns")
+    log(f"  [Cost] Average WNS = {avg_wns:+.4f} ns, Average TNS = {avg_tns:+.4f} ns")
+    if engine_result is not None:
+        last_timing_data = collect_timing_data(avg_wns, avg_tns, None)
+        last_timing_data['gate_timing'] = engine_result['gate_timing']
+    elif sta_backend is not None and MC_MODE != "parallel":
+        last_timing_data = sta_backend.timing_data(avg_wns, avg_tns)
+    else:
+        last_timing_data = collect_timing_data(avg_wns, avg_tns, sta_runner.last_timing_report)
+    last_timing_data['trial_costs'] = trial_costs
+    last_timing_data['trials'] = trial_results  # [(wns, tns)] per STA trial, for the run journal
+    last_timing_data['yield'] = engine_result['yield'] if engine_result is not None else \
+        sum(1 for wns, tns in trial_results if wns is not None and tns is not None and wns >= 0 and tns >= 0) / len(trial_results)
+    last_timing_data['mc_decision'] = decision
+    last_timing_data['partial'] = partial
     
     # Calculate timing cost (negative values indicate violations)
-    timing_cost = 0.0
-    if avg_wns < 0:
-        timing_cost += abs(avg_wns) * 10.0  # Weight WNS violations more heavily
-    if avg_tns < 0:
-        timing_cost += abs(avg_tns)
-    
-    # Calculate area cost
-    area = calculate_area(verilog_path)
-    area_cost = area / AREA_NORM_FACTOR  # Normalize area to similar scale as timing
+    timing_cost = trial_timing_cost(avg_wns, avg_tns)
     
     # Combine costs with weights
     total_cost = (TIMING_WEIGHT * timing_cost) + (AREA_WEIGHT * area_cost)
     
-    print(f"  [Cost] Timing Cost = {timing_cost:.4f}, Area Cost = {area_cost:.4f}, Total Cost = {total_cost:.4f}")
+    log(f"  [Cost] Timing Cost = {timing_cost:.4f}, Area Cost = {area_cost:.4f}, Total Cost = {total_cost:.4f}")
     
     return total_cost
 
@@ -178,11 +415,184 @@ def accept(new_cost, old_cost, temp):
 
     return random.random() < probability
 
+def use_eco_changes():
+    """True if candidates can be evaluated as edits of the design linked in the STA backend."""
+    return USE_ECO_CHANGES and MC_MODE != "parallel" and sta_backend is not None and sta_backend.holds_design()
+
+@timed("sa.anneal_step")
+def anneal_step(netlist, current_sizes, current_cost, temp, candidate_path=CANDIDATE_NETLIST, work_dir=None, current_timing=None):
+    """Perturb the current sizing state, evaluate the candidate and apply the Metropolis test.
+
+    current_timing is the timing data of the last evaluation of the current
+    state; it spares perturbation a separate STA run. With an STA backend that
+    holds the design (session or stand-in) the move is applied to the linked
+    design and undone on rejection, so the backend always holds the current
+    state; otherwise the candidate is written to candidate_path for STA to read. Returns (accepted,
+    candidate_cost, candidate_timing, candidate_sizes); candidate_cost is None
+    if the candidate could not be written. The moves and evaluation time are
+    left in last_step.
+    """
+    global last_step
+    candidate_sizes, changes = perturb_sizes(netlist, current_sizes, current_timing, backend=sta_backend)
+    last_step = {'moves': changes, 'cached': False, 'eval_seconds': 0.0}
+    eval_start = time.perf_counter()
+    # Adaptive MC compares the candidate trial by trial with the current state's costs on the same derates
+    reference = None
+    if ADAPTIVE_MC and timing_engine is None and current_timing is not None \
+            and any(c is not None for c in current_timing.get('trial_costs', [])):
+        reference = (current_timing['trial_costs'], metropolis_threshold(temp))
+    with phase("sa.eval_cache"):
+        cached = eval_cache.get(candidate_sizes, cache_variant()) if eval_cache is not None else None
+    if cached is not None:
+        candidate_cost, candidate_timing = cached
+        last_step['cached'] = True
+        log("  [Cache] Sizing state evaluated before, skipping STA")
+    elif timing_engine is not None:
+        candidate_cost = calculate_cost(None, DESIGN_NAME, SDC_FILE, LIB_FILE, SPEF_FILE, work_dir=work_dir,
+                                        area=calculate_model_area(netlist, candidate_sizes), sizes=candidate_sizes)
+    elif use_eco_changes() and sta_backend.apply_changes(changes):
+        candidate_cost = calculate_cost(None, DESIGN_NAME, SDC_FILE, LIB_FILE, SPEF_FILE, work_dir=work_dir,
+                                        area=calculate_model_area(netlist, candidate_sizes), reference=reference)
+    else:
+        try:
+            netlist.write_verilog(candidate_path, candidate_sizes)
+        except IOError as e:
+            print(f"[ERROR] Could not write candidate netlist to {candidate_path}: {e}")
+            return False, None, None, current_sizes
+        candidate_cost = calculate_cost(candidate_path, DESIGN_NAME, SDC_FILE, LIB_FILE, SPEF_FILE, work_dir=work_dir,
+                                        reference=reference)
+    if cached is None:
+        candidate_timing = last_timing_data
+        # A rejection settled on a few trials is no cost of the full derate bank; never reuse it
+        if eval_cache is not None and not (candidate_timing or {}).get('partial'):
+            with phase("sa.eval_cache"):
+                eval_cache.put(candidate_sizes, candidate_cost, candidate_timing, cache_variant())
+    last_step['eval_seconds'] = time.perf_counter() - eval_start
+    log(f"  [Evaluate] Current Cost = {current_cost:.6f}, Candidate Cost = {candidate_cost:.6f}")
+
+    # An adaptive evaluation has already settled the Metropolis test against its threshold
+    decision = candidate_timing.get('mc_decision') if cached is None and candidate_timing is not None else None
+    if not (accept(candidate_cost, current_cost, temp) if decision is None else decision):
+        log("  [Reject] ✗ Rejected Candidate")
+        # A session that evaluated the candidate (either way) holds it now; roll it back
+        if cached is None and sta_backend is not None and sta_backend.holds_design():
+            sta_backend.undo_changes(changes)
+        return False, candidate_cost, candidate_timing, current_sizes
+    log("  [Accept] ✓ Accepted Candidate")
+    # A cached candidate never reached the session, which must follow the current state
+    if cached is not None and sta_backend is not None and sta_backend.holds_design():
+        sta_backend.apply_changes(changes)
+    return True, candidate_cost, candidate_timing, candidate_sizes
+
+def evaluate_current(netlist, sizes, path=CURRENT_NETLIST, work_dir=None, linked_sizes=None):
+    """Re-evaluate the current sizing state, e.g. after the derate bank was redrawn.
+
+    The session (if any) already holds the current state; otherwise, and in
+    parallel MC mode where the one-shot trials never see the session, it is
+    written to path. linked_sizes is the state the session holds if that is
+    not sizes (e.g. when the best state is re-evaluated): the session is
+    moved to sizes for the evaluation and back afterwards. Returns (cost,
+    timing_data).
+    """
+    cached = eval_cache.get(sizes, cache_variant()) if eval_cache is not None else None
+    if cached is not None:
+        return cached
+    area = calculate_model_area(netlist, sizes)
+    if timing_engine is not None:
+        cost = calculate_cost(None, DESIGN_NAME, SDC_FILE, LIB_FILE, SPEF_FILE, work_dir=work_dir, area=area, sizes=sizes)
+    elif sta_backend is not None and sta_backend.holds_design() and MC_MODE != "parallel":
+        if linked_sizes is not None:
+            sta_backend.sync_masters(netlist.sizable_masters(sizes))
+        cost = calculate_cost(None, DESIGN_NAME, SDC_FILE, LIB_FILE, SPEF_FILE, work_dir=work_dir, area=area)
+        if linked_sizes is not None:
+            sta_backend.sync_masters(netlist.sizable_masters(linked_sizes))
+    else:
+        netlist.write_verilog(path, sizes)
+        cost = calculate_cost(path, DESIGN_NAME, SDC_FILE, LIB_FILE, SPEF_FILE, work_dir=work_dir)
+    if eval_cache is not None:
+        eval_cache.put(sizes, cost, last_timing_data, cache_variant())
+    return cost, last_timing_data
+
+def start_derate_bank(seed=DERATE_SEED):
+    """Build the shared derate bank for the active backend's MC trial count, or None if disabled."""
+    if not USE_DERATE_BANK:
+        return None
+    num_trials = ENGINE_MC_TRIALS if timing_engine is not None else MC_TRIALS
+    mu, sigma_delay, sigma_check = sample_derates.__defaults__
+    bank = DerateBank(num_trials, seed, mu, sigma_delay, sigma_check, DERATE_SAMPLER)
+    print(f"[INFO] Derate bank: {num_trials} {DERATE_SAMPLER} samples, seed {bank.seed}, refreshed every {DERATE_REFRESH_STEPS or 'never'} steps")
+    return bank
+
+def run_context_key():
+    """Hash of the input files and the settings that change a cost; evaluations and checkpoints are tied to it."""
+    settings = {
+        "design": DESIGN_NAME,
+        "backend": TIMING_BACKEND,
+        "mc_trials": ENGINE_MC_TRIALS if TIMING_BACKEND == "engine" else MC_TRIALS,
+        "derates": sample_derates.__defaults__,  # (mu, sigma_delay, sigma_check)
+        "derate_sampler": DERATE_SAMPLER,
+        "adaptive_mc": (ADAPTIVE_MC, MC_MIN_TRIALS),
+        "weights": (TIMING_WEIGHT, AREA_WEIGHT, AREA_NORM_FACTOR),
+        "liberty_areas": USE_LIBERTY_DATA,
+    }
+    return settings_key([BASELINE_NETLIST, SDC_FILE, LIB_FILE, SPEF_FILE], settings)
+
+def start_eval_cache():
+    """Build the evaluation cache for the current input files and cost settings, or None if disabled."""
+    if not USE_EVAL_CACHE:
+        return None
+    return EvalCache(run_context_key(), EVAL_CACHE_SIZE, EVAL_CACHE_DB)
+
+@timed("sa.checkpoint")
+def write_checkpoint(netlist, temp, iteration, current_sizes, current_cost, current_timing, best_sizes, best_cost):
+    """Save everything needed to continue the run exactly where it is; the best netlist is written alongside."""
+    state = {
+        'temp': temp,
+        'iteration': iteration,
+        'current_sizes': current_sizes,
+        'current_cost': current_cost,
+        # The report file is rewritten by the next STA run, only the parsed index stays valid
+        'current_timing': dict(current_timing, timing_report=None) if current_timing is not None else None,
+        'best_sizes': best_sizes,
+        'best_cost': best_cost,
+        'cost_history': list(cost_history),
+        'random_state': random.getstate(),
+        'numpy_random_state': np.random.get_state(),
+        'derate_bank': (derate_bank.seed, derate_bank.generation) if derate_bank is not None else None,
+        'eval_cache': eval_cache.snapshot() if eval_cache is not None else None,
+    }
+    if save_checkpoint(CHECKPOINT_FILE, run_context_key(), state):
+        try:
+            netlist.write_verilog(BEST_NETLIST, best_sizes)
+        except IOError as e:
+            print(f"[Warning] Could not write best netlist with the checkpoint: {e}")
+        log(f"  [Checkpoint] Saved iteration {iteration} to {CHECKPOINT_FILE}")
+
+def start_timing_engine(netlist):
+    """Build the timing engine for a Netlist, or None (OpenSTA fallback) if the inputs are not supported."""
+    try:
+        return TimingEngine.from_files(netlist, SDC_FILE, LIB_FILE, SPEF_FILE)
+    except (IOError, ValueError, KeyError) as e:
+        print(f"[Warning] Could not build the timing engine ({e}), falling back to OpenSTA.")
+        return None
+
 # --- Simulated Annealing Main Loop ---
-def simulated_annealing():
-    """Performs the simulated annealing optimization."""
+def simulated_annealing(resume=False):
+    """Performs the simulated annealing optimization.
+
+    With resume the run continues from CHECKPOINT_FILE: sizing states,
+    temperature, costs, history, RNG states, derate bank and evaluation
+    cache are restored, so the remaining iterations match an uninterrupted run.
+    """
+    global sta_backend, timing_engine, eval_cache, derate_bank, MC_MODE
     temp = INIT_TEMP
     iteration = 0 # Overall iteration counter
+    set_log_level(LOG_LEVEL)
+    profiling.ENABLED = PROFILE_PHASES
+    profiling.reset()
+    run_start = time.perf_counter()
+    run_stamp = time.strftime("%Y%m%d-%H%M%S")
+    results_dir = "results"
 
     # --- Initialization ---
     print("[SA Init] Starting Simulated Annealing...")
@@ -194,72 +604,144 @@ def simulated_annealing():
             print(f"[FATAL ERROR] Required file not found: {f}. Exiting.")
             sys.exit(1)
 
+    checkpoint = None
+    if resume:
+        checkpoint = load_checkpoint(CHECKPOINT_FILE, run_context_key())
+        if checkpoint is None:
+            print(f"[FATAL ERROR] Cannot resume from {CHECKPOINT_FILE}. Exiting.")
+            sys.exit(1)
+
     # Clean up previous run files (optional but recommended)
     for f in [CURRENT_NETLIST, CANDIDATE_NETLIST, BEST_NETLIST, DERATE_TCL]:
         if os.path.exists(f):
             os.remove(f)
 
-    # Copy baseline to current and best to start
-    try:
-        shutil.copy(BASELINE_NETLIST, CURRENT_NETLIST)
-        shutil.copy(BASELINE_NETLIST, BEST_NETLIST)
-    except Exception as e:
-        print(f"[FATAL ERROR] Failed to copy baseline netlist: {e}. Exiting.")
-        sys.exit(1)
-
-    # Calculate initial cost
-    print("[SA Init] Calculating initial cost...")
-    current_cost = calculate_cost(CURRENT_NETLIST, DESIGN_NAME, SDC_FILE, LIB_FILE, SPEF_FILE)
-    if current_cost == float('inf'):
-        print("[FATAL ERROR] Initial baseline netlist failed STA. Cannot proceed. Check baseline files and setup.")
-        sys.exit(1)
+    # Liberty areas and drive families decide what is sizable, so load them before parsing
+    load_liberty_data()
+    init_net_loads(SPEF_FILE)  # SPEF net loads for load-aware move scoring
+
+    # Parse the baseline once; SA states are drive-size vectors over its sizable instances
+    netlist = Netlist.from_verilog(BASELINE_NETLIST, SIZABLE_CELL_BASES)
+    current_sizes = netlist.initial_sizes()
+    best_sizes = array('i', current_sizes)
+    print(f"[SA Init] Parsed {len(netlist.inst_names)} instances, {len(current_sizes)} sizable")
+
+    # Build the in-process timing graph, or open the STA backend (by default one persistent OpenSTA process)
+    if TIMING_BACKEND == "engine":
+        timing_engine = start_timing_engine(netlist)
+    if timing_engine is None:
+        sta_backend = open_sta_backend(STA_BACKEND, BASELINE_NETLIST, DESIGN_NAME, SDC_FILE, LIB_FILE, SPEF_FILE)
+        if sta_backend is None:
+            print("[FATAL ERROR] No STA backend available. Exiting.")
+            sys.exit(1)
+        if STA_BACKEND == "standin" and MC_MODE == "parallel":
+            MC_MODE = "batch"  # The stand-in runs in this process; a pool would launch OpenSTA instead
+
+    if checkpoint is not None:
+        # Continue from the checkpoint instead of re-evaluating the baseline
+        temp = checkpoint['temp']
+        iteration = checkpoint['iteration']
+        current_sizes = checkpoint['current_sizes']
+        current_cost = checkpoint['current_cost']
+        current_timing = checkpoint['current_timing']
+        best_sizes = checkpoint['best_sizes']
+        best_cost = checkpoint['best_cost']
+        cost_history[:] = checkpoint['cost_history']
+        if checkpoint['derate_bank'] is not None:
+            derate_bank = start_derate_bank(checkpoint['derate_bank'][0])
+            if derate_bank is not None:
+                derate_bank.redraw(checkpoint['derate_bank'][1])
+        eval_cache = start_eval_cache()
+        if eval_cache is not None and checkpoint['eval_cache'] is not None:
+            eval_cache.restore(checkpoint['eval_cache'])
+        # The session was loaded with the baseline; bring it to the checkpointed state
+        if sta_backend is not None:
+            sta_backend.sync_masters(netlist.sizable_masters(current_sizes))
+        random.setstate(checkpoint['random_state'])
+        np.random.set_state(checkpoint['numpy_random_state'])
+        print(f"[SA Init] Resumed from {CHECKPOINT_FILE} at iteration {iteration}, Temp = {temp:.6f}, "
+              f"Current Cost = {current_cost:.6f}, Best Cost = {best_cost:.6f}")
+    else:
+        derate_bank = start_derate_bank()
+
+        # Calculate initial cost
+        print("[SA Init] Calculating initial cost...")
+        current_cost = calculate_cost(BASELINE_NETLIST, DESIGN_NAME, SDC_FILE, LIB_FILE, SPEF_FILE)
+        current_timing = last_timing_data
+        if current_cost == float('inf'):
+            print("[FATAL ERROR] Initial baseline netlist failed STA. Cannot proceed. Check baseline files and setup.")
+            sys.exit(1)
+        eval_cache = start_eval_cache()
+        if eval_cache is not None:
+            eval_cache.put(current_sizes, current_cost, current_timing, cache_variant())
 
-    best_cost = current_cost
-    print(f"[SA Init] Initial Cost (Baseline) = {current_cost:.6f}")
+        best_cost = current_cost
+        print(f"[SA Init] Initial Cost (Baseline) = {current_cost:.6f}")
 
     # --- SA Loop ---
     max_total_iterations = MAX_ITER * int(math.log(FINAL_TEMP/INIT_TEMP) / math.log(ALPHA)) if ALPHA < 1 else MAX_ITER*100
     print(f"[SA RUN] Estimated total iterations ~{max_total_iterations}")
-
+    journal = Journal(JOURNAL_FILE) if JOURNAL_FILE else None
+    if journal is not None:
+        journal.record("start", time=time.time(), resumed=checkpoint is not None, iteration=iteration, temp=temp,
+                       current_cost=current_cost, best_cost=best_cost, init_temp=INIT_TEMP, final_temp=FINAL_TEMP,
+                       alpha=ALPHA, mc_trials=MC_TRIALS, mc_mode=MC_MODE, backend=TIMING_BACKEND,
+                       derate_sampler=DERATE_SAMPLER, derate_seed=derate_bank.seed if derate_bank is not None else None)
+
+    profiled_iterations = 0
     while temp > FINAL_TEMP and iteration < max_total_iterations : # Added total iteration limit
         iteration += 1
-        print(f"\n[Iter {iteration}] Temp = {temp:.6f}")
+        iteration_start = time.perf_counter()
+        if profiled_iterations < CPROFILE_ITERATIONS:
+            profiling.start_cprofile()
+            profiled_iterations += 1
+        elif profiling.cprofile_running():
+            stats_path = profiling.stop_cprofile(os.path.join(results_dir, f"sa_cprofile_{run_stamp}.prof"))
+            print(f"[Profile] cProfile of {CPROFILE_ITERATIONS} iterations saved to {stats_path}")
+        log(f"\n[Iter {iteration}] Temp = {temp:.6f}")
+
+        # Move the derate bank on; the current and best states are re-evaluated so all comparisons share samples
+        if derate_bank is not None and DERATE_REFRESH_STEPS and iteration % DERATE_REFRESH_STEPS == 0:
+            derate_bank.redraw()
+            log(f"  [Derates] Redrew derate bank (generation {derate_bank.generation}), re-evaluating current and best states")
+            current_cost, current_timing = evaluate_current(netlist, current_sizes)
+            best_cost = current_cost if best_sizes == current_sizes else \
+                evaluate_current(netlist, best_sizes, CANDIDATE_NETLIST, linked_sizes=current_sizes)[0]
+            if current_cost < best_cost:
+                best_cost = current_cost
+                best_sizes = array('i', current_sizes)
 
-        # 1. Perturb: Generate a candidate solution from the current one
-        print(f"  [Perturb] Generating candidate from {CURRENT_NETLIST}")
-        perturbed_path = perturb_netlist(CURRENT_NETLIST, CANDIDATE_NETLIST)
+        # 1-3. Perturb, evaluate and accept or reject the candidate
+        accepted, candidate_cost, candidate_timing, current_sizes = anneal_step(
+            netlist, current_sizes, current_cost, temp, current_timing=current_timing)
 
-        if perturbed_path is None:
+        if candidate_cost is None:
             print("  [!] Perturbation failed. Skipping this iteration.")
             # Optionally cool down anyway, or retry perturbation
             # temp *= ALPHA # Example: Cool down even on failure
             continue
 
-        # 2. Evaluate: Calculate the cost of the candidate solution
-        candidate_cost = calculate_cost(CANDIDATE_NETLIST, DESIGN_NAME, SDC_FILE, LIB_FILE, SPEF_FILE)
-        print(f"  [Evaluate] Current Cost = {current_cost:.6f}, Candidate Cost = {candidate_cost:.6f}")
-
-        # 3. Decide: Accept or reject the candidate
-        if accept(candidate_cost, current_cost, temp):
-            print("  [Accept] ✓ Accepted Candidate")
+        if accepted:
             current_cost = candidate_cost
-            try:
-                shutil.copy(CANDIDATE_NETLIST, CURRENT_NETLIST) # Update current state
-            except Exception as e:
-                 print(f"  [Warning] Failed to copy candidate to current: {e}")
-
+            current_timing = candidate_timing
 
             # Check if this is the best solution found so far
             if current_cost < best_cost:
                 print(f"  [Best]   🚀 New Best Found! Cost = {current_cost:.6f}")
                 best_cost = current_cost
-                try:
-                    shutil.copy(CURRENT_NETLIST, BEST_NETLIST) # Save the new best
-                except Exception as e:
-                    print(f"  [Warning] Failed to copy current to best: {e}")
-        else:
-            print("  [Reject] ✗ Rejected Candidate")
-            # Current state remains unchanged (CURRENT_NETLIST and current_cost)
+                best_sizes = array('i', current_sizes) # Save the new best
+        # On rejection the current state remains unchanged (current_sizes and current_cost)
+
+        if journal is not None:
+            trials = candidate_timing.get('trials', []) if candidate_timing is not None else []
+            journal.record("iteration", iteration=iteration, temp=temp, accepted=accepted,
+                           current_cost=current_cost, candidate_cost=candidate_cost, best_cost=best_cost,
+                           wns=candidate_timing['wns'] if candidate_timing is not None else None,
+                           tns=candidate_timing['tns'] if candidate_timing is not None else None,
+                           timing_yield=candidate_timing.get('yield') if candidate_timing is not None else None,
+                           trials=trials, moves=last_step['moves'], cached=last_step['cached'],
+                           derate_generation=derate_bank.generation if derate_bank is not None else None,
+                           eval_seconds=last_step['eval_seconds'], seconds=time.perf_counter() - iteration_start)
 
         # 4. Cool down (typically after a fixed number of iterations at a temp,
         # or after each iteration as done here)
@@ -269,12 +751,26 @@ def simulated_annealing():
         # time.sleep(0.01) # Optional small delay
         cost_history.append(current_cost)
 
+        if CHECKPOINT_EVERY and iteration % CHECKPOINT_EVERY == 0:
+            write_checkpoint(netlist, temp, iteration, current_sizes, current_cost, current_timing, best_sizes, best_cost)
+
         # Clean up candidate file (optional, saves disk space)
         # if os.path.exists(CANDIDATE_NETLIST): os.remove(CANDIDATE_NETLIST)
 
 # ... inside simulated_annealing function, after SA loop finishes ...
 
+    if profiling.cprofile_running():
+        stats_path = profiling.stop_cprofile(os.path.join(results_dir, f"sa_cprofile_{run_stamp}.prof"))
+        print(f"[Profile] cProfile of {profiled_iterations} iterations saved to {stats_path}")
+
     # --- End of SA ---
+    # Verilog for the final states is only written once, at the end
+    try:
+        netlist.write_verilog(CURRENT_NETLIST, current_sizes)
+        netlist.write_verilog(BEST_NETLIST, best_sizes)
+    except IOError as e:
+        print(f"[ERROR] Failed to write final netlists: {e}")
+
     print(f"\n[SA Done] Simulated Annealing Finished.")
     print(f"  Final Temperature = {temp:.6f}")
     # print(f"  Total Iterations = {total_iterations}") # Assuming you used the modified loop
@@ -282,6 +778,14 @@ def simulated_annealing():
     # print(f"  Total Iterations = {iteration}") # If you used the original loop structure
     print(f"  Best Cost Found = {best_cost:.6f}")
     print(f"  Best netlist saved to: {BEST_NETLIST}")
+    if eval_cache is not None:
+        eval_cache.report()
+        eval_cache.close()
+    if journal is not None:
+        journal.record("done", iteration=iteration, temp=temp, current_cost=current_cost, best_cost=best_cost,
+                       seconds=time.perf_counter() - run_start)
+        journal.close()
+        print(f"  Run journal appended to: {JOURNAL_FILE}")
 
     # --- Final Comparison ---
     print("\n[Info] Comparing Initial Baseline vs Final Best Netlist (Nominal STA)...")
@@ -289,7 +793,7 @@ def simulated_annealing():
     # Run nominal STA (no derates) for Baseline
     print("\n🟢 Baseline (Initial) Nominal STA:")
     generate_derate(path=DERATE_TCL, mu=1.0, sigma_delay=0, sigma_check=0) # Nominal
-    wns_base, tns_base = run_sta(BASELINE_NETLIST, DESIGN_NAME, SDC_FILE, LIB_FILE, SPEF_FILE, DERATE_TCL)
+    wns_base, tns_base = evaluate_sta(BASELINE_NETLIST, DESIGN_NAME, SDC_FILE, LIB_FILE, SPEF_FILE, DERATE_TCL)
     if wns_base is not None:
         print(f"  Nominal WNS (Baseline) = {wns_base:+.4f} ns")
         print(f"  Nominal TNS (Baseline) = {tns_base:+.4f} ns")
@@ -305,7 +809,7 @@ def simulated_annealing():
         wns_best, tns_best = None, None # Ensure they are None
     else:
         generate_derate(path=DERATE_TCL, mu=1.0, sigma_delay=0, sigma_check=0) # Nominal
-        wns_best, tns_best = run_sta(BEST_NETLIST, DESIGN_NAME, SDC_FILE, LIB_FILE, SPEF_FILE, DERATE_TCL)
+        wns_best, tns_best = evaluate_sta(BEST_NETLIST, DESIGN_NAME, SDC_FILE, LIB_FILE, SPEF_FILE, DERATE_TCL)
         if wns_best is not None:
             print(f"  Nominal WNS (Best) = {wns_best:+.4f} ns")
             print(f"  Nominal TNS (Best) = {tns_best:+.4f} ns")
@@ -348,6 +852,20 @@ def simulated_annealing():
         except OSError:
             pass
 
+    if sta_backend is not None:
+        sta_backend.close()
+        sta_backend = None
+    timing_engine = None
+    shutdown_worker_pool()
+
+    if PROFILE_PHASES:
+        run_wall = time.perf_counter() - run_start
+        profile_path = os.path.join(results_dir, f"sa_phase_profile_{run_stamp}.txt")
+        print("\n⏱️  Phase Profile:")
+        print(profiling.summary_table(run_wall))
+        profiling.write_summary(profile_path, run_wall)
+        print(f"Saved phase profile as {profile_path}")
+
     # Save SA Cost Curve
     plt.plot(cost_history)
     plt.xlabel("Iteration")
@@ -370,7 +888,6 @@ def simulated_annealing():
                    fontsize=8, va='bottom', ha='left', bbox=dict(facecolor='white', alpha=0.7, edgecolor='none'))
 
     # --- Save plot with SA parameters in filename, in 'results' folder ---
-    results_dir = "results"
     if not os.path.exists(results_dir):
         os.makedirs(results_dir)
     plot_filename = f"sa_cost_curve_INIT_TEMP-{INIT_TEMP}_FINAL_TEMP-{FINAL_TEMP}_ALPHA-{ALPHA}_MAX_ITER-{MAX_ITER}.png"
@@ -381,4 +898,8 @@ def simulated_annealing():
 
 # --- Main Execution ---
 if __name__ == "__main__":
-    simulated_annealing()
\ No newline at end of file
+    # python3 simulated_annealing.py [--resume] [--log-level=quiet|info|debug]
+    for arg in sys.argv[1:]:
+        if arg.startswith("--log-level="):
+            LOG_LEVEL = arg.split("=", 1)[1]
+    simulated_annealing(resume="--resume" in sys.argv)
\ No newline at end of file
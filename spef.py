@@ -0,0 +1,164 @@
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+from liberty import file_hash
+
+C_UNITS = {"PF": 1.0, "FF": 1e-3}        # SPEF *C_UNIT -> pF
+R_UNITS = {"OHM": 1.0, "KOHM": 1e3}      # SPEF *R_UNIT -> ohm
+SPEF_CACHE_DIR = ".spef_cache"  # Columnar .npy caches, one directory per SPEF content hash
+CACHE_VERSION = 1  # Bump when the cached columns change
+COLUMNS = ("total_cap", "gnd_net", "gnd_cap", "cc_net", "cc_other", "cc_cap", "res_net", "res_value")
+
+def spef_name(name):
+    """Net name as the netlist model keys it: SPEF escapes are dropped."""
+    return name.replace("\\", "")
+
+class SpefData:
+    """Parasitics of a SPEF file as columnar arrays.
+
+    Nets are indexed by position in net_names. Ground caps, coupling caps
+    and resistors are flat arrays tagged with their net (cc_other is the
+    net on the far side of a coupling cap, -1 if it cannot be resolved).
+    Caps are in pF, resistances in ohm.
+    """
+
+    def __init__(self, net_names, columns):
+        self.net_names = net_names
+        self.net_index = {name: k for k, name in enumerate(net_names)}
+        for name in COLUMNS:
+            setattr(self, name, columns[name])
+
+    def net_caps(self):
+        """{net: total capacitance in pF}."""
+        return dict(zip(self.net_names, self.total_cap.tolist()))
+
+    def coupling_caps(self):
+        """Total coupling capacitance of each net (pF), indexed like net_names."""
+        return np.bincount(self.cc_net, weights=self.cc_cap, minlength=len(self.net_names))
+
+    def net_resistance(self):
+        """Sum of resistor values of each net (ohm), indexed like net_names."""
+        return np.bincount(self.res_net, weights=self.res_value, minlength=len(self.net_names))
+
+def parse_spef(spef_path):
+    """Parse name map, *D_NET totals, *CONN pins, *CAP and *RES sections into SpefData."""
+    name_map = {}
+    c_scale = 1.0
+    r_scale = 1.0
+    net_names = []
+    total_cap = []
+    pin_net = {}  # "inst:pin" or port -> net index, from *CONN
+    gnd_net, gnd_cap = [], []
+    cc_net, cc_other, cc_cap = [], [], []
+    res_net, res_value = [], []
+    section = None
+    net = -1
+
+    def resolve(token):
+        if token.startswith("*"):
+            head, sep, tail = token.partition(":")
+            token = name_map.get(head, head[1:]) + sep + tail
+        return spef_name(token)
+
+    with open(spef_path, 'r') as f:
+        for line in f:
+            fields = line.split()
+            if not fields or fields[0].startswith("//"):
+                continue
+            keyword = fields[0]
+            if keyword.startswith("*") and not keyword[1:].isdigit():
+                if keyword == "*C_UNIT":
+                    c_scale = float(fields[1]) * C_UNITS.get(fields[2].upper(), 1.0)
+                elif keyword == "*R_UNIT":
+                    r_scale = float(fields[1]) * R_UNITS.get(fields[2].upper(), 1.0)
+                elif keyword == "*D_NET":
+                    net = len(net_names)
+                    net_names.append(resolve(fields[1]))
+                    total_cap.append(float(fields[2]) * c_scale)
+                elif keyword in ("*I", "*P") and section == "*CONN":
+                    pin_net[resolve(fields[1])] = net
+                    continue
+                section = keyword
+                continue
+            if section == "*NAME_MAP" and len(fields) == 2:
+                name_map[keyword] = fields[1]
+            elif section == "*CAP" and len(fields) == 3:
+                gnd_net.append(net)
+                gnd_cap.append(float(fields[2]) * c_scale)
+            elif section == "*CAP" and len(fields) == 4:
+                cc_net.append(net)
+                cc_other.append(resolve(fields[2]))
+                cc_cap.append(float(fields[3]) * c_scale)
+            elif section == "*RES" and len(fields) == 4:
+                res_net.append(net)
+                res_value.append(float(fields[3]) * r_scale)
+
+    # Far-side nodes are internal net nodes (net:12) or pins listed in another net's *CONN
+    net_index = {name: k for k, name in enumerate(net_names)}
+    other = []
+    for node in cc_other:
+        k = pin_net.get(node)
+        if k is None:
+            k = net_index.get(node.rsplit(":", 1)[0] if ":" in node else node, -1)
+        other.append(k)
+
+    columns = {
+        "total_cap": np.array(total_cap, dtype=np.float64),
+        "gnd_net": np.array(gnd_net, dtype=np.int32),
+        "gnd_cap": np.array(gnd_cap, dtype=np.float64),
+        "cc_net": np.array(cc_net, dtype=np.int32),
+        "cc_other": np.array(other, dtype=np.int32),
+        "cc_cap": np.array(cc_cap, dtype=np.float64),
+        "res_net": np.array(res_net, dtype=np.int32),
+        "res_value": np.array(res_value, dtype=np.float64),
+    }
+    return SpefData(net_names, columns)
+
+def load_spef(spef_path, cache_dir=SPEF_CACHE_DIR):
+    """parse_spef() through a memory-mapped .npy cache keyed by the file's content hash."""
+    start = time.time()
+    key = file_hash(spef_path)[:16]
+    cache_path = os.path.join(cache_dir, f"{os.path.basename(spef_path)}-{key}-v{CACHE_VERSION}")
+    if os.path.isdir(cache_path):
+        try:
+            with open(os.path.join(cache_path, "nets.txt"), 'r') as f:
+                net_names = f.read().split("\n")[:-1]
+            columns = {name: np.load(os.path.join(cache_path, f"{name}.npy"), mmap_mode='r') for name in COLUMNS}
+            print(f"[INFO] Mapped SPEF cache {cache_path} in {1000.0 * (time.time() - start):.1f} ms")
+            return SpefData(net_names, columns)
+        except (OSError, ValueError) as e:
+            print(f"[Warning] Ignoring unreadable SPEF cache {cache_path}: {e}")
+
+    data = parse_spef(spef_path)
+    print(f"[INFO] Parsed SPEF {spef_path} ({len(data.net_names)} nets) in {1000.0 * (time.time() - start):.1f} ms")
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(tmp_path, exist_ok=True)
+        with open(os.path.join(tmp_path, "nets.txt"), 'w') as f:
+            f.writelines(name + "\n" for name in data.net_names)
+        for name in COLUMNS:
+            np.save(os.path.join(tmp_path, f"{name}.npy"), getattr(data, name))
+        if os.path.isdir(cache_path):
+            shutil.rmtree(cache_path)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"[Warning] Could not write SPEF cache {cache_path}: {e}")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return data
+
+# --- Standalone Test Block ---
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python3 spef.py <design.spef>")
+        sys.exit(1)
+    spef = load_spef(sys.argv[1])
+    coupling = spef.coupling_caps()
+    resistance = spef.net_resistance()
+    print(f"[INFO] {len(spef.net_names)} nets, total capacitance {spef.total_cap.sum():.6f} pF, "
+          f"{len(spef.cc_cap)} coupling caps ({np.count_nonzero(spef.cc_other < 0)} unresolved), {len(spef.res_value)} resistors")
+    for k in np.argsort(-spef.total_cap)[:10]:
+        print(f"  {spef.net_names[k]}: {spef.total_cap[k]:.6f} pF (coupling {coupling[k]:.6f} pF), R = {resistance[k]:.2f} ohm")
@@ -0,0 +1,581 @@
+import os
+import re
+import subprocess
+import zlib
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+import sta_runner
+from netlist import split_master
+from profiling import timed
+from sta_runner import (EXPORT_PROCS, SESSION_SENTINEL, collect_timing_data, derate_sweep_commands,
+                        invalidate_timing_index, parse_export_metrics, parse_sweep_reports, parse_tns, parse_wns,
+                        read_instance_masters, remove_reports, report_commands, run_sta, run_sta_batch,
+                        tcl_instance_name)
+from telemetry import log
+
+# Backends the optimizer can be configured with (simulated_annealing.STA_BACKEND):
+#   "oneshot": a fresh OpenSTA process per evaluation, talking through Tcl scripts and report files
+#   "session": one OpenSTA process that keeps the design linked (OpenSTASession)
+#   "standin": deterministic in-process timing model, no OpenSTA needed (tests, benchmarks, dry runs)
+STA_BACKENDS = ("oneshot", "session", "standin")
+
+# --- Stand-in Timing Model ---
+STANDIN_WNS = -0.03          # WNS of the design as first loaded, at nominal derates
+STANDIN_PATH_DEPTH = 12      # Average number of cells on a stand-in path
+STANDIN_STAGE_DELAY = 0.05   # Delay in ns of an average size-1 cell stage
+STANDIN_CHECK_TIME = 0.05    # Setup time in ns that the cell_check derate scales
+
+DERATE_SETTING = re.compile(r'-cell_(delay|check)\s+([-+\d.eE]+)')
+
+class STABackend(ABC):
+    """Interface of the STA engines the optimizer drives.
+
+    A backend is opened for one design (netlist, SDC, liberty, SPEF) and
+    evaluates sizing variants of it:
+
+      start()                  load the design; False if the backend is unusable
+      holds_design()           True if a linked design is kept between calls: then
+                               apply_changes()/undo_changes() edit it and
+                               verilog_file=None evaluates it as is
+      apply_changes(changes)   apply a move [(instance, old_master, new_master)]
+      undo_changes(changes)    roll a move back
+      sync_masters(masters)    make every (instance, master) pair hold
+      run_sta(verilog_file, derate_tcl)     -> (wns, tns) under one derate file
+      run_sta_batch(verilog_file, derates)  -> [(wns, tns)] per (cell_delay, cell_check) pair
+      timing_data(wns, tns)    collect_timing_data() bundle of the last evaluation,
+                               including its per-instance slack/delay table
+      evaluate_moves(moves)    -> [(wns, tns)] at nominal derates with each move
+                               applied alone and undone again (what-if analysis);
+                               None without a linked design
+      close()
+
+    Failed evaluations return (None, None). Subclasses must implement
+    run_sta() and run_sta_batch(); the other methods default to a backend
+    without a linked design.
+    """
+
+    def start(self):
+        return True
+
+    def is_running(self):
+        return True
+
+    def holds_design(self):
+        return False
+
+    def apply_changes(self, changes):
+        return False
+
+    def undo_changes(self, changes):
+        return False
+
+    def sync_masters(self, masters):
+        return False
+
+    @abstractmethod
+    def run_sta(self, verilog_file="design.v", derate_tcl="derate.tcl"):
+        pass
+
+    @abstractmethod
+    def run_sta_batch(self, verilog_file="design.v", derates=()):
+        pass
+
+    def timing_data(self, wns, tns):
+        return collect_timing_data(wns, tns, sta_runner.last_timing_report)
+
+    @timed("sta.what_if")
+    def evaluate_moves(self, moves):
+        if not self.holds_design():
+            return None
+        results = []
+        for changes in moves:
+            if not self.apply_changes(changes):
+                return None
+            results.append(self.run_sta(verilog_file=None, derate_tcl=None))
+            if not self.undo_changes(changes):
+                return None
+        return results
+
+    def close(self):
+        pass
+
+class OneShotSTA(STABackend):
+    """A new OpenSTA process per evaluation (sta_runner.run_sta / run_sta_batch).
+
+    Every call reads the whole design again, so nothing is kept between
+    evaluations and candidates always come as netlist files.
+    """
+
+    def __init__(self, verilog_file="design.v", design_name="gcd", sdc_path="design.sdc", lib_path="my.lib", spef_path="design.spef", work_dir=None):
+        self.design_name = design_name
+        self.sdc_path = sdc_path
+        self.lib_path = lib_path
+        self.spef_path = spef_path
+        self.work_dir = work_dir  # Directory for scripts and reports (current directory if None)
+
+    def run_sta(self, verilog_file="design.v", derate_tcl="derate.tcl"):
+        if verilog_file is None:
+            return None, None
+        return run_sta(verilog_file, self.design_name, self.sdc_path, self.lib_path, self.spef_path, derate_tcl,
+                       work_dir=self.work_dir)
+
+    def run_sta_batch(self, verilog_file="design.v", derates=()):
+        if verilog_file is None:
+            return [(None, None)] * len(derates)
+        return run_sta_batch(verilog_file, self.design_name, self.sdc_path, self.lib_path, self.spef_path, derates,
+                             work_dir=self.work_dir)
+
+class OpenSTASession(STABackend):
+    """A long-lived OpenSTA process driven over a stdin/stdout Tcl pipe.
+
+    The liberty, netlist, SDC and parasitics are loaded once. Each later
+    run_sta() call only issues replace_cell for instances whose master differs
+    from the linked design, re-applies the derates and writes the reports.
+    Callers that already know the move can instead apply_changes() a list of
+    (instance, old_master, new_master) edits, evaluate with verilog_file=None
+    and undo_changes() to roll a rejected candidate back. This is the
+    "session" backend.
+    """
+
+    def __init__(self, verilog_file="design.v", design_name="gcd", sdc_path="design.sdc", lib_path="my.lib", spef_path="design.spef", opensta_cmd=None, work_dir=None):
+        self.verilog_file = verilog_file
+        self.design_name = design_name
+        self.sdc_path = sdc_path
+        self.lib_path = lib_path
+        self.spef_path = spef_path
+        self.opensta_cmd = opensta_cmd or sta_runner.OPENSTA_CMD
+        self.work_dir = work_dir  # Directory for this session's reports (current directory if None)
+        if work_dir:
+            os.makedirs(work_dir, exist_ok=True)
+        self.proc = None
+        self.masters = {}  # Masters currently linked in the session, keyed by instance
+        self.timing_report = None  # Path report of the last evaluation
+
+    @timed("sta.session_start")
+    def start(self):
+        """Launch OpenSTA and load the library, design, SDC and parasitics."""
+        self.close()
+        print(f"[INFO] Starting persistent OpenSTA session: {self.opensta_cmd}")
+        try:
+            self.proc = subprocess.Popen([self.opensta_cmd, "-no_splash"],
+                                         stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE,
+                                         stderr=subprocess.STDOUT,
+                                         text=True,
+                                         bufsize=1)
+        except OSError as e:
+            print(f"[ERROR] Failed to start OpenSTA session: {e}")
+            self.proc = None
+            return False
+        ok, output = self.execute([f"read_liberty {self.lib_path}"] + (EXPORT_PROCS if sta_runner.STA_EXPORT else []))
+        if not ok:
+            print("[ERROR] OpenSTA session failed to read the liberty file")
+            print(output)
+            return False
+        return self.load_design(self.verilog_file)
+
+    @timed("sta.session_design_load")
+    def load_design(self, verilog_file):
+        """Read and link a netlist, then re-apply the SDC and parasitics."""
+        commands = [
+            f"read_verilog {verilog_file}",
+            f"link_design {self.design_name}",
+            f"read_sdc {self.sdc_path}",
+        ]
+        if self.spef_path and os.path.exists(self.spef_path):
+            commands.append(f"read_spef {self.spef_path}")
+        else:
+            print(f"[Warning] SPEF file '{self.spef_path}' not found or specified, skipping read_spef.")
+        ok, output = self.execute(commands)
+        if ok:
+            self.masters = read_instance_masters(verilog_file)
+        else:
+            print("[ERROR] OpenSTA session failed to load the design")
+            print(output)
+        return ok
+
+    def execute(self, commands):
+        """Send Tcl commands and block until the session has processed them.
+
+        Returns (ok, output) where output is everything OpenSTA printed.
+        """
+        if self.proc is None or self.proc.poll() is not None:
+            return False, "OpenSTA session is not running"
+        body = "\n".join(commands)
+        script = (
+            f"if {{[catch {{\n{body}\n}} sta_err]}} {{ puts \"ERROR: $sta_err\" }}\n"
+            f"puts {SESSION_SENTINEL}\n"
+            "flush stdout\n"
+        )
+        try:
+            self.proc.stdin.write(script)
+            self.proc.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            return False, f"Failed to write to OpenSTA session: {e}"
+        output = []
+        ok = True
+        for line in self.proc.stdout:
+            if line.strip().endswith(SESSION_SENTINEL):
+                return ok, "".join(output)
+            if line.startswith("ERROR:") or line.startswith("Error:"):
+                ok = False
+            output.append(line)
+        return False, "".join(output) + "\nOpenSTA session exited unexpectedly"
+
+    def is_running(self):
+        """True if the OpenSTA process is alive."""
+        return self.proc is not None and self.proc.poll() is None
+
+    def holds_design(self):
+        """True if a linked design is kept for apply_changes() and verilog_file=None evaluations."""
+        return self.is_running()
+
+    def sync_netlist(self, verilog_file):
+        """Bring the session design in line with a netlist file.
+
+        Returns the list of (instance, master) changes that still have to be
+        sent as replace_cell commands, or None if the session is unusable.
+        """
+        if not self.is_running():
+            if not self.start():
+                return None
+        try:
+            masters = read_instance_masters(verilog_file)
+        except IOError as e:
+            print(f"[ERROR] Failed to read netlist {verilog_file}: {e}")
+            return None
+
+        # A structurally different netlist cannot be reached with replace_cell
+        if masters.keys() != self.masters.keys():
+            print(f"[INFO] Netlist {verilog_file} differs structurally from the session design, reloading")
+            if not self.load_design(verilog_file):
+                return None
+        return [(inst, master) for inst, master in masters.items() if self.masters[inst] != master]
+
+    @timed("sta.session_evaluate")
+    def evaluate(self, changes, commands):
+        """Apply replace_cell changes followed by commands; False if the session failed."""
+        commands = [f"replace_cell {tcl_instance_name(inst)} {master}" for inst, master in changes] + commands
+        ok, output = self.execute(commands)
+        if not ok:
+            print("[ERROR] OpenSTA session evaluation failed")
+            print(output)
+            # The linked masters are unknown after a partial failure; reload next time
+            self.close()
+            return False
+        self.masters.update(changes)
+        return True
+
+    def sync_masters(self, masters):
+        """Replace cells so each (instance, master) pair holds in the linked design.
+
+        Pairs that already hold are skipped. Returns False if the session is
+        not running or OpenSTA rejected a replace_cell; the session is then
+        closed and the next netlist-based run reloads it.
+        """
+        if not self.is_running():
+            return False
+        changes = [(inst, master) for inst, master in masters if self.masters.get(inst) != master]
+        if not changes:
+            return True
+        for inst, _ in changes:
+            if inst not in self.masters:
+                print(f"[ERROR] Instance {inst} is not in the session design")
+                return False
+        return self.evaluate(changes, [])
+
+    def apply_changes(self, changes):
+        """Apply an ECO move given as [(instance, old_master, new_master)]."""
+        return self.sync_masters((inst, new_master) for inst, _, new_master in changes)
+
+    def undo_changes(self, changes):
+        """Roll back a move applied with apply_changes()."""
+        return self.sync_masters((inst, old_master) for inst, old_master, _ in reversed(changes))
+
+    def linked_changes(self, verilog_file):
+        """Changes needed for verilog_file; with None the linked design is evaluated as is."""
+        if verilog_file is None:
+            return [] if self.is_running() else None
+        return self.sync_netlist(verilog_file)
+
+    def report_path(self, name):
+        """Location of a report file inside the session's work directory."""
+        return os.path.join(self.work_dir, name) if self.work_dir else name
+
+    def run_sta(self, verilog_file="design.v", derate_tcl="derate.tcl", timing_report=None, wns_report=None, tns_report=None):
+        """Evaluate a sizing variant of the loaded design and return WNS and TNS.
+
+        verilog_file=None evaluates the currently linked design (see apply_changes).
+        """
+        export_file = self.report_path("sta_export.csv") if sta_runner.STA_EXPORT else None
+        timing_report = export_file or timing_report or self.report_path("timing.txt")
+        wns_report = wns_report or self.report_path("wns.txt")
+        tns_report = tns_report or self.report_path("tns.txt")
+        changes = self.linked_changes(verilog_file)
+        if changes is None:
+            return None, None
+
+        commands = ["unset_timing_derate"]
+        if derate_tcl and os.path.exists(derate_tcl):
+            commands.append(f"source {derate_tcl}")
+        else:
+            print(f"[Warning] Derate file '{derate_tcl}' not found or specified, skipping derate source.")
+        commands += report_commands(timing_report, wns_report, tns_report, export_file)
+        remove_reports(export_file or timing_report)
+        invalidate_timing_index(timing_report)
+        if not self.evaluate(changes, commands):
+            return None, None
+
+        if export_file:
+            wns, tns = parse_export_metrics(export_file, 1)[0]
+        else:
+            wns = parse_wns(wns_report)
+            tns = parse_tns(tns_report)
+        if wns is None or tns is None:
+            print("[WARNING] Failed to parse timing reports")
+            return None, None
+        log(f"[INFO] Session ({len(changes)} cells replaced) WNS: {wns:.4f} ns, TNS: {tns:.4f} ns", "debug")
+        sta_runner.last_timing_report = self.timing_report = timing_report
+        return wns, tns
+
+    def run_sta_batch(self, verilog_file="design.v", derates=(), wns_report=None, tns_report=None):
+        """Evaluate every (cell_delay, cell_check) pair in one round trip.
+
+        Returns a list of (wns, tns) in the order of derates.
+        """
+        wns_report = wns_report or self.report_path("wns_mc.txt")
+        tns_report = tns_report or self.report_path("tns_mc.txt")
+        export_file = self.report_path("sta_export_mc.csv") if sta_runner.STA_EXPORT else None
+        timing_report = export_file or self.report_path("timing.txt")
+        derates = list(derates)
+        changes = self.linked_changes(verilog_file)
+        if changes is None:
+            return [(None, None)] * len(derates)
+        remove_reports(wns_report, tns_report, timing_report)
+        invalidate_timing_index(timing_report)
+        commands = ["unset_timing_derate"] + derate_sweep_commands(derates, wns_report, tns_report, timing_report, export_file)
+        if not self.evaluate(changes, commands):
+            return [(None, None)] * len(derates)
+        log(f"[INFO] Session derate sweep ({len(changes)} cells replaced, {len(derates)} samples)", "debug")
+        sta_runner.last_timing_report = self.timing_report = timing_report
+        if export_file:
+            return parse_export_metrics(export_file, len(derates))
+        return parse_sweep_reports(wns_report, tns_report, len(derates))
+
+    @timed("sta.what_if")
+    def evaluate_moves(self, moves):
+        """WNS/TNS of the linked design with each move applied alone, in one round trip.
+
+        moves is a list of [(instance, old_master, new_master)] changes. Each
+        is applied with replace_cell, timed at nominal derates and replaced
+        back, so OpenSTA only re-times what the move touches and the linked
+        design ends as it started. Returns [(wns, tns)] per move, or None if
+        the session failed.
+        """
+        moves = [list(changes) for changes in moves]
+        if not self.is_running():
+            return None
+        export_file = self.report_path("sta_export_what_if.csv") if sta_runner.STA_EXPORT else None
+        wns_report = self.report_path("wns_what_if.txt")
+        tns_report = self.report_path("tns_what_if.txt")
+        remove_reports(export_file or wns_report, tns_report)
+        if export_file:
+            invalidate_timing_index(export_file)
+        commands = ["unset_timing_derate"]
+        for changes in moves:
+            commands += [f"replace_cell {tcl_instance_name(inst)} {new_master}" for inst, _, new_master in changes]
+            if export_file:
+                commands.append(f"sta_export_metrics {export_file}")
+            else:
+                commands += [f"report_wns >> {wns_report}", f"report_tns >> {tns_report}"]
+            commands += [f"replace_cell {tcl_instance_name(inst)} {old_master}" for inst, old_master, _ in reversed(changes)]
+        ok, output = self.execute(commands)
+        if not ok:
+            print("[ERROR] OpenSTA session what-if evaluation failed")
+            print(output)
+            self.close()
+            return None
+        log(f"[INFO] Session what-if analysis of {len(moves)} moves", "debug")
+        if export_file:
+            return parse_export_metrics(export_file, len(moves))
+        return parse_sweep_reports(wns_report, tns_report, len(moves))
+
+    def timing_data(self, wns, tns):
+        """collect_timing_data() bundle of the last evaluation's path report."""
+        return collect_timing_data(wns, tns, self.timing_report)
+
+    def close(self):
+        """Terminate the OpenSTA process if it is running."""
+        if self.proc is None:
+            return
+        try:
+            if self.proc.poll() is None:
+                self.proc.stdin.write("exit\n")
+                self.proc.stdin.flush()
+                self.proc.wait(timeout=10)
+        except (BrokenPipeError, OSError, subprocess.TimeoutExpired):
+            self.proc.kill()
+        self.proc = None
+        self.masters = {}
+
+class StandInSTA(STABackend):
+    """Deterministic in-process timing model with the interface of a session.
+
+    Every instance is a stage on one of len(instances) / STANDIN_PATH_DEPTH
+    paths, both its path and its delay weight fixed by a hash of its name.
+    A stage's delay falls with its drive size (STANDIN_STAGE_DELAY * weight
+    * (0.5 + 0.5 / size)); path arrivals scale with cell_delay and the
+    setup time with cell_check. Required times are set when the design is
+    loaded so its WNS is STANDIN_WNS. Only the netlist is read, so runs need
+    neither OpenSTA nor a liberty file, and equal inputs always give equal
+    results.
+    """
+
+    def __init__(self, verilog_file="design.v", design_name="gcd", sdc_path="design.sdc", lib_path="my.lib", spef_path="design.spef", work_dir=None):
+        self.verilog_file = verilog_file
+        self.masters = {}        # Masters currently linked, keyed by instance
+        self.index = {}          # Instance -> position in the stage arrays
+        self.weights = None      # Delay weight of each stage
+        self.paths = None        # Path of each stage
+        self.required = 0.0      # Required time of every path
+        self.num_paths = 0
+        self._stage_delays = None
+        self.last_gate_timing = {}  # Per-instance table of the last evaluation
+
+    @timed("sta.standin_load")
+    def start(self):
+        return self.load_design(self.verilog_file)
+
+    def load_design(self, verilog_file):
+        """Link a netlist and derive the stand-in paths and required time from it."""
+        try:
+            self.masters = read_instance_masters(verilog_file)
+        except IOError as e:
+            print(f"[ERROR] Stand-in STA could not read {verilog_file}: {e}")
+            return False
+        names = list(self.masters)
+        self.index = {name: i for i, name in enumerate(names)}
+        self.num_paths = max(1, len(names) // STANDIN_PATH_DEPTH)
+        self.weights = np.array([0.5 + zlib.crc32(name.encode()) / 2.0 ** 32 for name in names])
+        self.paths = np.array([zlib.crc32(f"{name}/path".encode()) % self.num_paths for name in names], dtype=np.int64)
+        arrivals = self._arrivals()
+        self.required = (arrivals.max() if len(arrivals) else 0.0) + STANDIN_WNS
+        log(f"[INFO] Stand-in STA: {len(names)} instances on {self.num_paths} paths", "debug")
+        return True
+
+    def holds_design(self):
+        return bool(self.masters)
+
+    def _arrivals(self):
+        """Nominal arrival time of every path under the linked masters."""
+        sizes = np.array([split_master(self.masters[name])[1] or 1 for name in self.index], dtype=float)
+        delays = STANDIN_STAGE_DELAY * self.weights * (0.5 + 0.5 / sizes)
+        self._stage_delays = delays
+        return np.bincount(self.paths, weights=delays, minlength=self.num_paths)
+
+    def sync_masters(self, masters):
+        changes = [(inst, master) for inst, master in masters if self.masters.get(inst) != master]
+        for inst, _ in changes:
+            if inst not in self.masters:
+                print(f"[ERROR] Instance {inst} is not in the stand-in design")
+                return False
+        self.masters.update(changes)
+        return True
+
+    def apply_changes(self, changes):
+        return self.sync_masters((inst, new_master) for inst, _, new_master in changes)
+
+    def undo_changes(self, changes):
+        return self.sync_masters((inst, old_master) for inst, old_master, _ in reversed(changes))
+
+    def _link(self, verilog_file):
+        """Bring the linked masters in line with verilog_file (None keeps them); False on failure."""
+        if verilog_file is None:
+            return self.holds_design()
+        try:
+            masters = read_instance_masters(verilog_file)
+        except IOError as e:
+            print(f"[ERROR] Failed to read netlist {verilog_file}: {e}")
+            return False
+        if masters.keys() != self.masters.keys():
+            return self.load_design(verilog_file)
+        self.masters = masters
+        return True
+
+    @timed("sta.standin_evaluate")
+    def _evaluate(self, derates):
+        """[(wns, tns)] per derate pair; the per-instance table is kept for the last pair."""
+        arrivals = self._arrivals()
+        results = []
+        slacks = None
+        for cell_delay, cell_check in derates:
+            slacks = self.required - STANDIN_CHECK_TIME * (cell_check - 1.0) - cell_delay * arrivals
+            results.append((min(0.0, float(slacks.min())), float(np.minimum(slacks, 0.0).sum())))
+        if slacks is not None:
+            cell_delay = derates[-1][0]
+            self.last_gate_timing = {
+                name: {
+                    'delay': float(cell_delay * self._stage_delays[i]),
+                    'slew': 0.0,
+                    'slack': float(slacks[self.paths[i]]),
+                    'path_type': 'max',
+                    'path': f"standin_path_{self.paths[i]}",
+                }
+                for name, i in self.index.items()
+            }
+        return results
+
+    def run_sta(self, verilog_file="design.v", derate_tcl="derate.tcl"):
+        if not self._link(verilog_file):
+            return None, None
+        derate = {'delay': 1.0, 'check': 1.0}
+        if derate_tcl and os.path.exists(derate_tcl):
+            with open(derate_tcl, 'r') as f:
+                for kind, value in DERATE_SETTING.findall(f.read()):
+                    derate[kind] = float(value)
+        return self._evaluate([(derate['delay'], derate['check'])])[0]
+
+    def run_sta_batch(self, verilog_file="design.v", derates=()):
+        derates = list(derates)
+        if not self._link(verilog_file):
+            return [(None, None)] * len(derates)
+        return self._evaluate(derates)
+
+    def timing_data(self, wns, tns):
+        timing_data = collect_timing_data(wns, tns, None)
+        timing_data['gate_timing'] = self.last_gate_timing
+        return timing_data
+
+    def evaluate_moves(self, moves):
+        # What-ifs leave the table of the last real evaluation in place
+        gate_timing = self.last_gate_timing
+        try:
+            return super().evaluate_moves(moves)
+        finally:
+            self.last_gate_timing = gate_timing
+
+    def close(self):
+        self.masters = {}
+
+def open_sta_backend(name, verilog_file="design.v", design_name="gcd", sdc_path="design.sdc", lib_path="my.lib", spef_path="design.spef", work_dir=None):
+    """Build and start one of STA_BACKENDS for a design.
+
+    A session that fails to start falls back to one-shot runs. Returns
+    None if the backend cannot be started at all.
+    """
+    if name not in STA_BACKENDS:
+        raise ValueError(f"Unknown STA backend '{name}', expected one of {', '.join(STA_BACKENDS)}")
+    args = (verilog_file, design_name, sdc_path, lib_path, spef_path)
+    if name == "session":
+        backend = OpenSTASession(*args, work_dir=work_dir)
+        if backend.start():
+            return backend
+        print("[Warning] Could not start persistent OpenSTA session, falling back to one-shot runs.")
+        name = "oneshot"
+    backend = StandInSTA(*args, work_dir=work_dir) if name == "standin" else OneShotSTA(*args, work_dir=work_dir)
+    if not backend.start():
+        print(f"[ERROR] Could not start the {name} STA backend")
+        return None
+    return backend
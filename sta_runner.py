@@ -3,17 +3,123 @@ import subprocess
 import time
 import re
 import os
+from concurrent.futures import ProcessPoolExecutor
+
+from derates import DerateBank, draw_derate_arrays
+from telemetry import log, log_enabled, set_log_level
+from profiling import phase, timed
+
+# Path to the OpenSTA binary used for both one-shot runs and persistent sessions
+OPENSTA_CMD = "/usr/local/bin/opensta"
+
+# Marker printed by a persistent session once a batch of commands has completed
+SESSION_SENTINEL = "__STA_SESSION_DONE__"
+
+# Root directory holding one scratch directory per parallel STA worker process
+SCRATCH_ROOT = "sta_scratch"
+
+# Path report written by the most recent successful STA evaluation in this process
+last_timing_report = None
+
+# Parsed per-instance index for each path report, keyed by report path
+_timing_index_cache = {}
+
+# Matches "<MASTER> <instance> (" at the start of a cell instantiation line
+INSTANCE_PATTERN = re.compile(r'^\s*([A-Za-z_]\w*)\s+(\\\S+|[A-Za-z_][\w$]*)\s*\(')
+
+# Paths the path report lists per path group, and per endpoint within a group. One path
+# (OpenSTA's default) only times the gates of the single worst path; with many, every
+# gate on a violating path gets its own worst slack in the per-instance index
+REPORT_GROUP_COUNT = 200
+REPORT_ENDPOINT_COUNT = 3
+
+# Path report lines: "  0.02    0.21 ^ _551_/ZN (NAND2_X4)" stages and "  -0.03   slack (VIOLATED)"
+REPORT_STAGE = re.compile(r'^\s*(-?\d+\.\d+)\s+(-?\d+\.\d+)\s+[\^v]\s+(\S+)\s+\((\S+)\)')
+REPORT_SLACK = re.compile(r'^\s*(-?\d+\.\d+)\s+slack\b')
+
+# Evaluations write one CSV export (EXPORT_PROCS) instead of the text reports that
+# parse_wns/parse_tns/parse_timing_report scrape. Set False for OpenSTA builds whose
+# Tcl API lacks find_timing_paths or worst_slack; the text reports are then used
+STA_EXPORT = True
+
+# Tcl procs writing the export. Rows are "M,<wns>,<tns>" per evaluated derate sample and
+# "P,<path>,<pin>,<arrival>,<required>,<slack>" per pin of every reported path from its
+# startpoint on (launch clock network excluded, as in parse_timing_report), in ns
+EXPORT_PROCS = [
+    "proc sta_export_metrics {export_file} {",
+    "    set f [open $export_file a]",
+    "    puts $f \"M,[worst_slack -max],[total_negative_slack -max]\"",
+    "    close $f",
+    "}",
+    "proc sta_export_paths {export_file group_count endpoint_count} {",
+    "    set f [open $export_file a]",
+    "    set path_index 0",
+    "    foreach path_end [find_timing_paths -path_delay max -sort_by_slack -group_count $group_count -endpoint_count $endpoint_count] {",
+    "        set points [$path_end points]",
+    "        # Skip the launch clock network: start at the startpoint's register clock pin, if any",
+    "        set first 0",
+    "        for {set i 0} {$i < [llength $points]} {incr i} {",
+    "            if {[get_property [[lindex $points $i] pin] is_register_clock]} {",
+    "                set first $i",
+    "                break",
+    "            }",
+    "        }",
+    "        foreach point [lrange $points $first end] {",
+    "            puts $f \"P,$path_index,[get_full_name [$point pin]],[sta::format_time [$point arrival] 6],[sta::format_time [$point required] 6],[sta::format_time [$point slack] 6]\"",
+    "        }",
+    "        incr path_index",
+    "    }",
+    "    close $f",
+    "}",
+]
+
+# Parsed export arrays for each export file, keyed by path
+_export_cache = {}
 
 # --- Utility Functions for STA ---
 
-def generate_derate(path="derate.tcl", mu=1.0, sigma_delay=0.02, sigma_check=0.02):
-    """Generates a Tcl file with random timing derates."""
+def sample_derate(mu=1.0, sigma_delay=0.02, sigma_check=0.02):
+    """Draw one random (cell_delay, cell_check) derate pair."""
     # Ensure non-negative derates, although STA tools might handle small negatives
     delay_derate = max(0.1, np.random.normal(mu, sigma_delay)) # Avoid zero or negative
     check_derate = max(0.1, np.random.normal(mu, sigma_check)) # Avoid zero or negative
+    return delay_derate, check_derate
+
+def sample_derates(num_samples, mu=1.0, sigma_delay=0.02, sigma_check=0.02, *, sampler="random", seed=None):
+    """Draw a list of (cell_delay, cell_check) derate pairs for a batched MC sweep.
+
+    sampler is one of derates.SAMPLERS; with seed the pairs are reproducible.
+    """
+    delay_derates, check_derates = sample_derate_arrays(num_samples, mu, sigma_delay, sigma_check, sampler=sampler, seed=seed)
+    return list(zip(delay_derates.tolist(), check_derates.tolist()))
+
+def sample_derate_arrays(num_samples, mu=1.0, sigma_delay=0.02, sigma_check=0.02, *, sampler="random", seed=None):
+    """Draw num_samples derate pairs as two arrays (cell_delay, cell_check) for vectorized MC."""
+    if sampler == "random" and seed is None:
+        delay_derates = np.maximum(0.1, np.random.normal(mu, sigma_delay, num_samples))
+        check_derates = np.maximum(0.1, np.random.normal(mu, sigma_check, num_samples))
+        return delay_derates, check_derates
+    rng = np.random.default_rng(seed) if seed is not None else np.random.default_rng(np.random.randint(2 ** 32, dtype=np.uint64))
+    return draw_derate_arrays(num_samples, rng, mu, sigma_delay, sigma_check, sampler)
+
+def generate_derate(path="derate.tcl", mu=1.0, sigma_delay=0.02, sigma_check=0.02, bank=None, index=0):
+    """Generates a Tcl file with random timing derates.
+
+    With bank (a derates.DerateBank) the index-th sample of the bank is
+    written instead, so serial trials walk one fixed sample set.
+    """
+    if bank is not None:
+        write_derate(path, bank.delay[index], bank.check[index], f"{bank.sampler} sample {index} of bank {bank.key}")
+        return
+    delay_derate, check_derate = sample_derate(mu, sigma_delay, sigma_check)
+    write_derate(path, delay_derate, check_derate, f"mu={mu}, sigma_delay={sigma_delay}, sigma_check={sigma_check}")
+
+@timed("sta.derate_write")
+def write_derate(path, delay_derate, check_derate, note="fixed sample"):
+    """Writes a Tcl file applying one (cell_delay, cell_check) derate pair."""
     try:
         with open(path, "w") as f:
-            f.write(f"# Generated Derates: mu={mu}, sigma_delay={sigma_delay}, sigma_check={sigma_check}\n")
+            f.write(f"# Generated Derates: {note}\n")
             f.write(f"set_timing_derate -late -cell_delay {delay_derate:.4f}\n")
             f.write(f"set_timing_derate -late -cell_check {check_derate:.4f}\n")
             # Add early derates if needed for setup checks (often 1.0 or slightly less)
@@ -22,8 +128,12 @@ def generate_derate(path="derate.tcl", mu=1.0, sigma_delay=0.02, sigma_check=0.0
     except IOError as e:
         print(f"[ERROR] Failed to write derate file {path}: {e}")
 
-def generate_run_tcl(tcl_path="run_sta.tcl", verilog_path="design.v", design_name="gcd", sdc_path="design.sdc", lib_path="my.lib", spef_path="design.spef", derate_tcl="derate.tcl", timing_report="timing.txt", wns_report="wns.txt", tns_report="tns.txt"):
-    """Generates the run_sta.tcl script."""
+@timed("sta.tcl_generation")
+def generate_run_tcl(tcl_path="run_sta.tcl", verilog_path="design.v", design_name="gcd", sdc_path="design.sdc", lib_path="my.lib", spef_path="design.spef", derate_tcl="derate.tcl", timing_report="timing.txt", wns_report="wns.txt", tns_report="tns.txt", export_file=None):
+    """Generates the run_sta.tcl script.
+
+    With export_file the results go to that CSV export instead of the three text reports.
+    """
     try:
         with open(tcl_path, "w") as f:
             f.write("# Auto-generated run_sta.tcl\n")
@@ -35,92 +145,296 @@ def generate_run_tcl(tcl_path="run_sta.tcl", verilog_path="design.v", design_nam
                 f.write(f"read_spef {spef_path}\n")
             else:
                 print(f"[Warning] SPEF file '{spef_path}' not found or specified, skipping read_spef.")
+            if export_file:
+                for line in EXPORT_PROCS:
+                    f.write(line + "\n")
             if derate_tcl and os.path.exists(derate_tcl):
                 f.write(f"source {derate_tcl}\n")
             else:
                 print(f"[Warning] Derate file '{derate_tcl}' not found or specified, skipping derate source.")
 
             # Generate more detailed timing reports
-            f.write(f"report_checks -path_delay max -sort_by_slack -format full_clock_expanded > {timing_report}\n")
-            f.write(f"report_wns > {wns_report}\n")
-            f.write(f"report_tns > {tns_report}\n")
+            for line in report_commands(timing_report, wns_report, tns_report, export_file):
+                f.write(line + "\n")
             f.write("exit\n")
         return True
     except IOError as e:
         print(f"[ERROR] Failed to write Tcl script {tcl_path}: {e}")
         return False
 
-def parse_timing_report(report_path):
-    """Parse the detailed timing report to extract gate-specific timing information."""
+def report_checks_command(timing_report):
+    """Tcl writing the multi-path report that parse_timing_report() reads."""
+    return (f"report_checks -path_delay max -sort_by_slack -group_count {REPORT_GROUP_COUNT} "
+            f"-endpoint_count {REPORT_ENDPOINT_COUNT} -format full_clock_expanded > {timing_report}")
+
+def report_commands(timing_report, wns_report, tns_report, export_file=None):
+    """Tcl reporting one evaluation: the CSV export if export_file is set, else the text reports."""
+    if export_file:
+        return [f"sta_export_metrics {export_file}", export_paths_command(export_file)]
+    return [report_checks_command(timing_report), f"report_wns > {wns_report}", f"report_tns > {tns_report}"]
+
+def export_paths_command(export_file):
+    """Tcl appending the pins of the reported paths to an export (see EXPORT_PROCS)."""
+    return f"sta_export_paths {export_file} {REPORT_GROUP_COUNT} {REPORT_ENDPOINT_COUNT}"
+
+def derate_sweep_commands(derates, wns_report="wns_mc.txt", tns_report="tns_mc.txt", timing_report=None, export_file=None):
+    """Tcl that loops over (cell_delay, cell_check) pairs and appends WNS/TNS per pair.
+
+    Both reports get one line per derate pair, in the order given. If
+    timing_report is set, the path report for the last pair is written there.
+    With export_file, one metrics row per pair and the paths of the last
+    pair go to that export instead.
+    """
+    pairs = " ".join(f"{delay:.4f} {check:.4f}" for delay, check in derates)
+    commands = [
+        f"foreach {{cell_delay cell_check}} {{{pairs}}} {{",
+        "    set_timing_derate -late -cell_delay $cell_delay",
+        "    set_timing_derate -late -cell_check $cell_check",
+    ]
+    if export_file:
+        commands += [f"    sta_export_metrics {export_file}", "}", export_paths_command(export_file)]
+        return commands
+    commands += [
+        f"    report_wns >> {wns_report}",
+        f"    report_tns >> {tns_report}",
+        "}",
+    ]
+    if timing_report:
+        commands.append(report_checks_command(timing_report))
+    return commands
+
+@timed("sta.tcl_generation")
+def generate_batch_tcl(tcl_path="run_sta_mc.tcl", verilog_path="design.v", design_name="gcd", sdc_path="design.sdc", lib_path="my.lib", spef_path="design.spef", derates=(), wns_report="wns_mc.txt", tns_report="tns_mc.txt", timing_report=None, export_file=None):
+    """Generates a Tcl script that loads the design once and sweeps a list of derates."""
+    try:
+        with open(tcl_path, "w") as f:
+            f.write("# Auto-generated batched Monte Carlo run\n")
+            f.write(f"read_liberty {lib_path}\n")
+            f.write(f"read_verilog {verilog_path}\n")
+            f.write(f"link_design {design_name}\n")
+            f.write(f"read_sdc {sdc_path}\n")
+            if spef_path and os.path.exists(spef_path):
+                f.write(f"read_spef {spef_path}\n")
+            else:
+                print(f"[Warning] SPEF file '{spef_path}' not found or specified, skipping read_spef.")
+            if export_file:
+                for line in EXPORT_PROCS:
+                    f.write(line + "\n")
+            for line in derate_sweep_commands(derates, wns_report, tns_report, timing_report, export_file):
+                f.write(line + "\n")
+            f.write("exit\n")
+        return True
+    except IOError as e:
+        print(f"[ERROR] Failed to write Tcl script {tcl_path}: {e}")
+        return False
+
+@timed("sta.parse_timing_report")
+def parse_timing_report(report_path, verbose=False):
+    """Stream a multi-path report into a per-instance worst slack/delay table.
+
+    Every path block (Startpoint ... slack) is read once; each cell pin on
+    its data arrival side, from the startpoint on, credits the pin's
+    instance with the path's slack. The launch clock network before the
+    startpoint's clock pin is skipped: resizing its buffers would move
+    launch and capture together.
+    Returns {instance: {'slack', 'delay', 'slew', 'path_type', 'path',
+    'paths'}} with the worst (lowest) slack over all reported paths through
+    the instance, the largest stage delay, the startpoint of the worst path
+    and the number of reported paths through it. Port pins are skipped.
+    """
     gate_timing = {}
-    current_gate = None
-    current_path = None
+    path = None          # Startpoint of the path being read
+    path_type = None
+    stages = {}          # Instance -> largest stage delay on the current path
+    arrival_side = False # Still before "data arrival time"
+    launched = False     # The startpoint's first pin has been reached
     
     try:
         with open(report_path, 'r') as f:
             for line in f:
-                # Look for path start
-                if 'Startpoint' in line:
-                    current_path = line.split(':')[1].strip()
-                
-                # Look for gate instances
-                elif 'Instance' in line:
-                    parts = line.split()
-                    if len(parts) >= 2:
-                        current_gate = parts[1]
-                        if current_gate not in gate_timing:
-                            gate_timing[current_gate] = {
-                                'delay': 0.0,
-                                'slew': 0.0,
-                                'slack': 0.0,
-                                'path_type': None,
-                                'path': current_path
-                            }
-                
-                # Extract timing information
-                elif current_gate:
-                    if 'delay' in line.lower():
-                        try:
-                            delay = float(line.split()[-2])
-                            gate_timing[current_gate]['delay'] = max(gate_timing[current_gate]['delay'], delay)
-                        except (ValueError, IndexError):
-                            pass
-                    elif 'slew' in line.lower():
-                        try:
-                            slew = float(line.split()[-2])
-                            gate_timing[current_gate]['slew'] = max(gate_timing[current_gate]['slew'], slew)
-                        except (ValueError, IndexError):
-                            pass
-                    elif 'slack' in line.lower():
-                        try:
-                            slack = float(line.split()[-2])
-                            # Keep the worst (most negative) slack
-                            if slack < gate_timing[current_gate]['slack']:
-                                gate_timing[current_gate]['slack'] = slack
-                        except (ValueError, IndexError):
-                            pass
-                    elif 'path type' in line.lower():
-                        path_type = line.split()[-1]
-                        if gate_timing[current_gate]['path_type'] is None:
-                            gate_timing[current_gate]['path_type'] = path_type
+                if line.startswith('Startpoint:'):
+                    path = line.split(':', 1)[1].split()[0]
+                    path_type = None
+                    stages = {}
+                    arrival_side = True
+                    launched = False
+                    continue
+                if path is None:
+                    continue
+                if arrival_side:
+                    match = REPORT_STAGE.match(line)
+                    if match:
+                        pin = match.group(3)
+                        instance = pin.rsplit('/', 1)[0]
+                        launched = launched or instance == path
+                        if launched and '/' in pin:
+                            delay = float(match.group(1))
+                            if delay > stages.get(instance, float('-inf')):
+                                stages[instance] = delay
+                        continue
+                    if 'data arrival time' in line:
+                        arrival_side = False
+                    elif line.startswith('Path Type:'):
+                        path_type = line.split(':', 1)[1].strip()
+                    continue
+                match = REPORT_SLACK.match(line)
+                if match:
+                    slack = float(match.group(1))
+                    for instance, delay in stages.items():
+                        timing = gate_timing.get(instance)
+                        if timing is None:
+                            gate_timing[instance] = {'delay': delay, 'slew': 0.0, 'slack': slack,
+                                                     'path_type': path_type, 'path': path, 'paths': 1}
+                            continue
+                        timing['paths'] += 1
+                        if delay > timing['delay']:
+                            timing['delay'] = delay
+                        if slack < timing['slack']:
+                            timing['slack'] = slack
+                            timing['path'] = path
+                    path = None
         
         # Print debug information
-        print("\n    --- Timing Report Summary ---")
-        for gate, timing in gate_timing.items():
-            print(f"    Gate: {gate}")
-            print(f"      Path: {timing['path']}")
-            print(f"      Delay: {timing['delay']:.4f} ns")
-            print(f"      Slew: {timing['slew']:.4f} ns")
-            print(f"      Slack: {timing['slack']:.4f} ns")
-            print(f"      Path Type: {timing['path_type']}")
-        print("    --- End Timing Report Summary ---\n")
-        
+        if verbose:
+            print("\n    --- Timing Report Summary ---")
+            for gate, timing in gate_timing.items():
+                print(f"    Gate: {gate}")
+                print(f"      Path: {timing['path']} ({timing['paths']} reported paths)")
+                print(f"      Delay: {timing['delay']:.4f} ns")
+                print(f"      Slack: {timing['slack']:.4f} ns")
+                print(f"      Path Type: {timing['path_type']}")
+            print("    --- End Timing Report Summary ---\n")
+
         return gate_timing
     except Exception as e:
         print(f"[Warning] Error parsing timing report: {e}")
         return {}
 
+def _report_stamp(report_path):
+    """Modification stamp used to detect a rewritten report."""
+    st = os.stat(report_path)
+    return st.st_mtime_ns, st.st_size
+
+def load_timing_index(report_path):
+    """Per-instance slack/delay index of a path report, parsed once per report version.
+
+    Every consumer of the same report (run_sta, collect_timing_data and the
+    perturbation scoring loop) shares the single parse. A .csv report is an
+    STA export and is read with load_sta_export().
+    """
+    try:
+        stamp = _report_stamp(report_path)
+    except OSError:
+        print(f"[Warning] Timing report not found: {report_path}")
+        return {}
+    cached = _timing_index_cache.get(report_path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    if report_path.endswith(".csv"):
+        index = export_gate_timing(load_sta_export(report_path))
+    else:
+        index = parse_timing_report(report_path)
+    _timing_index_cache[report_path] = (stamp, index)
+    return index
+
+def invalidate_timing_index(report_path):
+    """Drop the cached index of a report that is about to be rewritten."""
+    _timing_index_cache.pop(report_path, None)
+    _export_cache.pop(report_path, None)
+
+@timed("sta.load_export")
+def load_sta_export(export_path):
+    """Load an STA export (see EXPORT_PROCS) into NumPy arrays, once per file version.
+
+    Returns {'wns', 'tns'} with one value per evaluated derate sample and,
+    one entry per exported pin in path order, {'path', 'pin', 'arrival',
+    'required', 'slack'}. None if the export is missing or malformed.
+    """
+    try:
+        stamp = _report_stamp(export_path)
+    except OSError:
+        print(f"[Warning] STA export not found: {export_path}")
+        return None
+    cached = _export_cache.get(export_path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    try:
+        with open(export_path, 'r') as f:
+            text = f.read()
+        # Metrics rows come before the path rows, which are converted column-wise in one pass
+        metrics_text, found, points_text = ("\n" + text).partition("\nP,")
+        metrics = [line[2:].split(',') for line in metrics_text.splitlines() if line.startswith('M,')]
+        wns, tns = (np.array(column, dtype=float) for column in zip(*metrics)) if metrics else (np.empty(0), np.empty(0))
+        export = {
+            'wns': np.minimum(wns, 0.0),  # Like report_wns, a met design has a WNS of 0
+            'tns': tns,
+        }
+        points_text = ("P," + points_text).strip() if found else ""
+        num_points = points_text.count("\n") + 1 if points_text else 0
+        if points_text.count(',') == 5 * num_points:
+            fields = points_text.replace("\n", ",").split(',') if num_points else []
+            path, pin = fields[1::6], fields[2::6]
+            arrival, required, slack = fields[3::6], fields[4::6], fields[5::6]
+        else:
+            # Pin names holding commas (escaped identifiers): split the numbers off the right of each row
+            rows = [line[2:].rsplit(',', 3) for line in points_text.splitlines()]
+            heads, arrival, required, slack = zip(*rows)
+            path, pin = zip(*(head.split(',', 1) for head in heads))
+        export.update(path=np.fromiter(map(int, path), np.int64, num_points), pin=np.array(pin, dtype=str),
+                      arrival=np.fromiter(map(float, arrival), float, num_points),
+                      required=np.fromiter(map(float, required), float, num_points),
+                      slack=np.fromiter(map(float, slack), float, num_points))
+    except (IOError, ValueError) as e:
+        print(f"[Warning] Could not parse STA export {export_path}: {e}")
+        return None
+    _export_cache[export_path] = (stamp, export)
+    return export
+
+@timed("sta.export_gate_timing")
+def export_gate_timing(export):
+    """Per-instance table of an export in the parse_timing_report() format.
+
+    An instance gets the worst slack over its pins, the largest arrival
+    step into one of its pins as its delay, the first instance of the path
+    through its worst pin as 'path' and the number of exported paths it is on.
+    Exported paths start at their startpoint, so launch clock buffers are
+    not credited.
+    """
+    if export is None or not len(export['pin']):
+        return {}
+    path, pins = export['path'], export['pin']
+    starts = np.r_[True, path[1:] != path[:-1]]
+    stage_delays = np.where(starts, 0.0, np.diff(export['arrival'], prepend=export['arrival'][0]))
+    instances = np.array([pin.rpartition('/')[0] for pin in pins.tolist()])
+    cell = instances != ''  # Port pins have no instance
+    if not cell.any():
+        return {}
+    names, inst = np.unique(instances[cell], return_inverse=True)
+    cell_paths = path[cell]
+    delay = np.full(len(names), -np.inf)
+    np.maximum.at(delay, inst, stage_delays[cell])
+    # Worst pin of every instance: sort by instance, then slack, and take each instance's first entry
+    order = np.lexsort((export['slack'][cell], inst))
+    first = order[np.r_[True, inst[order][1:] != inst[order][:-1]]]
+    stride = int(path.max()) + 1
+    path_counts = np.bincount(np.unique(inst * stride + cell_paths) // stride, minlength=len(names))
+    startpoints = dict(zip(path[starts].tolist(), (pin.rsplit('/', 1)[0] for pin in pins[starts].tolist())))
+    return {
+        name: {'delay': d, 'slew': 0.0, 'slack': s, 'path_type': 'max', 'path': startpoints[p], 'paths': n}
+        for name, d, s, p, n in zip(names.tolist(), delay.tolist(), export['slack'][cell][first].tolist(),
+                                    cell_paths[first].tolist(), path_counts.tolist())
+    }
+
+def parse_export_metrics(export_path, num_samples):
+    """(wns, tns) per derate sample from an export; [(None, None)] * num_samples on failure."""
+    export = load_sta_export(export_path)
+    if export is None or len(export['wns']) != num_samples:
+        print(f"[WARNING] Expected {num_samples} WNS/TNS values in the STA export {export_path}")
+        return [(None, None)] * num_samples
+    return list(zip(export['wns'].tolist(), export['tns'].tolist()))
+
 # Keep WNS/TNS parsing separate as they have dedicated reports
+@timed("sta.parse_wns_tns")
 def parse_wns(path="wns.txt"):
     try:
         with open(path) as f:
@@ -139,6 +453,7 @@ def parse_wns(path="wns.txt"):
         print(f"[Warning] Failed to parse WNS from {path}: {e}")
     return None
 
+@timed("sta.parse_wns_tns")
 def parse_tns(path="tns.txt"):
     try:
         with open(path) as f:
@@ -158,57 +473,161 @@ def parse_tns(path="tns.txt"):
     return None
 
 
-def run_sta(verilog_file="design.v", design_name="gcd", sdc_path="design.sdc", lib_path="my.lib", spef_path="design.spef", derate_tcl="derate.tcl"):
-    """Run OpenSTA and return WNS and TNS values."""
+def parse_metric_all(path, pattern):
+    """Return every value matched by pattern in a report, in file order (None on error)."""
+    try:
+        with open(path) as f:
+            return [float(v) for v in re.findall(pattern, f.read(), re.IGNORECASE)]
+    except FileNotFoundError:
+        print(f"[Warning] Report file not found: {path}")
+    except ValueError:
+        print(f"[Warning] Could not parse float values from {path}")
+    return None
+
+@timed("sta.parse_wns_tns")
+def parse_sweep_reports(wns_report, tns_report, num_samples):
+    """Parse the appended WNS/TNS reports of a derate sweep into (wns, tns) pairs."""
+    wns_values = parse_metric_all(wns_report, r'(?:wns|worst slack)\s+\w*\s*([+-]?\d+\.?\d*)')
+    tns_values = parse_metric_all(tns_report, r'(?:tns|total negative slack)\s+\w*\s*([+-]?\d+\.?\d*)')
+    if wns_values is None or tns_values is None or len(wns_values) != num_samples or len(tns_values) != num_samples:
+        print(f"[WARNING] Expected {num_samples} WNS/TNS values from the derate sweep")
+        return [(None, None)] * num_samples
+    return list(zip(wns_values, tns_values))
+
+def remove_reports(*paths):
+    """Delete report files so appended sweeps start empty."""
+    for path in paths:
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def run_sta_batch(verilog_file="design.v", design_name="gcd", sdc_path="design.sdc", lib_path="my.lib", spef_path="design.spef", derates=(), work_dir=None):
+    """Run one OpenSTA process that evaluates every (cell_delay, cell_check) pair.
+
+    Returns a list of (wns, tns) in the order of derates; failed evaluations are (None, None).
+    """
+    global last_timing_report
+    tcl_script = "run_sta_mc.tcl"
+    timing_report = "timing.txt"
+    wns_report = "wns_mc.txt"
+    tns_report = "tns_mc.txt"
+    export_file = "sta_export_mc.csv"
+    if work_dir:
+        os.makedirs(work_dir, exist_ok=True)
+        tcl_script, timing_report, wns_report, tns_report, export_file = (
+            os.path.join(work_dir, name) for name in (tcl_script, timing_report, wns_report, tns_report, export_file))
+    if STA_EXPORT:
+        timing_report = export_file
+    else:
+        export_file = None
+    derates = list(derates)
+
+    remove_reports(wns_report, tns_report, timing_report)
+    invalidate_timing_index(timing_report)
+    if not generate_batch_tcl(tcl_script, verilog_file, design_name, sdc_path, lib_path, spef_path, derates, wns_report, tns_report, timing_report, export_file):
+        print("[ERROR] Failed to generate TCL script")
+        return [(None, None)] * len(derates)
+
+    try:
+        log(f"[INFO] Running OpenSTA derate sweep ({len(derates)} samples): {OPENSTA_CMD} {tcl_script}", "debug")
+        with phase("sta.opensta_process"):
+            result = subprocess.run([OPENSTA_CMD, tcl_script],
+                                  capture_output=True,
+                                  text=True,
+                                  check=True)
+        if result.stderr:
+            log(f"\n--- OpenSTA Errors ---\n{result.stderr}")
+        last_timing_report = timing_report
+        if export_file:
+            return parse_export_metrics(export_file, len(derates))
+        return parse_sweep_reports(wns_report, tns_report, len(derates))
+    except subprocess.CalledProcessError as e:
+        print(f"[ERROR] OpenSTA failed with return code {e.returncode}")
+        print("STDOUT:", e.stdout)
+        print("STDERR:", e.stderr)
+    except Exception as e:
+        print(f"[ERROR] Unexpected error running OpenSTA: {e}")
+    finally:
+        if os.path.exists(tcl_script):
+            try:
+                os.remove(tcl_script)
+            except OSError:
+                pass
+    return [(None, None)] * len(derates)
+
+def run_sta(verilog_file="design.v", design_name="gcd", sdc_path="design.sdc", lib_path="my.lib", spef_path="design.spef", derate_tcl="derate.tcl", work_dir=None):
+    """Run OpenSTA and return WNS and TNS values.
+
+    With work_dir the Tcl script and reports are written there instead of the
+    current directory, so several runs can proceed at the same time.
+    """
+    global last_timing_report
     # Generate TCL script
     tcl_script = "run_sta.tcl"
     timing_report = "timing.txt"
     wns_report = "wns.txt"
     tns_report = "tns.txt"
-    
+    export_file = "sta_export.csv"
+    if work_dir:
+        os.makedirs(work_dir, exist_ok=True)
+        tcl_script, timing_report, wns_report, tns_report, export_file = (
+            os.path.join(work_dir, name) for name in (tcl_script, timing_report, wns_report, tns_report, export_file))
+    if STA_EXPORT:
+        timing_report = export_file
+        remove_reports(export_file)
+    else:
+        export_file = None
+
+    invalidate_timing_index(timing_report)
     if not generate_run_tcl(tcl_script, verilog_file, design_name, sdc_path, lib_path, spef_path, derate_tcl, 
-                          timing_report, wns_report, tns_report):
+                          timing_report, wns_report, tns_report, export_file):
         print("[ERROR] Failed to generate TCL script")
         return None, None
 
     # Print the TCL script for debugging
-    print("\n--- Generated TCL Script ---")
-    with open(tcl_script, 'r') as f:
-        print(f.read())
-    print("--- End TCL Script ---\n")
+    if log_enabled("debug"):
+        print("\n--- Generated TCL Script ---")
+        with open(tcl_script, 'r') as f:
+            print(f.read())
+        print("--- End TCL Script ---\n")
 
     # Run OpenSTA directly
     try:
         # Use OpenSTA directly since we're already in a container
-        opensta_cmd = "/usr/local/bin/opensta"
+        opensta_cmd = OPENSTA_CMD
         
-        print(f"[INFO] Running OpenSTA: {opensta_cmd} {tcl_script}")
+        log(f"[INFO] Running OpenSTA: {opensta_cmd} {tcl_script}", "debug")
         
-        result = subprocess.run([opensta_cmd, tcl_script], 
-                              capture_output=True, 
-                              text=True,
-                              check=True)
+        with phase("sta.opensta_process"):  # Process startup, design load, timing update and report writing
+            result = subprocess.run([opensta_cmd, tcl_script], 
+                                  capture_output=True, 
+                                  text=True,
+                                  check=True)
         
-        print("\n--- OpenSTA Output ---")
-        print(result.stdout)
+        log(f"\n--- OpenSTA Output ---\n{result.stdout}", "debug")
         if result.stderr:
-            print("\n--- OpenSTA Errors ---")
-            print(result.stderr)
-        print("--- End OpenSTA Output ---\n")
+            log(f"\n--- OpenSTA Errors ---\n{result.stderr}")
+        log("--- End OpenSTA Output ---\n", "debug")
         
         # Parse timing reports
-        wns = parse_wns(wns_report)
-        tns = parse_tns(tns_report)
-        gate_timing = parse_timing_report(timing_report)
-        
+        if export_file:
+            wns, tns = parse_export_metrics(export_file, 1)[0]
+        else:
+            wns = parse_wns(wns_report)
+            tns = parse_tns(tns_report)
+        gate_timing = load_timing_index(timing_report)
+
         if wns is None or tns is None:
             print("[WARNING] Failed to parse timing reports")
             return None, None
             
-        print(f"[INFO] WNS: {wns:.4f} ns, TNS: {tns:.4f} ns")
+        log(f"[INFO] WNS: {wns:.4f} ns, TNS: {tns:.4f} ns", "debug")
+        last_timing_report = timing_report
         
         # Print detailed timing information
-        if gate_timing:
+        if gate_timing and log_enabled("debug"):
             print("\n--- Detailed Timing Information ---")
             for gate, timing in gate_timing.items():
                 print(f"Gate: {gate}")
@@ -237,9 +656,112 @@ def run_sta(verilog_file="design.v", design_name="gcd", sdc_path="design.sdc", l
             except OSError:
                 pass
 
+def collect_timing_data(wns, tns, timing_report):
+    """Bundle an evaluation's WNS/TNS with its parsed path report.
+
+    Kept in memory by the optimizer so perturbation can reuse the timing of
+    the current state instead of running STA on it again.
+    """
+    return {
+        'wns': wns,
+        'tns': tns,
+        'gate_timing': load_timing_index(timing_report) if timing_report else {},
+        'timing_report': timing_report,
+    }
+
+# --- Parallel Trial Execution ---
+
+_worker_pool = None
+_worker_pool_size = 0
+
+def get_worker_pool(workers):
+    """Return a process pool of the requested size, reusing it across evaluations."""
+    global _worker_pool, _worker_pool_size
+    if _worker_pool is None or _worker_pool_size != workers:
+        shutdown_worker_pool()
+        _worker_pool = ProcessPoolExecutor(max_workers=workers)
+        _worker_pool_size = workers
+    return _worker_pool
+
+def shutdown_worker_pool():
+    """Stop the shared worker pool, if one was started."""
+    global _worker_pool, _worker_pool_size
+    if _worker_pool is not None:
+        _worker_pool.shutdown()
+    _worker_pool = None
+    _worker_pool_size = 0
+
+def _run_sta_trial(args):
+    """Pool worker: run one derate sample in this worker's private scratch directory."""
+    verilog_file, design_name, sdc_path, lib_path, spef_path, derate, scratch_root = args
+    work_dir = os.path.join(scratch_root, f"worker_{os.getpid()}")
+    os.makedirs(work_dir, exist_ok=True)
+    derate_tcl = os.path.join(work_dir, "derate.tcl")
+    write_derate(derate_tcl, derate[0], derate[1])
+    wns, tns = run_sta(verilog_file, design_name, sdc_path, lib_path, spef_path, derate_tcl, work_dir=work_dir)
+    return wns, tns, last_timing_report
+
+def run_sta_parallel(verilog_file="design.v", design_name="gcd", sdc_path="design.sdc", lib_path="my.lib", spef_path="design.spef", derates=(), workers=None, scratch_root=SCRATCH_ROOT):
+    """Run one OpenSTA process per derate sample across a pool of workers.
+
+    Every worker writes its Tcl script, derate file and reports into its own
+    directory under scratch_root. Returns [(wns, tns), ...] in the order of derates.
+    """
+    global last_timing_report
+    derates = list(derates)
+    if verilog_file is None:
+        print("[ERROR] Parallel STA needs a netlist file; one-shot runs cannot evaluate a linked design")
+        return [(None, None)] * len(derates)
+    workers = workers or os.cpu_count() or 1
+    jobs = [(verilog_file, design_name, sdc_path, lib_path, spef_path, derate, scratch_root) for derate in derates]
+    log(f"[INFO] Running {len(jobs)} STA trials on {workers} workers", "debug")
+    try:
+        results = list(get_worker_pool(workers).map(_run_sta_trial, jobs))
+        for wns, tns, timing_report in results:
+            if wns is not None and tns is not None:
+                last_timing_report = timing_report
+        return [(wns, tns) for wns, tns, _ in results]
+    except Exception as e:
+        print(f"[ERROR] Parallel STA execution failed: {e}")
+        shutdown_worker_pool()
+        return [(None, None)] * len(derates)
+
+# --- Persistent OpenSTA Session ---
+
+@timed("sta.read_instance_masters")
+def read_instance_masters(verilog_path):
+    """Return {instance_name: master} for every cell instance in a flat netlist."""
+    masters = {}
+    with open(verilog_path, 'r') as f:
+        for line in f:
+            match = INSTANCE_PATTERN.match(line)
+            if match and match.group(1) != "module":
+                masters[match.group(2)] = match.group(1)
+    return masters
+
+def tcl_instance_name(instance_name):
+    """Quote a Verilog instance name for OpenSTA commands.
+
+    Escaped identifiers (\\name[0] ) lose the backslash and keep their
+    brackets escaped, which is how OpenSTA stores them after read_verilog.
+    """
+    if instance_name.startswith('\\'):
+        instance_name = instance_name[1:].replace('[', '\\[').replace(']', '\\]')
+    return "{" + instance_name + "}"
+
 # --- Standalone Monte Carlo Analysis ---
-def monte_carlo_main(verilog_file="design.v", num_runs=10, design_name="gcd", sdc_path="design.sdc", lib_path="my.lib", spef_path="design.spef"):
-    """Runs multiple STA iterations with varying derates."""
+def monte_carlo_main(verilog_file="design.v", num_runs=10, design_name="gcd", sdc_path="design.sdc", lib_path="my.lib", spef_path="design.spef", backend="session", batch=False, workers=1, sampler="random", seed=None):
+    """Runs multiple STA iterations with varying derates.
+
+    All num_runs derate samples are drawn up front as one DerateBank, placed
+    by sampler (see derates.SAMPLERS) and reproducible through seed. backend
+    is one of sta_backend.STA_BACKENDS: with "session" the design is loaded
+    once into a persistent OpenSTA process and each run only re-applies the
+    derates. With batch the samples are swept inside a single evaluation.
+    With workers > 1 (and no batch) the runs are spread over a process pool
+    of one-shot OpenSTA runs.
+    """
+    from sta_backend import open_sta_backend  # sta_backend builds on this module
     print(f"\nStarting Monte Carlo STA Analysis for {verilog_file}...")
     yield_count = 0
     wns_list = []
@@ -253,13 +775,33 @@ def monte_carlo_main(verilog_file="design.v", num_runs=10, design_name="gcd", sd
               print(f"[ERROR] Required file not found: {f}")
               return
 
+    bank = DerateBank(num_runs, seed, sampler=sampler)
+    print(f"[INFO] Derate samples: {num_runs} x {sampler}, seed {bank.seed}")
+
+    parallel = workers > 1 and not batch
+    sta = None
+    if not parallel:
+        sta = open_sta_backend(backend, verilog_file, design_name, sdc_path, lib_path, spef_path)
+        if sta is None:
+            return
+
+    trial_results = None
+    if batch:
+        trial_results = sta.run_sta_batch(verilog_file=verilog_file, derates=bank.pairs())
+    elif parallel:
+        trial_results = run_sta_parallel(verilog_file, design_name, sdc_path, lib_path, spef_path, bank.pairs(), workers)
+        shutdown_worker_pool()
+
     for i in range(num_runs):
-        print(f"\n--- MC Run {i+1}/{num_runs} ---")
-        # Generate new derate factors for this run
-        generate_derate(path=derate_file)
+        log(f"\n--- MC Run {i+1}/{num_runs} ---")
+        if trial_results is not None:
+            wns, tns = trial_results[i]
+        else:
+            # Write this run's derate factors
+            generate_derate(path=derate_file, bank=bank, index=i)
 
-        # Run STA with the current derate file
-        wns, tns = run_sta(verilog_file=verilog_file, design_name=design_name, sdc_path=sdc_path, lib_path=lib_path, spef_path=spef_path, derate_tcl=derate_file)
+            # Run STA with the current derate file
+            wns, tns = sta.run_sta(verilog_file=verilog_file, derate_tcl=derate_file)
 
         if wns is not None and tns is not None:
             wns_list.append(wns)
@@ -270,12 +812,15 @@ def monte_carlo_main(verilog_file="design.v", num_runs=10, design_name="gcd", sd
             if passed:
                 yield_count += 1
             status = "✓ Pass" if passed else "✗ Fail"
-            print(f"  Result: WNS = {wns:.4f} ns, TNS = {tns:.4f} ns | {status}")
+            log(f"  Result: WNS = {wns:.4f} ns, TNS = {tns:.4f} ns | {status}")
         else:
-            print(f"  Result: WNS = N/A, TNS = N/A | ✗ Fail (STA Error)")
+            log(f"  Result: WNS = N/A, TNS = N/A | ✗ Fail (STA Error)")
         # Optional small delay
         # time.sleep(0.05)
 
+    if sta is not None:
+        sta.close()
+
     print("\n--- Monte Carlo Summary ---")
     if wns_list:
         print(f"Successful Runs: {len(wns_list)}/{num_runs}")
@@ -297,17 +842,39 @@ def monte_carlo_main(verilog_file="design.v", num_runs=10, design_name="gcd", sd
 if __name__ == "__main__":
     # Example usage for standalone MC run:
     # python sta_runner.py my_design.v top_module constraints.sdc stdcell.lib parasitic.spef 20
+    # Add --batch to sweep all derate samples inside a single OpenSTA evaluation,
+    # or --workers=N to run the samples on N parallel OpenSTA processes.
+    # --sampler=lhs|sobol|halton|antithetic|random and --seed=N choose the derate sample set,
+    # --log-level=quiet|info|debug how much per-run output is printed,
+    # --backend=session|oneshot|standin which STA engine evaluates the runs
     import sys
-    if len(sys.argv) < 5:
-         print("Usage: python sta_runner.py <netlist.v> <design_name> <sdc_file> <lib_file> [spef_file] [num_runs]")
+    batch = "--batch" in sys.argv
+    backend = "session"
+    workers = 1
+    sampler = "random"
+    seed = None
+    for a in sys.argv:
+        if a.startswith("--workers="):
+            workers = int(a.split("=", 1)[1])
+        elif a.startswith("--sampler="):
+            sampler = a.split("=", 1)[1]
+        elif a.startswith("--seed="):
+            seed = int(a.split("=", 1)[1])
+        elif a.startswith("--log-level="):
+            set_log_level(a.split("=", 1)[1])
+        elif a.startswith("--backend="):
+            backend = a.split("=", 1)[1]
+    argv = [a for a in sys.argv if not a.startswith("--")]
+    if len(argv) < 5:
+         print("Usage: python sta_runner.py <netlist.v> <design_name> <sdc_file> <lib_file> [spef_file] [num_runs] [--batch] [--workers=N] [--sampler=NAME] [--seed=N] [--log-level=LEVEL] [--backend=NAME]")
          sys.exit(1)
 
-    netlist_v = sys.argv[1]
-    design = sys.argv[2]
-    sdc = sys.argv[3]
-    lib = sys.argv[4]
-    spef = sys.argv[5] if len(sys.argv) > 5 else None
-    runs = int(sys.argv[6]) if len(sys.argv) > 6 else 10
+    netlist_v = argv[1]
+    design = argv[2]
+    sdc = argv[3]
+    lib = argv[4]
+    spef = argv[5] if len(argv) > 5 else None
+    runs = int(argv[6]) if len(argv) > 6 else 10
 
     # Check existence before calling
     if not os.path.exists(netlist_v): print(f"Error: Netlist not found: {netlist_v}"); sys.exit(1)
@@ -315,4 +882,4 @@ if __name__ == "__main__":
     if not os.path.exists(lib): print(f"Error: Liberty file not found: {lib}"); sys.exit(1)
     if spef and not os.path.exists(spef): print(f"Warning: SPEF file not found: {spef}"); spef = None # Proceed without SPEF
 
-    monte_carlo_main(verilog_file=netlist_v, num_runs=runs, design_name=design, sdc_path=sdc, lib_path=lib, spef_path=spef)
\ No newline at end of file
+    monte_carlo_main(verilog_file=netlist_v, num_runs=runs, design_name=design, sdc_path=sdc, lib_path=lib, spef_path=spef, backend=backend, batch=batch, workers=workers, sampler=sampler, seed=seed)
\ No newline at end of file
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""Stand-in for the OpenSTA binary that answers with canned reports.
+
+Understands the subset of Tcl that sta_runner generates: one-shot scripts
+(stub_opensta.py run_sta.tcl), persistent sessions over stdin
+(stub_opensta.py -no_splash), derate files pulled in with source, and the
+foreach derate sweep. report_checks copies STUB_STA_TIMING_REPORT (default:
+timing.txt next to this script); report_wns/report_tns print the canned
+STUB_STA_WNS/STUB_STA_TNS shifted by the cell_delay derate, so sweeps return
+distinct, deterministic values. sta_export_metrics/sta_export_paths write
+the same values, and the canned report's paths, as an STA export; proc
+definitions are skipped. Every other command is accepted and ignored.
+Used by benchmark.py so the Python side can be measured without OpenSTA.
+"""
+import os
+import re
+import shutil
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TIMING_REPORT = os.environ.get("STUB_STA_TIMING_REPORT", os.path.join(HERE, "timing.txt"))
+BASE_WNS = float(os.environ.get("STUB_STA_WNS", "-0.03"))
+BASE_TNS = float(os.environ.get("STUB_STA_TNS", "-0.31"))
+DERATE_SENSITIVITY = 0.4  # ns of WNS lost per unit of cell_delay derate above 1.0
+
+REDIRECT = re.compile(r'^(.*?)\s*(>>?)\s*(\S+)\s*$')
+FOREACH = re.compile(r'^foreach\s+\{cell_delay cell_check\}\s+\{([^}]*)\}\s+\{$')
+STAGE = re.compile(r'^\s*(-?\d+\.\d+)\s+(-?\d+\.\d+)\s+[\^v]\s+(\S+)')
+SLACK = re.compile(r'^\s*(-?\d+\.\d+)\s+slack\b')
+
+def report_paths(report_path):
+    """[(pins, slack)] of the path report: (pin, arrival) pairs from the startpoint to the data arrival time."""
+    paths = []
+    pins = None  # Stages of the path being read
+    arrival_side = False
+    startpoint = None
+    with open(report_path, 'r') as f:
+        for line in f:
+            if line.startswith('Startpoint:'):
+                pins, arrival_side = [], True
+                startpoint = line.split(':', 1)[1].split()[0]
+            elif pins is None:
+                continue
+            elif arrival_side:
+                match = STAGE.match(line)
+                if match and (pins or match.group(3).rsplit('/', 1)[0] == startpoint):
+                    pins.append((match.group(3), float(match.group(2))))
+                elif 'data arrival time' in line:
+                    arrival_side = False
+            else:
+                match = SLACK.match(line)
+                if match:
+                    paths.append((pins, float(match.group(1))))
+                    pins = None
+    return paths
+
+class StubSTA:
+    def __init__(self):
+        self.variables = {"cell_delay": "1.0", "cell_check": "1.0"}
+        self.cell_delay = 1.0
+
+    def substitute(self, line):
+        return re.sub(r'\$(\w+)', lambda m: self.variables.get(m.group(1), m.group(0)), line)
+
+    def metrics(self):
+        shift = DERATE_SENSITIVITY * (self.cell_delay - 1.0)
+        wns = min(0.0, BASE_WNS - shift)
+        tns = min(0.0, BASE_TNS - 10.0 * shift)
+        return wns, tns
+
+    def output(self, text, redirect):
+        if redirect is None:
+            sys.stdout.write(text)
+            return
+        mode, path = redirect
+        with open(path, 'a' if mode == '>>' else 'w') as f:
+            f.write(text)
+
+    def command(self, line):
+        """Run one command; returns False on exit."""
+        line = self.substitute(line.strip())
+        if not line or line.startswith("#"):
+            return True
+        redirect = None
+        match = REDIRECT.match(line)
+        if match and not line.startswith("puts"):
+            line, redirect = match.group(1), (match.group(2), match.group(3))
+        words = line.split()
+        name = words[0]
+        if name == "exit":
+            return False
+        if name == "source" and len(words) > 1 and os.path.exists(words[1]):
+            with open(words[1], 'r') as f:
+                self.run_lines(f.readlines())
+        elif name == "set_timing_derate" and "-cell_delay" in words:
+            self.cell_delay = float(words[words.index("-cell_delay") + 1])
+        elif name == "unset_timing_derate":
+            self.cell_delay = 1.0
+        elif name == "report_checks":
+            if redirect is not None and redirect[0] == '>':
+                shutil.copyfile(TIMING_REPORT, redirect[1])
+            else:
+                with open(TIMING_REPORT, 'r') as f:
+                    self.output(f.read(), redirect)
+        elif name == "report_wns":
+            self.output(f"wns max {self.metrics()[0]:.2f}\n", redirect)
+        elif name == "report_tns":
+            self.output(f"tns max {self.metrics()[1]:.2f}\n", redirect)
+        elif name == "sta_export_metrics":
+            wns, tns = self.metrics()
+            with open(words[1], 'a') as f:
+                f.write(f"M,{wns:.6f},{tns:.6f}\n")
+        elif name == "sta_export_paths":
+            self.export_paths(words[1])
+        elif name == "puts":
+            text = line[len("puts"):].strip().strip('"')
+            if not text.startswith("ERROR"):
+                print(text)
+        elif name == "flush":
+            sys.stdout.flush()
+        return True
+
+    def export_paths(self, export_file, report_path=TIMING_REPORT):
+        """Append the paths of the canned report, slacks shifted like the WNS, as "P," export rows."""
+        shift = self.metrics()[0] - BASE_WNS
+        with open(export_file, 'a') as f:
+            for index, (pins, slack) in enumerate(report_paths(report_path)):
+                slack += shift
+                for pin, arrival in pins:
+                    f.write(f"P,{index},{pin},{arrival:.6f},{arrival + slack:.6f},{slack:.6f}\n")
+
+    def run_lines(self, lines):
+        """Run a block of script lines; returns False once exit was seen."""
+        i = 0
+        while i < len(lines):
+            line = lines[i].strip()
+            i += 1
+            # Session wrapper: if {[catch { ... } sta_err]} { puts "ERROR: $sta_err" }
+            if line.startswith("if {[catch {") or line.startswith("}} sta_err]}"):
+                continue
+            if line.startswith("proc "):
+                depth = line.count("{") - line.count("}")
+                while i < len(lines) and depth > 0:
+                    depth += lines[i].count("{") - lines[i].count("}")
+                    i += 1
+                continue
+            match = FOREACH.match(line)
+            if match:
+                body = []
+                while i < len(lines) and lines[i].strip() != "}":
+                    body.append(lines[i])
+                    i += 1
+                i += 1
+                values = match.group(1).split()
+                for delay, check in zip(values[0::2], values[1::2]):
+                    self.variables["cell_delay"], self.variables["cell_check"] = delay, check
+                    self.run_lines(body)
+                continue
+            if not self.command(line):
+                return False
+        return True
+
+def main():
+    sta = StubSTA()
+    scripts = [a for a in sys.argv[1:] if not a.startswith("-")]
+    if scripts:
+        with open(scripts[0], 'r') as f:
+            sta.run_lines(f.readlines())
+        return
+    # Session mode: commands arrive on stdin until exit; the session waits for each
+    # batch's sentinel, so a batch runs once its closing "flush stdout" has arrived
+    batch = []
+    for line in sys.stdin:
+        batch.append(line)
+        if line.strip() == "exit" or line.strip() == "flush stdout":
+            if not sta.run_lines(batch):
+                return
+            sys.stdout.flush()
+            batch = []
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import json
+import os
+
+# Verbosity of the optimizer's console output:
+#   "quiet": warnings, errors and run-level summaries only
+#   "info":  plus one block per SA iteration (costs, accept/reject)
+#   "debug": plus per-trial results, per-gate moves, generated Tcl and raw OpenSTA output
+LOG_LEVELS = {"quiet": 0, "info": 1, "debug": 2}
+LOG_LEVEL = "quiet"
+
+def set_log_level(level):
+    """Select one of LOG_LEVELS for log()."""
+    global LOG_LEVEL
+    if level not in LOG_LEVELS:
+        raise ValueError(f"Unknown log level '{level}', expected one of {', '.join(LOG_LEVELS)}")
+    LOG_LEVEL = level
+
+def log_enabled(level="info"):
+    """True if messages of this level are printed; lets callers skip building expensive messages."""
+    return LOG_LEVELS[LOG_LEVEL] >= LOG_LEVELS[level]
+
+def log(message, level="info"):
+    """Print message if the current LOG_LEVEL includes level."""
+    if LOG_LEVELS[LOG_LEVEL] >= LOG_LEVELS[level]:
+        print(message)
+
+class Journal:
+    """Append-only JSON-lines record of a run, one object per event.
+
+    Every record gets an 'event' field ("start", "iteration", "done", ...).
+    Lines are flushed as they are written, so a crashed run keeps every
+    record up to the crash. read_journal() loads the file back.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, 'a', buffering=1)
+
+    def record(self, event, **fields):
+        """Append one record."""
+        if self.file is None:
+            return
+        fields['event'] = event
+        self.file.write(json.dumps(fields, separators=(',', ':'), default=_json_default) + "\n")
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+def _json_default(value):
+    """Encode NumPy scalars and arrays, which json does not know."""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def read_journal(path, event=None):
+    """Records of a journal file, optionally only those of one event type."""
+    records = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # A line cut short by a crash
+            if event is None or record.get('event') == event:
+                records.append(record)
+    return records
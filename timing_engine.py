@@ -0,0 +1,430 @@
+import os
+import re
+import sys
+
+import numpy as np
+
+from liberty import interpolate, load_library_cached
+from netlist import Netlist, instance_key, split_master
+from spef import load_spef
+
+# --- Configuration ---
+RISE, FALL = 0, 1
+CLOCK_PATTERN = re.compile(r'create_clock\s.*-period\s+([\d.]+).*\[get_ports\s+\{?([^}\]]+?)\}?\s*\]')
+IO_DELAY_PATTERN = re.compile(r'set_(input|output)_delay\s+([-\d.]+)\s.*\[get_ports\s+\{?([^}\]]+?)\}?\s*\]')
+
+# --- SDC Subset ---
+def read_sdc(sdc_path):
+    """Read the single-clock subset of an SDC file: create_clock and set_input/output_delay."""
+    sdc = {'period': None, 'clock_port': None, 'input_delays': {}, 'output_delays': {}}
+    with open(sdc_path, 'r') as f:
+        for line in f:
+            match = CLOCK_PATTERN.search(line)
+            if match:
+                sdc['period'] = float(match.group(1))
+                sdc['clock_port'] = match.group(2).strip()
+                continue
+            match = IO_DELAY_PATTERN.search(line)
+            if match:
+                sdc[f"{match.group(1)}_delays"][match.group(3).strip()] = float(match.group(2))
+    if sdc['period'] is None:
+        raise ValueError(f"No create_clock found in {sdc_path}")
+    return sdc
+
+def _sense_transitions(arc):
+    """(input transition, output transition) pairs of a delay arc."""
+    if arc.timing_type == "rising_edge":
+        return [(RISE, RISE), (RISE, FALL)]
+    if arc.timing_type == "falling_edge":
+        return [(FALL, RISE), (FALL, FALL)]
+    if arc.timing_sense == "positive_unate":
+        return [(RISE, RISE), (FALL, FALL)]
+    if arc.timing_sense == "negative_unate":
+        return [(FALL, RISE), (RISE, FALL)]
+    return [(RISE, RISE), (FALL, RISE), (RISE, FALL), (FALL, FALL)]
+
+class TableStack:
+    """Liberty tables padded into arrays so a whole level is interpolated in one call."""
+
+    def __init__(self):
+        self.tables = []
+
+    def add(self, table):
+        self.tables.append(table)
+        return len(self.tables) - 1
+
+    def freeze(self):
+        n1 = max(len(t.index_1) for t in self.tables)
+        n2 = max(len(t.index_2) for t in self.tables)
+        count = len(self.tables)
+        self.index_1 = np.full((count, n1), np.inf)
+        self.index_2 = np.full((count, n2), np.inf)
+        self.values = np.zeros((count, n1, n2))
+        self.len_1 = np.array([len(t.index_1) for t in self.tables])
+        self.len_2 = np.array([len(t.index_2) for t in self.tables])
+        for k, t in enumerate(self.tables):
+            self.index_1[k, :len(t.index_1)] = t.index_1
+            self.index_2[k, :len(t.index_2)] = t.index_2
+            self.values[k, :len(t.index_1), :len(t.index_2)] = t.values
+
+    def lookup(self, table_ids, x1, x2):
+        return interpolate(self.index_1[table_ids], self.index_2[table_ids], self.values[table_ids],
+                           self.len_1[table_ids], self.len_2[table_ids], x1, x2)
+
+class TimingEngine:
+    """Levelized NLDM setup timing of a Netlist model, vectorized with NumPy.
+
+    Supports the subset the optimizer needs: one clock from create_clock
+    with propagated latency, input/output delays, combinational and
+    clock-to-Q arcs, setup checks, lumped SPEF net caps plus pin caps as
+    output load, and zero wire delay. Nets are the graph nodes (each net has
+    one driver), so a cell arc connects its input net to its output net.
+    Launch and capture clock paths see the same derate, i.e. clock path
+    pessimism is fully removed. Cells of one drive family must share pins
+    and arcs, which lets a sizing state change tables without rebuilding
+    the graph.
+    """
+
+    def __init__(self, netlist, library, sdc, net_caps=None):
+        self.netlist = netlist
+        self.library = library
+        self.period = sdc['period']
+        net_caps = net_caps or {}
+
+        # Masters the sizing state can reach: every library cell of a family used in the netlist
+        families = {split_master(m)[0] for m in netlist.inst_masters}
+        self.masters = sorted(name for name in library.cells if split_master(name)[0] in families)
+        self.master_index = {name: k for k, name in enumerate(self.masters)}
+
+        self.net_index = {}
+        self.net_names = []
+        for port in netlist.input_ports + netlist.output_ports:
+            self._net(port)
+
+        # Graph rows, built from the cell each instance has in the parsed netlist
+        arc_rows = []     # (from_net, to_net, in_rf, out_rf, inst, key)
+        check_rows = []   # (data_net, clock_net, data_rf, inst, key)
+        pin_rows = []     # (net, inst, key)
+        keys = {}
+        self.instance_master = np.full(len(netlist.inst_names), -1, dtype=np.int64)
+        for inst, master in enumerate(netlist.inst_masters):
+            cell = library.cells.get(master)
+            pins = dict(netlist.pins(inst))
+            if cell is None:
+                if pins:
+                    print(f"[Warning] Cell {master} of {netlist.inst_names[inst]} not found in {library.name}, ignoring it")
+                continue
+            self.instance_master[inst] = self.master_index[master]
+            base = split_master(master)[0]
+            for pin, cap in cell.pin_caps.items():
+                if self._connected(pins.get(pin)):
+                    pin_rows.append((self._net(pins[pin]), inst, keys.setdefault((base, "cap", pin), len(keys))))
+            for arc in cell.delay_arcs():
+                if not (self._connected(pins.get(arc.pin)) and self._connected(pins.get(arc.related_pin))):
+                    continue
+                for in_rf, out_rf in _sense_transitions(arc):
+                    key = keys.setdefault((base, "arc", arc.related_pin, arc.pin, out_rf), len(keys))
+                    arc_rows.append((self._net(pins[arc.related_pin]), self._net(pins[arc.pin]), in_rf, out_rf, inst, key))
+            for arc in cell.setup_arcs():
+                if not (self._connected(pins.get(arc.pin)) and self._connected(pins.get(arc.related_pin))):
+                    continue
+                for data_rf in (RISE, FALL):
+                    key = keys.setdefault((base, "setup", arc.related_pin, arc.pin, data_rf), len(keys))
+                    check_rows.append((self._net(pins[arc.pin]), self._net(pins[arc.related_pin]), data_rf, inst, key))
+
+        # Per-master lookup of table ids and pin caps for every key
+        self.tables = TableStack()
+        num_masters = len(self.masters)
+        self.delay_table = np.full((num_masters, len(keys)), -1, dtype=np.int64)
+        self.slew_table = np.full((num_masters, len(keys)), -1, dtype=np.int64)
+        self.pin_cap = np.zeros((num_masters, len(keys)))
+        for m, name in enumerate(self.masters):
+            cell = library.cells[name]
+            base = split_master(name)[0]
+            for pin, cap in cell.pin_caps.items():
+                key = keys.get((base, "cap", pin))
+                if key is not None:
+                    self.pin_cap[m, key] = cap
+            for arc in cell.delay_arcs() + cell.setup_arcs():
+                for out_rf, rf_name in ((RISE, "rise"), (FALL, "fall")):
+                    kind = "setup" if arc.timing_type.startswith("setup") else "arc"
+                    key = keys.get((base, kind, arc.related_pin, arc.pin, out_rf))
+                    if key is None:
+                        continue
+                    delay = arc.tables.get(f"{rf_name}_constraint" if kind == "setup" else f"cell_{rf_name}")
+                    slew = arc.tables.get(f"{rf_name}_transition")
+                    if delay is not None:
+                        self.delay_table[m, key] = self.tables.add(delay)
+                    if slew is not None:
+                        self.slew_table[m, key] = self.tables.add(slew)
+        self.tables.freeze()
+
+        arcs = np.array(arc_rows, dtype=np.int64).reshape(-1, 6)
+        checks = np.array(check_rows, dtype=np.int64).reshape(-1, 5)
+        pins = np.array(pin_rows, dtype=np.int64).reshape(-1, 3)
+        num_nets = len(self.net_names)
+
+        # Levelize nets; arcs are ordered by the level of the net they drive, then by
+        # (transition, net) so each target's arcs form one contiguous group
+        level = self._levelize(arcs, num_nets)
+        order = np.lexsort((arcs[:, 1], arcs[:, 3], level[arcs[:, 1]])) if len(arcs) else np.zeros(0, dtype=np.int64)
+        arcs = arcs[order]
+        self.arc_from, self.arc_to, self.arc_in_rf, self.arc_out_rf, self.arc_inst, self.arc_key = arcs.T.copy()
+        arc_levels = level[self.arc_to]
+        self.level_bounds = np.searchsorted(arc_levels, np.arange(arc_levels.max() + 2 if len(arcs) else 1))
+        # Per level: (lo, hi, group starts relative to lo, group transition, group net)
+        self.levels = []
+        for lvl in range(len(self.level_bounds) - 1):
+            lo, hi = self.level_bounds[lvl], self.level_bounds[lvl + 1]
+            if lo == hi:
+                continue
+            target = self.arc_out_rf[lo:hi] * num_nets + self.arc_to[lo:hi]
+            starts = np.flatnonzero(np.r_[True, target[1:] != target[:-1]])
+            self.levels.append((lo, hi, starts, self.arc_out_rf[lo:hi][starts], self.arc_to[lo:hi][starts]))
+        self.check_data, self.check_clock, self.check_rf, self.check_inst, self.check_key = checks.T.copy()
+        # Endpoint (data pin) of each check: its rise and fall checks count once in TNS, as in OpenSTA
+        endpoints, self.check_endpoint = np.unique(self.check_data * len(netlist.inst_names) + self.check_inst,
+                                                   return_inverse=True)
+        self.num_endpoints = len(endpoints)
+        self.pin_net, self.pin_inst, self.pin_key = pins.T.copy()
+
+        # Loads from parasitics are fixed; pin caps follow the sizing state
+        self.wire_cap = np.zeros(num_nets)
+        for name, cap in net_caps.items():
+            net = self.net_index.get(name)
+            if net is not None:
+                self.wire_cap[net] = cap / library.cap_unit_pf
+
+        # Sources and output-port endpoints
+        self.clock_net = self.net_index.get(sdc['clock_port'])
+        self.input_nets = np.array([self.net_index[p] for p in netlist.input_ports if p != sdc['clock_port']], dtype=np.int64)
+        self.input_arrival = np.array([sdc['input_delays'].get(p, 0.0) for p in netlist.input_ports if p != sdc['clock_port']])
+        self.output_nets = np.array([self.net_index[p] for p in netlist.output_ports], dtype=np.int64)
+        self.output_required = np.array([self.period - sdc['output_delays'].get(p, 0.0) for p in netlist.output_ports])
+        self.output_names = list(netlist.output_ports)
+
+        print(f"[INFO] Timing graph: {num_nets} nets, {len(arcs)} arc rows, {len(checks)} setup checks, "
+              f"{len(self.level_bounds) - 1} levels")
+
+    @classmethod
+    def from_files(cls, netlist, sdc_path, lib_path, spef_path=None):
+        """Build an engine for a parsed Netlist from the SDC, liberty and (optional) SPEF files."""
+        net_caps = load_spef(spef_path).net_caps() if spef_path else {}
+        return cls(netlist, load_library_cached(lib_path), read_sdc(sdc_path), net_caps)
+
+    def _net(self, name):
+        name = instance_key(name)
+        net = self.net_index.get(name)
+        if net is None:
+            net = self.net_index[name] = len(self.net_names)
+            self.net_names.append(name)
+        return net
+
+    @staticmethod
+    def _connected(net):
+        """False for unconnected pins and constants such as 1'b0."""
+        return bool(net) and not net[0].isdigit()
+
+    @staticmethod
+    def _levelize(arcs, num_nets):
+        """Longest-path depth of every net (Kahn's algorithm over unique net edges)."""
+        edges = np.unique(arcs[:, :2], axis=0) if len(arcs) else np.zeros((0, 2), dtype=np.int64)
+        fanout = [[] for _ in range(num_nets)]
+        indegree = np.zeros(num_nets, dtype=np.int64)
+        for src, dst in edges:
+            fanout[src].append(dst)
+            indegree[dst] += 1
+        level = np.zeros(num_nets, dtype=np.int64)
+        ready = [n for n in range(num_nets) if indegree[n] == 0]
+        visited = 0
+        while ready:
+            net = ready.pop()
+            visited += 1
+            for dst in fanout[net]:
+                level[dst] = max(level[dst], level[net] + 1)
+                indegree[dst] -= 1
+                if indegree[dst] == 0:
+                    ready.append(dst)
+        if visited != num_nets:
+            raise ValueError("Combinational loop in the timing graph")
+        return level
+
+    # --- Sizing State ---
+    def master_ids(self, sizes=None):
+        """Master id of every instance under a sizing state of the engine's Netlist."""
+        master_ids = self.instance_master.copy()
+        if sizes is not None:
+            netlist = self.netlist
+            for k in range(len(sizes)):
+                if sizes[k] != netlist.base_sizes[k]:
+                    master = self.master_index.get(netlist.master_of(k, sizes))
+                    if master is None:
+                        raise KeyError(f"{netlist.master_of(k, sizes)} is not in the library")
+                    master_ids[netlist.sizable[k]] = master
+        return master_ids
+
+    def master_ids_for_verilog(self, verilog_path):
+        """Master ids for a netlist file with the same instances as the engine's Netlist."""
+        variant = Netlist.from_verilog(verilog_path)
+        if variant.inst_names != self.netlist.inst_names:
+            raise ValueError(f"{verilog_path} does not have the instances of the timing graph")
+        master_ids = self.instance_master.copy()
+        for inst, master in enumerate(variant.inst_masters):
+            if master_ids[inst] >= 0:
+                master_ids[inst] = self.master_index[master]
+        return master_ids
+
+    # --- Propagation ---
+    def propagate(self, master_ids, cell_delay=1.0, cell_check=1.0):
+        """Forward arrival/slew propagation and setup checks for one or many derate samples.
+
+        cell_delay and cell_check may be arrays of S samples. Derates scale
+        delays but not slews, so table lookups run once and only arrivals
+        carry the sample axis: arrival is (2, nets, S) and WNS, TNS, worst
+        slack are length-S vectors (WNS is clipped at 0 like report_wns).
+        """
+        cell_delay, cell_check = np.broadcast_arrays(np.atleast_1d(np.asarray(cell_delay, dtype=float)),
+                                                     np.atleast_1d(np.asarray(cell_check, dtype=float)))
+        num_samples = len(cell_delay)
+        num_nets = len(self.net_names)
+        load = self.wire_cap + np.bincount(self.pin_net, weights=self.pin_cap[master_ids[self.pin_inst], self.pin_key],
+                                           minlength=num_nets)
+        arrival = np.full((2, num_nets, num_samples), -np.inf)
+        slew = np.zeros((2, num_nets))
+        arrival[:, self.input_nets, :] = self.input_arrival[None, :, None]
+        if self.clock_net is not None:
+            arrival[RISE, self.clock_net, :] = 0.0
+            arrival[FALL, self.clock_net, :] = self.period / 2.0
+
+        arc_masters = master_ids[self.arc_inst]
+        delay_ids = self.delay_table[arc_masters, self.arc_key]
+        slew_ids = self.slew_table[arc_masters, self.arc_key]
+        arc_delay = np.zeros(len(self.arc_from))
+        for lo, hi, starts, group_rf, group_net in self.levels:
+            src, dst = self.arc_from[lo:hi], self.arc_to[lo:hi]
+            in_rf = self.arc_in_rf[lo:hi]
+            in_slew = slew[in_rf, src]
+            out_load = load[dst]
+            delay = self.tables.lookup(delay_ids[lo:hi], in_slew, out_load)
+            arc_delay[lo:hi] = delay
+            source = arrival[in_rf, src]
+            candidate = source + delay[:, None] * cell_delay[None, :]
+            arrival[group_rf, group_net] = np.maximum.reduceat(candidate, starts, axis=0)
+            out_slew = np.where(np.isfinite(source[:, 0]), self.tables.lookup(slew_ids[lo:hi], in_slew, out_load), 0.0)
+            slew[group_rf, group_net] = np.maximum.reduceat(out_slew, starts)
+
+        # Setup checks against the capturing clock edge one period later
+        check_masters = master_ids[self.check_inst]
+        setup = self.tables.lookup(self.delay_table[check_masters, self.check_key],
+                                   slew[self.check_rf, self.check_data], slew[RISE, self.check_clock])
+        with np.errstate(invalid='ignore'):
+            check_required = self.period + arrival[RISE, self.check_clock] - setup[:, None] * cell_check[None, :]
+            check_slack = check_required - arrival[self.check_rf, self.check_data]
+            output_slack = self.output_required[:, None] - arrival[:, self.output_nets].max(axis=0)
+            endpoint_slack = np.full((self.num_endpoints, num_samples), np.inf)
+            np.minimum.at(endpoint_slack, self.check_endpoint, check_slack)
+
+        slacks = np.concatenate([endpoint_slack, output_slack])
+        slacks = slacks[np.isfinite(slacks[:, 0])] if len(slacks) else slacks
+        worst = slacks.min(axis=0) if len(slacks) else np.zeros(num_samples)
+        return {
+            'arrival': arrival,
+            'slew': slew,
+            'load': load,
+            'arc_delay': arc_delay,  # Underated
+            'cell_delay': cell_delay,
+            'check_required': check_required,
+            'check_slack': check_slack,
+            'output_slack': output_slack,
+            'worst_slack': worst,
+            'wns': np.minimum(worst, 0.0),
+            'tns': np.minimum(slacks, 0.0).sum(axis=0),
+            'yield': float(np.mean(worst >= 0.0)),
+        }
+
+    def required_times(self, result, sample=0):
+        """Backward pass: required time (2 x nets) of one sample of a propagate() result."""
+        num_nets = len(self.net_names)
+        required = np.full((2, num_nets), np.inf)
+        np.minimum.at(required, (self.check_rf, self.check_data), result['check_required'][:, sample])
+        required[:, self.output_nets] = np.minimum(required[:, self.output_nets], self.output_required)
+        arc_delay = result['arc_delay'] * result['cell_delay'][sample]
+        for lo, hi, _, _, _ in reversed(self.levels):
+            candidate = required[self.arc_out_rf[lo:hi], self.arc_to[lo:hi]] - arc_delay[lo:hi]
+            np.minimum.at(required, (self.arc_in_rf[lo:hi], self.arc_from[lo:hi]), candidate)
+        return required
+
+    def gate_timing(self, result, sample=0):
+        """Per-instance worst slack and delay in the parse_timing_report() format."""
+        required = self.required_times(result, sample)
+        net_slack = (required - result['arrival'][:, :, sample]).min(axis=0)
+        arc_delay = result['arc_delay'] * result['cell_delay'][sample]
+        gate_timing = {}
+        for row in range(len(self.arc_from)):
+            inst = self.arc_inst[row]
+            slack = net_slack[self.arc_to[row]]
+            if not np.isfinite(slack):
+                continue
+            name = instance_key(self.netlist.inst_names[inst])
+            entry = gate_timing.get(name)
+            if entry is None:
+                entry = gate_timing[name] = {'delay': 0.0, 'slew': 0.0, 'slack': 0.0, 'path_type': 'max', 'path': None}
+            entry['delay'] = max(entry['delay'], float(arc_delay[row]))
+            entry['slew'] = max(entry['slew'], float(result['slew'][self.arc_out_rf[row], self.arc_to[row]]))
+            entry['slack'] = min(entry['slack'], float(slack))
+        return gate_timing
+
+    def evaluate(self, sizes=None, cell_delay=1.0, cell_check=1.0, master_ids=None):
+        """WNS and TNS of a sizing state (or explicit master ids) under one derate."""
+        if master_ids is None:
+            master_ids = self.master_ids(sizes)
+        result = self.propagate(master_ids, cell_delay, cell_check)
+        return float(result['wns'][0]), float(result['tns'][0])
+
+    def evaluate_samples(self, master_ids, cell_delays, cell_checks):
+        """Monte Carlo over derate samples in one pass; returns the propagate() result with per-sample vectors."""
+        return self.propagate(master_ids, cell_delays, cell_checks)
+
+# --- Cross-Check Against OpenSTA ---
+def cross_check(verilog_path, design_name, sdc_path, lib_path, spef_path=None):
+    """Compare engine and OpenSTA WNS/TNS on a netlist without derates."""
+    from sta_runner import run_sta, write_derate
+    netlist = Netlist.from_verilog(verilog_path)
+    engine = TimingEngine.from_files(netlist, sdc_path, lib_path, spef_path)
+    wns_engine, tns_engine = engine.evaluate()
+    print(f"[Engine]  WNS: {wns_engine:.4f} ns, TNS: {tns_engine:.4f} ns")
+
+    write_derate("engine_check_derate.tcl", 1.0, 1.0, "unity derate for engine cross-check")
+    wns, tns = run_sta(verilog_path, design_name, sdc_path, lib_path, spef_path, "engine_check_derate.tcl")
+    os.remove("engine_check_derate.tcl")
+    if wns is None or tns is None:
+        print("[Warning] OpenSTA run failed; no cross-check possible")
+        return wns_engine, tns_engine, None, None
+    print(f"[OpenSTA] WNS: {wns:.4f} ns, TNS: {tns:.4f} ns")
+    print(f"[Diff]    WNS: {wns_engine - wns:+.4f} ns, TNS: {tns_engine - tns:+.4f} ns")
+    return wns_engine, tns_engine, wns, tns
+
+def monte_carlo(verilog_path, sdc_path, lib_path, spef_path=None, num_samples=1000, sampler="random"):
+    """Vectorized derate MC on a netlist; prints and returns the WNS/TNS/yield summary."""
+    from sta_runner import sample_derate_arrays
+    netlist = Netlist.from_verilog(verilog_path)
+    engine = TimingEngine.from_files(netlist, sdc_path, lib_path, spef_path)
+    delay_derates, check_derates = sample_derate_arrays(num_samples, sampler=sampler)
+    result = engine.evaluate_samples(engine.master_ids(), delay_derates, check_derates)
+    print(f"[MC x{num_samples}] WNS = {result['wns'].mean():+.4f} ± {result['wns'].std():.4f} ns (worst {result['wns'].min():+.4f}), "
+          f"TNS = {result['tns'].mean():+.4f} ± {result['tns'].std():.4f} ns, Yield = {100.0 * result['yield']:.1f}%")
+    return result
+
+# --- Standalone Test Block ---
+if __name__ == "__main__":
+    mc_samples = [int(a.split("=", 1)[1]) for a in sys.argv[1:] if a.startswith("--mc=")]
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if len(args) < 4:
+        print("Usage: python3 timing_engine.py <design.v> <design_name> <design.sdc> <my.lib> [design.spef] [--mc=N]")
+        print("Example: python3 timing_engine.py design.v gcd design.sdc my.lib design.spef")
+        print("  --mc=N  run N derate samples through the engine instead of cross-checking with OpenSTA")
+        sys.exit(1)
+    if mc_samples:
+        monte_carlo(args[0], args[2], args[3], args[4] if len(args) > 4 else None, mc_samples[0])
+    else:
+        cross_check(*args[:5])